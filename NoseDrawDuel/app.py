@@ -32,6 +32,10 @@ db.init_app(app)
 from multiplayer import multiplayer_bp
 app.register_blueprint(multiplayer_bp, url_prefix='/multiplayer')
 
+# Stage timings, /metrics and sampled traces (see metrics.py in the project root)
+import metrics
+metrics.init_app(app)
+
 # Import main routes
 from flask import render_template
 
@@ -44,3 +48,4 @@ with app.app_context():
     # Import models to ensure tables are created
     import models
     db.create_all()
+    models.upgrade_schema()
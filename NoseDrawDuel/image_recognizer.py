@@ -1,13 +1,12 @@
 import os
 import logging
-import numpy as np
 from PIL import Image
-import cv2
 # REMOVE: from skimage.metrics import structural_similarity as ssim
 # REMOVE: from sklearn.metrics.pairwise import cosine_similarity
 
 # Add import for CNN evaluator
-from cnn_evaluator import evaluate_with_cnn
+from cnn_evaluator import evaluate_with_cnn, rank_labels
+from preprocessing import get_preprocessor
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -20,10 +19,7 @@ class ImageRecognizer:
         """Simple preprocessing: convert to grayscale, resize, and normalize"""
         if not isinstance(image, Image.Image):
             raise ValueError("Input must be a PIL Image.")
-        img = image.convert('L')
-        img = img.resize(size, Image.Resampling.LANCZOS)
-        arr = np.array(img, dtype=np.float32) / 255.0
-        return arr
+        return get_preprocessor(size).run(image).reshape(size[1], size[0])
 
     def load_reference(self, character, size=(100, 100)):
         path = os.path.join(self.reference_path, f'{character}.png')
@@ -35,10 +31,8 @@ class ImageRecognizer:
 
     def evaluate_drawing(self, drawn_image, correct_answer):
         try:
-            # Preprocess image as needed for CNN (e.g., grayscale, resize to 28x28)
-            user_img = self.preprocess(drawn_image, size=(28, 28))
-            # Call CNN evaluator (returns percentage score)
-            percentage = evaluate_with_cnn(user_img, correct_answer)
+            # Call CNN evaluator (returns percentage score); it runs the shared preprocessing itself
+            percentage = evaluate_with_cnn(drawn_image, correct_answer)
             return float(percentage)
         except Exception as e:
             logger.error(f"Recognition error: {e}")
@@ -53,15 +47,11 @@ class ImageRecognizer:
                 image_data = image_data.split(',')[1]
             image_bytes = base64.b64decode(image_data)
             image = Image.open(io.BytesIO(image_bytes))
-            best_score = 0
-            best_shape = None
-            for shape_name in ['A', 'O', '1', '2', '3', 'circle', 'triangle', 'square']:
-                # Preprocess for CNN
-                user_img = self.preprocess(image, size=(28, 28))
-                score = evaluate_with_cnn(user_img, shape_name)
-                if score > best_score:
-                    best_score = score
-                    best_shape = shape_name
+            # Preprocess once and score every candidate from a single forward pass
+            ranked = rank_labels(image, ['A', 'O', '1', '2', '3', 'circle', 'triangle', 'square'])
+            best_shape, best_score = ranked[0]
+            if best_score <= 0:
+                best_score, best_shape = 0, None
             return best_score, best_shape
         except Exception as e:
             logger.error(f"Shape comparison error: {e}")
@@ -2,29 +2,121 @@
 
 from app import db
 from datetime import datetime
+from sqlalchemy import inspect, text
 
 class GameSession(db.Model):
     """Model to track multiplayer game sessions."""
     id = db.Column(db.Integer, primary_key=True)
+    session_key = db.Column(db.String(32), unique=True, index=True)
     player1_name = db.Column(db.String(100), nullable=False, default="Player 1")
     player2_name = db.Column(db.String(100), nullable=False, default="Player 2")
     current_question = db.Column(db.String(500))
+    current_answer = db.Column(db.String(10))
     player1_score = db.Column(db.Float, default=0.0)
     player2_score = db.Column(db.Float, default=0.0)
+    player1_stars = db.Column(db.Integer, default=0)
+    player2_stars = db.Column(db.Integer, default=0)
     current_turn = db.Column(db.Integer, default=1)  # 1 for player1, 2 for player2
     game_status = db.Column(db.String(20), default='waiting')  # waiting, player1_turn, player2_turn, finished
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every compare-and-set
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     def to_dict(self):
         """Convert session to dictionary for JSON responses."""
         return {
             'id': self.id,
+            'session_key': self.session_key,
             'player1_name': self.player1_name,
             'player2_name': self.player2_name,
             'current_question': self.current_question,
             'player1_score': self.player1_score,
             'player2_score': self.player2_score,
+            'player1_stars': self.player1_stars,
+            'player2_stars': self.player2_stars,
             'current_turn': self.current_turn,
-            'game_status': self.game_status
+            'game_status': self.game_status,
+            'version': self.version
         }
 
+
+class DrawingResult(db.Model):
+    """One scored drawing from any mode, written in batches by game_history.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(16), nullable=False)  # single, local, multiplayer, room
+    player_name = db.Column(db.String(100))  # None when the player gave no name
+    session_key = db.Column(db.String(32))
+    question = db.Column(db.String(500))
+    answer = db.Column(db.String(10), nullable=False)
+    level = db.Column(db.Integer)
+    score = db.Column(db.Float, nullable=False)
+    stars = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    # The leaderboard refresh ranks within each of these; /history reads a player's latest
+    __table_args__ = (
+        db.Index('ix_drawing_result_answer_score', 'answer', 'score'),
+        db.Index('ix_drawing_result_player_score', 'player_name', 'score'),
+        db.Index('ix_drawing_result_level_score', 'level', 'score'),
+        db.Index('ix_drawing_result_player_created', 'player_name', 'created_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'mode': self.mode,
+            'player_name': self.player_name,
+            'question': self.question,
+            'answer': self.answer,
+            'level': self.level,
+            'score': round(self.score, 1),
+            'stars': self.stars,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class LeaderboardEntry(db.Model):
+    """Precomputed top scores per question, player and level, rebuilt periodically from DrawingResult."""
+    id = db.Column(db.Integer, primary_key=True)
+    board = db.Column(db.String(16), nullable=False)  # question (keyed by answer), player or level
+    key = db.Column(db.String(100), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    player_name = db.Column(db.String(100))
+    answer = db.Column(db.String(10))
+    level = db.Column(db.Integer)
+    score = db.Column(db.Float, nullable=False)
+    stars = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+    # Unique, so an overlapping rebuild fails instead of leaving every rank twice
+    __table_args__ = (db.Index('ix_leaderboard_entry_board_key_rank', 'board', 'key', 'rank', unique=True),)
+
+    def to_dict(self):
+        return {
+            'rank': self.rank,
+            'player_name': self.player_name,
+            'answer': self.answer,
+            'level': self.level,
+            'score': round(self.score, 1),
+            'stars': self.stars,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+def upgrade_schema():
+    """Add columns introduced after the first release to an existing database (create_all won't)."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        with db.engine.begin() as conn:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column.name == 'version':
+                    conn.execute(text(f'UPDATE {table.name} SET version = 0'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
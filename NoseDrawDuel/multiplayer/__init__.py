@@ -10,4 +10,4 @@ multiplayer_bp = Blueprint(
 )
 
 # Import routes to register them with the blueprint
-from . import routes
+from . import routes, room_routes
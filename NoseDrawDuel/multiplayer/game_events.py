@@ -0,0 +1,135 @@
+"""
+Push updates for game sessions over server-sent events.
+
+Clients open GET /multiplayer/events with EventSource and receive a 'state'
+event every time their session's version changes (turn change, scores,
+winner), instead of asking for the state after every action.
+
+Fan-out works across workers because every change bumps the session's
+version in the shared store. Each worker runs one poller thread that reads
+the versions of all sessions watched in that worker with a single
+SessionStore.versions() call every GAME_EVENTS_POLL_INTERVAL seconds. Changes
+made by the same worker are pushed immediately through notify(). A stream
+closes after GAME_EVENTS_MAX_STREAM seconds and EventSource reconnects,
+resuming from the Last-Event-ID version, so no worker thread is held forever.
+
+Streams hold a worker thread, so run the app with threaded workers
+(e.g. gunicorn --worker-class gthread) or gevent.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+GAME_EVENTS_POLL_INTERVAL = float(os.environ.get('GAME_EVENTS_POLL_INTERVAL', '0.5'))
+GAME_EVENTS_KEEPALIVE = float(os.environ.get('GAME_EVENTS_KEEPALIVE', '15'))
+GAME_EVENTS_MAX_STREAM = float(os.environ.get('GAME_EVENTS_MAX_STREAM', '300'))
+
+logger = logging.getLogger(__name__)
+
+GONE = -1  # version reported for sessions that ended or expired
+
+
+class GameEventHub:
+    """Tracks the latest known version of every watched session in this worker."""
+
+    def __init__(self, poll_interval=GAME_EVENTS_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._versions = {}
+        self._watchers = Counter()
+        self._poller = None
+        self._app = None
+        self._get_store = None
+        self.counters = {'streams': 0, 'events': 0, 'polls': 0, 'poll_errors': 0}
+
+    def _ensure_poller(self, app, get_store):
+        if self._poller is not None and self._poller.is_alive():
+            return
+        self._app, self._get_store = app, get_store
+        self._poller = threading.Thread(target=self._poll_loop, name='game-events-poller', daemon=True)
+        self._poller.start()
+
+    def watch(self, session_id, app, get_store):
+        with self._cond:
+            self._watchers[session_id] += 1
+            self.counters['streams'] += 1
+            self._ensure_poller(app, get_store)
+
+    def unwatch(self, session_id):
+        with self._cond:
+            self._watchers[session_id] -= 1
+            if self._watchers[session_id] <= 0:
+                del self._watchers[session_id]
+                self._versions.pop(session_id, None)
+
+    def _advance(self, session_id, version):
+        # Versions only move forward (or to GONE), so a poll that raced with a
+        # newer notify() can't make streams re-send an older state
+        current = self._versions.get(session_id)
+        if session_id in self._watchers and current != GONE and (
+                current is None or version == GONE or version > current):
+            self._versions[session_id] = version
+            return True
+        return False
+
+    def notify(self, session_id, version):
+        """Record a change made by this worker and wake its streams right away."""
+        with self._cond:
+            if self._advance(session_id, version):
+                self._cond.notify_all()
+
+    def wait(self, session_id, known_version, timeout):
+        """
+        Block until the session moves past known_version or the timeout
+        passes. Returns the latest known version (GONE if the session ended),
+        or None if nothing is known about it yet.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                version = self._versions.get(session_id)
+                if version is not None and (version == GONE or version > known_version):
+                    return version
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return version
+                self._cond.wait(remaining)
+
+    def _poll_loop(self):
+        with self._app.app_context():
+            while True:
+                time.sleep(self.poll_interval)
+                with self._cond:
+                    watched = list(self._watchers)
+                if not watched:
+                    continue
+                try:
+                    versions = self._get_store().versions(watched)
+                except Exception as e:
+                    self.counters['poll_errors'] += 1
+                    logger.warning(f"Polling session versions failed: {e}")
+                    continue
+                self.counters['polls'] += 1
+                with self._cond:
+                    changed = [self._advance(session_id, versions.get(session_id, GONE)) for session_id in watched]
+                    if any(changed):
+                        self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, watched_sessions=len(self._watchers),
+                        open_streams=sum(self._watchers.values()))
+
+
+hub = GameEventHub()
+
+
+def format_event(event, data, event_id=None):
+    """One SSE message; data is already JSON."""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,234 @@
+"""
+HTTP API for N-player rooms and tournaments (see rooms.py).
+
+    POST /multiplayer/rooms                      {"max_players": 30}         -> room
+    POST /multiplayer/rooms/<code>/join          {"name": "Ana"}             -> room, your seat
+    POST /multiplayer/rooms/<code>/start                                     -> room with a new prompt
+    POST /multiplayer/rooms/<code>/submit        drawing in any upload format -> room
+    POST /multiplayer/rooms/<code>/close                                     -> room, scored and ranked
+    GET  /multiplayer/rooms/<code>                                           -> room
+    POST /multiplayer/tournaments                {"players": [...], "room_size": 4}
+    POST /multiplayer/tournaments/<code>/join    {"name": "Ana"}             -> your current room
+    GET  /multiplayer/tournaments/<code>                                     -> bracket
+
+Seats are remembered in the Flask session, so each browser submits for its
+own player. The submit that completes a room scores it, in one batch.
+"""
+import logging
+
+from flask import jsonify, request, session
+
+from . import multiplayer_bp
+from .rooms import RoomCapacityError, RoomError, RoomNotFound, RoomStore
+from admission import Overloaded
+from cnn_evaluator import SCORE_SCALE, get_stars, preprocess_uint8, score_preprocessed
+from drawing_archive import archive as drawing_archive
+from drawing_upload import read_drawing, UploadError
+from game_history import history as game_history
+from inference_pool import InferenceError, InferenceTimeout
+from question_bank import bank as question_bank
+from stage_timing import span
+import metrics
+
+MAX_REMEMBERED_SEATS = 8
+
+logger = logging.getLogger(__name__)
+
+rooms = RoomStore()
+
+metrics.registry.callback('nosedraw_rooms', 'Multiplayer rooms in this worker, by status.',
+                          lambda: {(status,): count for status, count in rooms.stats()['rooms_by_status'].items()},
+                          labels=('status',))
+metrics.registry.callback('nosedraw_room_bytes', 'Approximate memory held by rooms and tournaments.',
+                          lambda: rooms.stats()['bytes'])
+
+
+def pick_question():
+    return question_bank.random_question()
+
+
+def remember_seat(code, seat):
+    seats = dict(session.get('room_seats', {}))
+    seats.pop(code, None)
+    seats[code] = seat
+    # Only the latest rooms matter; keep the session cookie small
+    session['room_seats'] = dict(list(seats.items())[-MAX_REMEMBERED_SEATS:])
+
+
+def seat_in(code):
+    return session.get('room_seats', {}).get(code)
+
+
+def int_field(data, name, default=None, minimum=1):
+    """An integer request field, or default if absent; ValueError if it is not a whole number >= minimum."""
+    value = data.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be a whole number")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+
+def room_response(state):
+    return jsonify(dict(state, success=True, seat=seat_in(state['code'])))
+
+
+def score_room(code):
+    """Score every submitted drawing of a room in one forward pass and rank the room."""
+    batch = rooms.begin_scoring(code)
+    if batch is None:
+        return  # already scored, or being scored by another request
+    players, drawings, answer = batch
+    try:
+        raw = score_preprocessed(drawings, [answer] * len(players)) if players else []
+    except InferenceError:
+        rooms.abort_scoring(code)
+        raise
+    scores = [float(score) * SCORE_SCALE for score in raw]
+    stars = [get_stars(score) for score in scores]
+    for drawing, score, star in zip(drawings, scores, stars):
+        metrics.observe_score('room', score, star)
+        drawing_archive.record(drawing, answer, score, star, 'room', session=code, preprocessed=True)
+    tournament = rooms.finish_scoring(code, players, scores, stars)
+    try:
+        state = rooms.get(code)
+    except RoomNotFound:
+        state = None  # evicted in between; nothing left to name the results by
+    for i, score, star in zip(players, scores, stars if state else ()):
+        game_history.record('room', answer, score, star, player_name=state['players'][i]['name'], session_key=code,
+                            question=state['question'])
+    if tournament is not None:
+        advance(tournament)
+
+
+def advance(code):
+    """Open the next bracket round if it is due; when rooms are full, the next bracket request tries again."""
+    try:
+        rooms.advance(code, pick_question)
+    except RoomCapacityError as e:
+        logger.warning(f"Tournament {code} cannot advance yet: {e}")
+
+
+@multiplayer_bp.errorhandler(RoomNotFound)
+def room_not_found(e):
+    return jsonify({'success': False, 'error': 'No such room or tournament'}), 404
+
+
+@multiplayer_bp.errorhandler(RoomError)
+def room_error(e):
+    return jsonify({'success': False, 'error': str(e)}), 409
+
+
+@multiplayer_bp.errorhandler(RoomCapacityError)
+def room_capacity(e):
+    response = jsonify({'success': False, 'error': 'Too many rooms are open right now, please try again later'})
+    response.headers['Retry-After'] = '60'
+    return response, 503
+
+
+@multiplayer_bp.errorhandler(InferenceError)
+def room_inference_error(e):
+    # Only reached from room routes; the drawings are kept and the room can be closed again
+    metrics.count_error('overloaded' if isinstance(e, Overloaded) else
+                        'inference_timeout' if isinstance(e, InferenceTimeout) else 'inference_unavailable')
+    response = jsonify({'success': False, 'error': 'Scoring is temporarily unavailable, please try again'})
+    if isinstance(e, Overloaded):
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    return response, 504 if isinstance(e, InferenceTimeout) else 503
+
+
+@multiplayer_bp.route('/rooms', methods=['POST'])
+def create_room():
+    data = request.get_json(silent=True) or {}
+    try:
+        max_players = int_field(data, 'max_players')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return room_response(rooms.create(max_players))
+
+
+@multiplayer_bp.route('/rooms/<code>')
+def get_room(code):
+    return room_response(rooms.get(code))
+
+
+@multiplayer_bp.route('/rooms/<code>/join', methods=['POST'])
+def join_room(code):
+    data = request.get_json(silent=True) or {}
+    name = str(data.get('name') or '').strip()[:100]
+    if not name:
+        raise RoomError("A player name is required")
+    remember_seat(code, rooms.join(code, name))
+    return room_response(rooms.get(code))
+
+
+@multiplayer_bp.route('/rooms/<code>/start', methods=['POST'])
+def start_room_round(code):
+    return room_response(rooms.start_round(code, pick_question()))
+
+
+@multiplayer_bp.route('/rooms/<code>/submit', methods=['POST'])
+def submit_room_drawing(code):
+    seat = seat_in(code)
+    if seat is None:
+        raise RoomError("Join the room before submitting")
+    try:
+        with span('decode'):
+            image, _ = read_drawing(request, 'drawing_data')
+    except UploadError as e:
+        metrics.count_error('upload')
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if image is None:
+        return jsonify({'success': False, 'error': 'No drawing data provided'}), 400
+    with span('preprocess'):
+        drawing = preprocess_uint8(image)
+    if rooms.submit(code, seat, drawing):
+        score_room(code)
+    return room_response(rooms.get(code))
+
+
+@multiplayer_bp.route('/rooms/<code>/close', methods=['POST'])
+def close_room_round(code):
+    """End the round now (e.g. when the timer runs out); players who did not submit score 0."""
+    score_room(code)
+    return room_response(rooms.get(code))
+
+
+@multiplayer_bp.route('/tournaments', methods=['POST'])
+def create_tournament():
+    data = request.get_json(silent=True) or {}
+    players = [str(name).strip()[:100] for name in data.get('players') or [] if str(name).strip()]
+    if len(players) < 2:
+        raise RoomError("A tournament needs at least two players")
+    try:
+        room_size = int_field(data, 'room_size', default=4, minimum=2)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify(dict(rooms.create_tournament(players, room_size, pick_question), success=True))
+
+
+@multiplayer_bp.route('/tournaments/<code>')
+def get_tournament(code):
+    advance(code)
+    return jsonify(dict(rooms.tournament(code), success=True))
+
+
+@multiplayer_bp.route('/tournaments/<code>/join', methods=['POST'])
+def join_tournament(code):
+    """Seat a player in their room of the current bracket round."""
+    data = request.get_json(silent=True) or {}
+    name = str(data.get('name') or '').strip()
+    advance(code)
+    current = rooms.seat(code, name)
+    if current is None:
+        return jsonify({'success': True, 'eliminated': True, 'tournament': rooms.tournament(code)})
+    room_code, seat = current
+    remember_seat(room_code, seat)
+    return room_response(rooms.get(room_code))
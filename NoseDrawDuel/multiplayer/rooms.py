@@ -0,0 +1,442 @@
+"""
+N-player rooms and bracket tournaments.
+
+A room holds any number of players (up to ROOM_MAX_PLAYERS) who all draw the
+same prompt at the same time. Each submission is preprocessed right away
+and kept as a 28x28 uint8 tensor. Once every player has submitted, or the
+round is closed, the whole room is scored with one forward pass
+(cnn_evaluator.score_preprocessed) and ranked.
+
+A tournament seeds its players into rooms of room_size. The winner of
+each room advances, and the next round's rooms are opened once every room
+of the current round has finished, until one player is left.
+
+Room state is kept compact so thousands of rooms fit in memory:
+- __slots__ objects;
+- scores in array('f');
+- stars and submitted flags in bytearrays;
+- one uint8 drawing buffer per room, allocated only while a round is
+  being drawn.
+
+The store tracks the approximate size of every room and tournament. When
+the total would pass ROOM_MEMORY_BUDGET_MB, it evicts expired and then
+finished rooms, least recently active first. If that is not enough, it
+refuses new rooms with RoomCapacityError. A tournament's rooms never expire
+or get evicted on their own: activity in any of them keeps the tournament
+alive, and they go when the whole tournament expires. So advance() always
+finds the rooms of the last round. Opening a bracket round is all or
+nothing.
+
+Like MemorySessionStore this is per process: run one worker, or route
+each room code to the same worker.
+"""
+import os
+import secrets
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+ROOM_MAX_PLAYERS = int(os.environ.get('ROOM_MAX_PLAYERS', '40'))
+ROOM_TTL = int(os.environ.get('ROOM_TTL', '7200'))
+ROOM_MEMORY_BUDGET_MB = float(os.environ.get('ROOM_MEMORY_BUDGET_MB', '64'))
+
+DRAWING_SHAPE = (28, 28)
+
+WAITING, DRAWING, SCORING, FINISHED = 'waiting', 'drawing', 'scoring', 'finished'
+
+
+class RoomError(ValueError):
+    """The request does not fit the room's current state (full, wrong phase, unknown player)."""
+
+
+class RoomNotFound(KeyError):
+    """No room or tournament with that code (it may have expired)."""
+
+
+class RoomCapacityError(RuntimeError):
+    """The memory budget for rooms is used up by active rooms."""
+
+
+def new_code():
+    return str(100000 + secrets.randbelow(900000))
+
+
+class Room:
+    __slots__ = ('code', 'names', 'max_players', 'question', 'answer', 'round', 'status', 'version',
+                 'submitted', 'drawings', 'scores', 'stars', 'tournament', 'expires_at')
+
+    def __init__(self, code, max_players, names=(), tournament=None):
+        self.code = code
+        self.names = list(names)
+        self.max_players = max_players
+        self.question = None
+        self.answer = None
+        self.round = 0
+        self.status = WAITING
+        self.version = 0
+        self.submitted = bytearray(len(self.names))
+        self.drawings = None  # (players, 28, 28) uint8 while a round is drawn
+        self.scores = array('f', bytes(4 * len(self.names)))
+        self.stars = bytearray(len(self.names))
+        self.tournament = tournament
+        self.expires_at = 0.0
+
+    def nbytes(self):
+        size = sys.getsizeof(self) + sys.getsizeof(self.names) + sum(sys.getsizeof(n) for n in self.names)
+        size += sys.getsizeof(self.submitted) + sys.getsizeof(self.scores) + sys.getsizeof(self.stars)
+        if self.drawings is not None:
+            size += self.drawings.nbytes
+        return size
+
+    def ranking(self):
+        """Player indices, best score first; earlier seats win ties."""
+        return sorted(range(len(self.names)), key=lambda i: -self.scores[i])
+
+    def public(self):
+        state = {
+            'code': self.code,
+            'round': self.round,
+            'status': self.status,
+            'question': self.question,
+            'players': [{'name': name, 'submitted': bool(self.submitted[i])} for i, name in enumerate(self.names)],
+            'max_players': self.max_players,
+            'tournament': self.tournament,
+            'version': self.version,
+        }
+        if self.status == FINISHED:
+            state['ranking'] = [{'rank': rank + 1, 'player': i, 'name': self.names[i],
+                                 'score': round(self.scores[i], 1), 'stars': self.stars[i]}
+                                for rank, i in enumerate(self.ranking())]
+        return state
+
+
+class Tournament:
+    __slots__ = ('code', 'players', 'room_size', 'rounds', 'champion', 'expires_at')
+
+    def __init__(self, code, players, room_size):
+        self.code = code
+        self.players = list(players)
+        self.room_size = room_size
+        self.rounds = []  # room codes per bracket round
+        self.champion = None
+        self.expires_at = 0.0
+
+    def nbytes(self):
+        size = sys.getsizeof(self) + sys.getsizeof(self.players) + sum(sys.getsizeof(n) for n in self.players)
+        return size + sys.getsizeof(self.rounds) + sum(sys.getsizeof(r) for r in self.rounds)
+
+
+def seed(players, room_size):
+    """Split players into the fewest rooms of at most room_size, sizes differing by at most one."""
+    count = max(1, -(-len(players) // room_size))
+    return [players[i::count] for i in range(count)]
+
+
+class RoomStore:
+    def __init__(self, budget_bytes=int(ROOM_MEMORY_BUDGET_MB * 1024 * 1024), ttl=ROOM_TTL,
+                 max_players=ROOM_MAX_PLAYERS):
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self.max_players = max_players
+        self._rooms = OrderedDict()  # code -> Room, least recently active first
+        self._tournaments = OrderedDict()
+        self._sizes = {}  # code -> accounted bytes, for rooms and tournaments
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.counters = {'rooms_created': 0, 'tournaments_created': 0, 'rounds_scored': 0, 'drawings_scored': 0,
+                         'evicted': 0, 'refused': 0}
+
+    # -- bookkeeping (called with the lock held) --
+
+    def _account(self, key, obj):
+        if key not in self._rooms and key not in self._tournaments:
+            return  # evicted meanwhile; its bytes were already given back
+        size = obj.nbytes()
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _forget(self, key, table):
+        table.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _touch(self, room):
+        room.expires_at = time.monotonic() + self.ttl
+        self._rooms.move_to_end(room.code)
+        tournament = self._tournaments.get(room.tournament)
+        if tournament is not None:
+            self._touch_tournament(tournament)
+
+    def _touch_tournament(self, tournament):
+        tournament.expires_at = time.monotonic() + self.ttl
+        self._tournaments.move_to_end(tournament.code)
+
+    def _expire(self, now):
+        # Both tables are kept in expiry order, so expired entries are at the front
+        while self._tournaments:
+            code, tournament = next(iter(self._tournaments.items()))
+            if tournament.expires_at > now:
+                break
+            for room_code in (c for codes in tournament.rounds for c in codes):
+                self._forget(room_code, self._rooms)
+            self._forget(code, self._tournaments)
+            self.counters['evicted'] += 1
+        while self._rooms:
+            code, room = next(iter(self._rooms.items()))
+            if room.expires_at > now:
+                break
+            if room.tournament in self._tournaments:
+                # Lives as long as its tournament; look again after another TTL
+                room.expires_at = now + self.ttl
+                self._rooms.move_to_end(code)
+                continue
+            self._forget(code, self._rooms)
+            self.counters['evicted'] += 1
+
+    def _make_room_for(self, needed, keep=None):
+        """Evict until needed more bytes fit the budget, never the room coded keep; else RoomCapacityError."""
+        self._expire(time.monotonic())
+        if self._bytes + needed <= self.budget_bytes:
+            return
+        for code in [c for c, room in self._rooms.items()
+                     if room.status == FINISHED and room.tournament is None and c != keep]:
+            self._forget(code, self._rooms)
+            self.counters['evicted'] += 1
+            if self._bytes + needed <= self.budget_bytes:
+                return
+        self.counters['refused'] += 1
+        raise RoomCapacityError(f"room memory budget of {self.budget_bytes} bytes is used up")
+
+    def _new_code(self):
+        code = new_code()
+        while code in self._rooms or code in self._tournaments:
+            code = new_code()
+        return code
+
+    def _room(self, code):
+        room = self._rooms.get(code)
+        if room is None or (room.expires_at <= time.monotonic() and room.tournament not in self._tournaments):
+            raise RoomNotFound(code)
+        return room
+
+    def _create_room(self, names=(), max_players=None, tournament=None):
+        room = Room(self._new_code(), min(max_players or self.max_players, self.max_players), names, tournament)
+        self._make_room_for(room.nbytes())
+        self._rooms[room.code] = room
+        self._touch(room)
+        self._account(room.code, room)
+        self.counters['rooms_created'] += 1
+        return room
+
+    def _start_round(self, room, question):
+        if not room.names:
+            raise RoomError("Nobody has joined the room yet")
+        n = len(room.names)
+        self._make_room_for(n * DRAWING_SHAPE[0] * DRAWING_SHAPE[1], keep=room.code)
+        room.question, room.answer = question['question'], question['answer']
+        room.round += 1
+        room.status = DRAWING
+        room.submitted = bytearray(n)
+        room.scores = array('f', bytes(4 * n))
+        room.stars = bytearray(n)
+        room.drawings = np.zeros((n,) + DRAWING_SHAPE, dtype=np.uint8)
+        room.version += 1
+        self._touch(room)
+        self._account(room.code, room)
+
+    # -- rooms --
+
+    def create(self, max_players=None):
+        with self._lock:
+            return self._create_room(max_players=max_players).public()
+
+    def get(self, code):
+        """Public state of a room; RoomNotFound if it does not exist."""
+        with self._lock:
+            return self._room(code).public()
+
+    def join(self, code, name):
+        """Seat a player in a room that has not started; returns the seat index."""
+        with self._lock:
+            room = self._room(code)
+            if room.tournament is not None:
+                raise RoomError("Tournament rooms are seated by the bracket")
+            if room.status != WAITING:
+                raise RoomError("The round has already started")
+            if len(room.names) >= room.max_players:
+                raise RoomError(f"The room is full ({room.max_players} players)")
+            room.names.append(name)
+            room.submitted.append(0)
+            room.scores.append(0.0)
+            room.stars.append(0)
+            room.version += 1
+            self._touch(room)
+            self._account(room.code, room)
+            return len(room.names) - 1
+
+    def start_round(self, code, question):
+        with self._lock:
+            room = self._room(code)
+            if room.status in (DRAWING, SCORING):
+                raise RoomError("A round is already in progress")
+            self._start_round(room, question)
+            return room.public()
+
+    def submit(self, code, player, drawing):
+        """
+        Keep a preprocessed (28, 28) uint8 drawing for a player; resubmitting
+        replaces it. Returns True once every player has submitted.
+        """
+        with self._lock:
+            room = self._room(code)
+            if room.status != DRAWING:
+                raise RoomError("The room is not accepting drawings")
+            if not 0 <= player < len(room.names):
+                raise RoomError("You are not seated in this room")
+            room.drawings[player] = drawing
+            if not room.submitted[player]:
+                room.submitted[player] = 1
+                room.version += 1
+            self._touch(room)
+            return all(room.submitted)
+
+    def begin_scoring(self, code):
+        """
+        Move a drawing room to scoring and return (players, drawings, answer)
+        for the submitted drawings, or None if someone else is already
+        scoring it. Players who did not submit score 0.
+        """
+        with self._lock:
+            room = self._room(code)
+            if room.status != DRAWING:
+                return None
+            room.status = SCORING
+            players = [i for i, done in enumerate(room.submitted) if done]
+            return players, room.drawings[players], room.answer
+
+    def abort_scoring(self, code):
+        """Scoring failed: reopen the round with the drawings kept, so it can be retried."""
+        with self._lock:
+            room = self._rooms.get(code)
+            if room is not None and room.status == SCORING:
+                room.status = DRAWING
+
+    def finish_scoring(self, code, players, scores, stars):
+        """Store the batch results; returns the tournament code to advance, if any."""
+        with self._lock:
+            room = self._rooms.get(code)
+            if room is None or room.status != SCORING:
+                return None
+            for i, score, star in zip(players, scores, stars):
+                room.scores[i] = score
+                room.stars[i] = star
+            room.status = FINISHED
+            room.drawings = None
+            room.version += 1
+            self._touch(room)
+            self._account(room.code, room)
+            self.counters['rounds_scored'] += 1
+            self.counters['drawings_scored'] += len(players)
+            return room.tournament
+
+    # -- tournaments --
+
+    def create_tournament(self, players, room_size, question_fn):
+        """Seed players into first-round rooms and start them; question_fn() picks each prompt."""
+        if len(set(players)) != len(players):
+            raise RoomError("Player names in a tournament must be unique")
+        with self._lock:
+            tournament = Tournament(self._new_code(), players, max(2, min(room_size, self.max_players)))
+            self._make_room_for(tournament.nbytes())
+            self._tournaments[tournament.code] = tournament
+            self._touch_tournament(tournament)
+            try:
+                self._open_round(tournament, tournament.players, question_fn)
+            except Exception:
+                self._forget(tournament.code, self._tournaments)
+                raise
+            self.counters['tournaments_created'] += 1
+            return self._tournament_state(tournament)
+
+    def _open_round(self, tournament, players, question_fn):
+        """Create and start every room of a bracket round, or none of them."""
+        codes = []
+        try:
+            for group in seed(players, tournament.room_size):
+                room = self._create_room(group, len(group), tournament.code)
+                codes.append(room.code)
+                self._start_round(room, question_fn())
+        except Exception:
+            for code in codes:
+                self._forget(code, self._rooms)
+            raise
+        tournament.rounds.append(codes)
+        self._account(tournament.code, tournament)
+
+    def advance(self, code, question_fn):
+        """
+        Open the next bracket round once every room of the current one has
+        finished; a no-op otherwise, so it can be retried after RoomCapacityError.
+        """
+        with self._lock:
+            tournament = self._tournaments.get(code)
+            if tournament is None or tournament.champion is not None:
+                return
+            rooms = [self._rooms.get(c) for c in tournament.rounds[-1]]
+            if any(room is None or room.status != FINISHED for room in rooms):
+                return
+            winners = [room.names[room.ranking()[0]] for room in rooms]
+            self._touch_tournament(tournament)
+            if len(winners) == 1:
+                tournament.champion = winners[0]
+                self._account(tournament.code, tournament)
+            else:
+                self._open_round(tournament, winners, question_fn)
+
+    def seat(self, code, name):
+        """(room code, seat index) of a player's current tournament room, or None once they are out."""
+        with self._lock:
+            tournament = self._tournaments.get(code)
+            if tournament is None:
+                raise RoomNotFound(code)
+            for room_code in tournament.rounds[-1]:
+                room = self._rooms.get(room_code)
+                if room is not None and name in room.names:
+                    return room_code, room.names.index(name)
+            if name not in tournament.players:
+                raise RoomError(f"{name} is not in this tournament")
+            return None
+
+    def _tournament_state(self, tournament):
+        rounds = []
+        for codes in tournament.rounds:
+            entries = []
+            for room_code in codes:
+                room = self._rooms.get(room_code)
+                if room is None:
+                    continue
+                entry = {'code': room_code, 'status': room.status, 'players': list(room.names)}
+                if room.status == FINISHED:
+                    entry['winner'] = room.names[room.ranking()[0]]
+                entries.append(entry)
+            rounds.append(entries)
+        return {'code': tournament.code, 'players': len(tournament.players), 'room_size': tournament.room_size,
+                'rounds': rounds, 'champion': tournament.champion}
+
+    def tournament(self, code):
+        with self._lock:
+            tournament = self._tournaments.get(code)
+            if tournament is None:
+                raise RoomNotFound(code)
+            return self._tournament_state(tournament)
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for room in self._rooms.values():
+                statuses[room.status] = statuses.get(room.status, 0) + 1
+            return dict(self.counters, rooms=len(self._rooms), tournaments=len(self._tournaments),
+                        rooms_by_status=statuses, bytes=self._bytes, budget_bytes=self.budget_bytes)
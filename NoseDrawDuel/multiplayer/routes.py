@@ -1,28 +1,77 @@
-from flask import render_template, request, jsonify, session
+from flask import render_template, request, jsonify, session, current_app, Response, stream_with_context
 from . import multiplayer_bp
-import random
-import base64
-import io
-from PIL import Image as PILImage
-from cnn_evaluator import evaluate_with_cnn
-from recognizer import ImageRecognizer
-
-# In-memory game sessions (no database needed)
-game_sessions = {}
-
-# Sample questions for children
-QUESTIONS = [
-    {"question": "Draw the number 0", "answer": "0"},
-    {"question": "Draw the number 1", "answer": "1"},
-    {"question": "Draw the number 2", "answer": "2"},
-    {"question": "Draw the number 3", "answer": "3"},
-    {"question": "Draw the number 4", "answer": "4"},
-    {"question": "What is 2 + 2?", "answer": "4"},
-    {"question": "What is 3 + 2?", "answer": "5"},
-    {"question": "How many sides does a triangle have?", "answer": "3"},
-    {"question": "How many legs does a spider have?", "answer": "8"},
-    {"question": "What is 5 + 4?", "answer": "9"}
-]
+from .game_events import GAME_EVENTS_KEEPALIVE, GAME_EVENTS_MAX_STREAM, GONE, format_event, hub
+from .session_store import MemorySessionStore, SQLSessionStore
+import json
+import logging
+import os
+import threading
+import time
+from cnn_evaluator import SCORE_SCALE, evaluate_preprocessed, get_stars, preprocess_uint8
+from drawing_upload import read_drawing, UploadError
+from debug_capture import capturer as debug_capture
+from drawing_archive import archive as drawing_archive
+from game_history import history as game_history
+from question_bank import bank as question_bank
+from inference_pool import InferenceError, InferenceTimeout
+from admission import Overloaded
+from stage_timing import span
+import metrics
+
+# Game session backend: 'memory' (per process) or 'sql' (GameSession table,
+# shared by all workers). Idle sessions expire after GAME_SESSION_TTL seconds.
+GAME_SESSION_STORE = os.environ.get('GAME_SESSION_STORE', 'memory')
+GAME_SESSION_TTL = int(os.environ.get('GAME_SESSION_TTL', '7200'))
+GAME_SESSION_MAX = int(os.environ.get('GAME_SESSION_MAX', '10000'))
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class StaleSubmission(Exception):
+    """The drawing was scored for a turn or round that is no longer the current one."""
+
+
+def get_store():
+    """Create the configured session store on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            # Two first requests must share one store, or sessions created in the other are lost
+            if _store is None:
+                if GAME_SESSION_STORE == 'sql':
+                    try:
+                        from models import GameSession
+                    except ImportError:
+                        from NoseDrawDuel.models import GameSession
+                    _store = SQLSessionStore(current_app.extensions['sqlalchemy'], GameSession,
+                                             ttl=GAME_SESSION_TTL)
+                else:
+                    _store = MemorySessionStore(ttl=GAME_SESSION_TTL, max_sessions=GAME_SESSION_MAX)
+    return _store
+
+
+def read_player(data):
+    """Which player submitted, 1 or 2 (JSON number or form/query string); ValueError otherwise."""
+    player = data.get('player', 1)
+    if isinstance(player, bool) or str(player) not in ('1', '2'):
+        raise ValueError("player must be 1 or 2")
+    return int(player)
+
+
+def check_turn(state, player, answer):
+    """StaleSubmission unless it is player's turn in the round whose answer is answer."""
+    if state['game_status'] != f'player{player}_turn':
+        raise StaleSubmission(f"It is not player {player}'s turn")
+    if state['current_answer'] != answer:
+        raise StaleSubmission("The round has moved on to another question")
+
+
+# Read when /metrics is scraped, inside that request's app context
+metrics.registry.callback('nosedraw_active_game_sessions', 'Multiplayer game sessions that have not expired.',
+                          lambda: get_store().active_count())
 
 
 @multiplayer_bp.route('/')
@@ -39,19 +88,20 @@ def start_game():
         player2_name = data.get('player2_name', 'Player 2')
         
         # Create new game session
-        current_q = random.choice(QUESTIONS)
-        session_id = str(random.randint(100000, 999999))
+        current_q = question_bank.random_question()
         
-        game_sessions[session_id] = {
+        session_id = get_store().create({
             'player1_name': player1_name,
             'player2_name': player2_name,
             'current_question': current_q["question"],
             'current_answer': current_q["answer"],
             'player1_score': 0.0,
             'player2_score': 0.0,
+            'player1_stars': 0,
+            'player2_stars': 0,
             'current_turn': 1,
             'game_status': 'player1_turn'
-        }
+        })
         
         # Store session ID in Flask session
         session['game_session_id'] = session_id
@@ -61,7 +111,8 @@ def start_game():
             'session_id': session_id,
             'current_question': current_q["question"],
             'current_turn': 1,
-            'game_status': 'player1_turn'
+            'game_status': 'player1_turn',
+            'version': 0
         })
         
     except Exception as e:
@@ -72,99 +123,183 @@ def get_game_state():
     """Get current game state."""
     try:
         session_id = session.get('game_session_id')
-        if not session_id or session_id not in game_sessions:
+        game_state = get_store().get(session_id) if session_id else None
+        if game_state is None:
             return jsonify({'success': False, 'error': 'No active game session'})
         
         return jsonify({
             'success': True,
-            'game_state': game_sessions[session_id]
+            'game_state': game_state
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def get_stars(score):
-    if score >= 80:
-        return 5
-    elif score >= 60:
-        return 4
-    elif score >= 40:
-        return 3
-    elif score >= 20:
-        return 2
-    elif score >= 7:
+@multiplayer_bp.route('/events')
+def game_events():
+    """Server-sent events: the session state, pushed every time it changes (see game_events.py)."""
+    session_id = session.get('game_session_id')
+    if not session_id or get_store().get(session_id) is None:
+        return jsonify({'success': False, 'error': 'No active game session'}), 404
+    try:
+        # EventSource sends the last version it saw when it reconnects
+        sent = int(request.headers.get('Last-Event-ID', GONE))
+    except ValueError:
+        sent = GONE
+    app = current_app._get_current_object()
+    
+    def stream(sent):
+        hub.watch(session_id, app, get_store)
+        started = time.monotonic()
+        try:
+            yield 'retry: 1000\n\n'
+            while True:
+                state = get_store().get(session_id)
+                if state is None:
+                    yield format_event('ended', '{}')
+                    return
+                if state['version'] != sent:
+                    sent = state['version']
+                    hub.counters['events'] += 1
+                    yield format_event('state', json.dumps(public_state(state)), sent)
+                hub.notify(session_id, sent)
+                # Sleep until the hub sees a newer version, with keepalive comments meanwhile
+                while True:
+                    remaining = GAME_EVENTS_MAX_STREAM - (time.monotonic() - started)
+                    if remaining <= 0:
+                        return
+                    version = hub.wait(session_id, sent, min(GAME_EVENTS_KEEPALIVE, remaining))
+                    if version == GONE:
+                        yield format_event('ended', '{}')
+                        return
+                    if version is not None and version > sent:
+                        break
+                    yield ': keepalive\n\n'
+        finally:
+            hub.unwatch(session_id)
+    
+    return Response(stream_with_context(stream(sent)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def winner_of(state):
+    """1, 2, 'tie' or None while the round is still being played."""
+    if state['game_status'] != 'finished':
+        return None
+    if state['player1_score'] > state['player2_score']:
         return 1
-    else:
-        return 0
+    if state['player2_score'] > state['player1_score']:
+        return 2
+    return 'tie'
+
+def public_state(state):
+    """Session state as pushed to clients (without the answer)."""
+    payload = {k: v for k, v in state.items() if k != 'current_answer'}
+    payload['player1_score'] = round(state['player1_score'], 1)
+    payload['player2_score'] = round(state['player2_score'], 1)
+    payload['winner'] = winner_of(state)
+    return payload
 
 @multiplayer_bp.route('/submit_drawing', methods=['POST'])
 def submit_drawing():
     """Submit a player's drawing for scoring."""
     try:
         session_id = session.get('game_session_id')
-        if not session_id or session_id not in game_sessions:
+        game_session = get_store().get(session_id) if session_id else None
+        if game_session is None:
             return jsonify({'success': False, 'error': 'No active game session'})
         
-        game_session = game_sessions[session_id]
-        
-        data = request.get_json()
-        drawing_data = data.get('drawing_data')
-        player = data.get('player', 1)
+        # JSON data URL, multipart PNG or raw grayscale bytes (see drawing_upload.py)
+        try:
+            with span('decode'):
+                image, data = read_drawing(request, 'drawing_data')
+        except UploadError as e:
+            metrics.count_error('upload')
+            return jsonify({'success': False, 'error': str(e)}), 400
+        try:
+            player = read_player(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        if not drawing_data:
+        if image is None:
             return jsonify({'success': False, 'error': 'No drawing data provided'})
         
         # Get the correct answer for this question
         correct_answer = game_session['current_answer']
+        # A retried or double-clicked submit, before the model is spent on it
+        check_turn(game_session, player, correct_answer)
         
-        # Convert base64 to PIL Image
-        if drawing_data.startswith('data:image'):
-            drawing_data = drawing_data.split(',')[1]
-        image_bytes = base64.b64decode(drawing_data)
-        pil_image = PILImage.open(io.BytesIO(image_bytes))
-        pil_image.save(f'debug_received_canvas_player{player}.png')  # Save for inspection
+        # Sampled, written off the request thread (see debug_capture.py)
+        debug_capture.capture(session_id, f'player{player}', image)
         # Calculate similarity score using recognizer
-        print(f'Player {player} submitting PIL image for scoring.')
-        score = float(evaluate_with_cnn(pil_image, correct_answer))
-        score = score * 3.43
+        logger.debug(f'Player {player} submitting drawing for scoring.')
+        with span('preprocess'):
+            pixels = preprocess_uint8(image)
+        score = float(evaluate_preprocessed(pixels, correct_answer))
+        score = score * SCORE_SCALE
         stars = get_stars(score)
-        print(f'Player {player} score for target "{correct_answer}": {score} ({stars} stars)')
-        
-        # Update player score
-        if player == 1:
-            game_session['player1_score'] = score
-            game_session['player1_stars'] = stars
-            game_session['current_turn'] = 2
-            game_session['game_status'] = 'player2_turn'
-        else:
-            game_session['player2_score'] = score
-            game_session['player2_stars'] = stars
-            game_session['game_status'] = 'finished'
+        metrics.observe_score('multiplayer', score, stars)
+        logger.debug(f'Player {player} score for target "{correct_answer}": {score} ({stars} stars)')
         
-        # Determine winner if game is finished
-        winner = None
-        if game_session['game_status'] == 'finished':
-            if game_session['player1_score'] > game_session['player2_score']:
-                winner = 1
-            elif game_session['player2_score'] > game_session['player1_score']:
-                winner = 2
+        # Update player score atomically; retried if the other player's submit lands first
+        def apply_score(state):
+            # Checked again on the state being written: the other player or next_question may have landed since
+            check_turn(state, player, correct_answer)
+            if player == 1:
+                state['player1_score'] = score
+                state['player1_stars'] = stars
+                state['current_turn'] = 2
+                state['game_status'] = 'player2_turn'
             else:
-                winner = 'tie'
+                state['player2_score'] = score
+                state['player2_stars'] = stars
+                state['game_status'] = 'finished'
         
-        return jsonify({
-            'success': True,
-            'score': round(score, 1),
-            'stars': stars,
-            'game_status': game_session['game_status'],
-            'current_turn': game_session['current_turn'],
-            'winner': winner,
-            'player1_score': round(game_session['player1_score'], 1),
-            'player2_score': round(game_session['player2_score'], 1),
-            'player1_stars': game_session.get('player1_stars', 0),
-            'player2_stars': game_session.get('player2_stars', 0)
-        })
+        with span('session'):
+            game_session = get_store().update(session_id, apply_score)
+        if game_session is None:
+            return jsonify({'success': False, 'error': 'No active game session'})
+        hub.notify(session_id, game_session['version'])
+        game_history.record('multiplayer', correct_answer, score, stars, player_name=game_session[f'player{player}_name'],
+                            session_key=session_id, question=game_session['current_question'])
+        drawing_archive.record(pixels, correct_answer, score, stars, 'multiplayer', session=session_id,
+                               strokes=data.get('strokes'), preprocessed=True)
         
+        # Determine winner if game is finished
+        winner = winner_of(game_session)
+        
+        with span('response'):
+            return jsonify({
+                'success': True,
+                'score': round(score, 1),
+                'stars': stars,
+                'game_status': game_session['game_status'],
+                'current_turn': game_session['current_turn'],
+                'winner': winner,
+                'player1_score': round(game_session['player1_score'], 1),
+                'player2_score': round(game_session['player2_score'], 1),
+                'player1_stars': game_session.get('player1_stars', 0),
+                'player2_stars': game_session.get('player2_stars', 0),
+                'version': game_session['version']
+            })
+        
+    except StaleSubmission as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Overloaded as e:
+        # Shed by admission control; the turn is not consumed
+        logger.warning(f'Scoring shed for player {player}: {e}')
+        metrics.count_error('overloaded')
+        response = jsonify({'success': False, 'retry_after': e.retry_after,
+                            'error': 'Lots of drawings are being checked right now, please try again in a moment'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    except InferenceError as e:
+        # The turn is not consumed, so the player can simply submit again
+        logger.error(f'Inference failed for player {player}: {e}')
+        status = 504 if isinstance(e, InferenceTimeout) else 503
+        metrics.count_error('inference_timeout' if status == 504 else 'inference_unavailable')
+        return jsonify({'success': False, 'error': 'Scoring is temporarily unavailable, please try again'}), status
     except Exception as e:
+        metrics.count_error('internal')
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @multiplayer_bp.route('/next_question', methods=['POST'])
@@ -172,25 +307,31 @@ def next_question():
     """Start a new round with a different question."""
     try:
         session_id = session.get('game_session_id')
-        if not session_id or session_id not in game_sessions:
-            return jsonify({'success': False, 'error': 'No active game session'})
-        
-        game_session = game_sessions[session_id]
         
         # Reset for new round
-        next_q = random.choice(QUESTIONS)
-        game_session['current_question'] = next_q["question"]
-        game_session['current_answer'] = next_q["answer"]
-        game_session['player1_score'] = 0.0
-        game_session['player2_score'] = 0.0
-        game_session['current_turn'] = 1
-        game_session['game_status'] = 'player1_turn'
+        next_q = question_bank.random_question()
+        
+        def reset_round(state):
+            state['current_question'] = next_q["question"]
+            state['current_answer'] = next_q["answer"]
+            state['player1_score'] = 0.0
+            state['player2_score'] = 0.0
+            state['current_turn'] = 1
+            state['game_status'] = 'player1_turn'
+        
+        game_session = get_store().update(session_id, reset_round) if session_id else None
+        if game_session is None:
+            return jsonify({'success': False, 'error': 'No active game session'})
+        hub.notify(session_id, game_session['version'])
         
         return jsonify({
             'success': True,
             'current_question': game_session['current_question'],
             'game_status': game_session['game_status'],
-            'current_turn': game_session['current_turn']
+            'current_turn': game_session['current_turn'],
+            'player1_score': game_session['player1_score'],
+            'player2_score': game_session['player2_score'],
+            'version': game_session['version']
         })
         
     except Exception as e:
@@ -201,9 +342,10 @@ def end_game():
     """End the current game session."""
     try:
         session_id = session.get('game_session_id')
-        if session_id and session_id in game_sessions:
+        if session_id:
             # Remove the game session
-            del game_sessions[session_id]
+            get_store().delete(session_id)
+            hub.notify(session_id, GONE)
         
         # Clear the session
         session.pop('game_session_id', None)
@@ -0,0 +1,217 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Fields of a game session that the routes read and write
+STATE_FIELDS = (
+    'player1_name', 'player2_name', 'current_question', 'current_answer',
+    'player1_score', 'player2_score', 'player1_stars', 'player2_stars',
+    'current_turn', 'game_status',
+)
+
+
+class SessionConflict(Exception):
+    """Raised when an update keeps losing compare-and-set races."""
+
+
+def new_session_id():
+    return str(100000 + secrets.randbelow(900000))
+
+
+class SessionStore:
+    """
+    Interface shared by the game session backends.
+
+    Every stored session carries a version number. get() returns a copy of
+    the state including 'version'; compare_and_set() only writes if the
+    version is still the one that was read, so two concurrent submits can
+    never overwrite each other's changes.
+    """
+
+    def create(self, state):
+        raise NotImplementedError
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def compare_and_set(self, session_id, expected_version, state):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def versions(self, session_ids):
+        """{session_id: version} for the sessions that still exist, in one lookup."""
+        raise NotImplementedError
+
+    def active_count(self):
+        """Number of sessions that have not expired."""
+        raise NotImplementedError
+
+    def update(self, session_id, mutate, retries=5):
+        """
+        Read-modify-write a session with optimistic locking.
+
+        mutate receives a copy of the state and changes it in place. Returns
+        the new state, or None if the session does not exist.
+        """
+        for _ in range(retries):
+            state = self.get(session_id)
+            if state is None:
+                return None
+            version = state['version']
+            mutate(state)
+            if self.compare_and_set(session_id, version, state):
+                state['version'] = version + 1
+                return state
+        raise SessionConflict(f"Too many concurrent updates to session {session_id}")
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process store with idle expiry (TTL) and a least-recently-used size cap."""
+
+    def __init__(self, ttl=7200, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (state, version, expires_at)
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        expired = [sid for sid, (_, _, expires_at) in self._sessions.items() if expires_at <= now]
+        for sid in expired:
+            del self._sessions[sid]
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def create(self, state):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session_id = new_session_id()
+            while session_id in self._sessions:
+                session_id = new_session_id()
+            self._sessions[session_id] = (dict(state), 0, now + self.ttl)
+        return session_id
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            state, version, expires_at = entry
+            if expires_at <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (state, version, now + self.ttl)
+            self._sessions.move_to_end(session_id)
+            return dict(state, version=version)
+
+    def compare_and_set(self, session_id, expected_version, state):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] != expected_version:
+                return False
+            new_state = {k: v for k, v in state.items() if k != 'version'}
+            self._sessions[session_id] = (new_state, expected_version + 1, now + self.ttl)
+            self._sessions.move_to_end(session_id)
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def versions(self, session_ids):
+        # Watching a session must not keep it alive, so the TTL is not refreshed here
+        now = time.monotonic()
+        with self._lock:
+            entries = ((sid, self._sessions.get(sid)) for sid in session_ids)
+            return {sid: entry[1] for sid, entry in entries if entry is not None and entry[2] > now}
+
+    def active_count(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for _, _, expires_at in self._sessions.values() if expires_at > now)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLSessionStore(SessionStore):
+    """
+    Store backed by the GameSession SQLAlchemy model, shared by every worker
+    that points at the same database. compare_and_set is a single
+    UPDATE ... WHERE version = :expected, so the database serializes turns.
+    """
+
+    def __init__(self, db, model, ttl=7200):
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+
+    def _cutoff(self):
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def create(self, state):
+        model = self.model
+        self.db.session.execute(self.db.delete(model).where(model.updated_at < self._cutoff()))
+        for _ in range(10):
+            session_id = new_session_id()
+            if self.db.session.execute(self.db.select(model.id).where(model.session_key == session_id)).first() is None:
+                break
+        row = model(session_key=session_id, version=0, updated_at=datetime.utcnow(),
+                    **{k: state[k] for k in STATE_FIELDS if k in state})
+        self.db.session.add(row)
+        self.db.session.commit()
+        return session_id
+
+    def get(self, session_id):
+        model = self.model
+        row = self.db.session.execute(
+            self.db.select(model).where(model.session_key == session_id, model.updated_at >= self._cutoff())
+        ).scalar_one_or_none()
+        if row is None:
+            return None
+        state = {k: getattr(row, k) for k in STATE_FIELDS}
+        state['version'] = row.version
+        # Don't keep ORM instances around between requests, and don't leave the
+        # read transaction open in long-lived callers such as event streams
+        self.db.session.expunge(row)
+        self.db.session.rollback()
+        return state
+
+    def compare_and_set(self, session_id, expected_version, state):
+        model = self.model
+        values = {k: state[k] for k in STATE_FIELDS if k in state}
+        result = self.db.session.execute(
+            self.db.update(model)
+            .where(model.session_key == session_id, model.version == expected_version)
+            .values(version=expected_version + 1, updated_at=datetime.utcnow(), **values)
+        )
+        self.db.session.commit()
+        return result.rowcount == 1
+
+    def delete(self, session_id):
+        self.db.session.execute(self.db.delete(self.model).where(self.model.session_key == session_id))
+        self.db.session.commit()
+
+    def versions(self, session_ids):
+        model = self.model
+        rows = self.db.session.execute(
+            self.db.select(model.session_key, model.version)
+            .where(model.session_key.in_(list(session_ids)), model.updated_at >= self._cutoff())
+        ).all()
+        # End the read transaction so the next poll sees other workers' commits
+        self.db.session.rollback()
+        return {key: version for key, version in rows}
+
+    def active_count(self):
+        model = self.model
+        count = self.db.session.execute(
+            self.db.select(self.db.func.count(model.id)).where(model.updated_at >= self._cutoff())
+        ).scalar_one()
+        self.db.session.rollback()
+        return count
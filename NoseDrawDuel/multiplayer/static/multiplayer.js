@@ -15,6 +15,8 @@ class MultiplayerNoseGame {
         this.noseTracker1 = null;
         this.noseTracker2 = null;
         this.currentNoseTracker = null;
+        this.strokes = {}; // canvas id -> polylines drawn so far
+        this.events = null; // EventSource for pushed game state
         
         this.initializeGame();
     }
@@ -199,6 +201,34 @@ class MultiplayerNoseGame {
         ctx.moveTo(x1, y1);
         ctx.lineTo(x2, y2);
         ctx.stroke();
+        this.recordStrokeSegment(canvas.id, x1, y1, x2, y2);
+    }
+
+    recordStrokeSegment(canvasId, x1, y1, x2, y2) {
+        // Start a new polyline whenever the segment doesn't continue the last one
+        const strokes = this.strokes[canvasId] || (this.strokes[canvasId] = []);
+        const current = strokes[strokes.length - 1];
+        const last = current && current[current.length - 1];
+        if (!last || last[0] !== x1 || last[1] !== y1) {
+            strokes.push([[x1, y1], [x2, y2]]);
+        } else {
+            current.push([x2, y2]);
+        }
+    }
+
+    encodeStrokes(strokes) {
+        // Delta-encode as flat integer lists: [x0, y0, dx1, dy1, ...]
+        return strokes.map(points => {
+            const flat = [];
+            let px = 0, py = 0;
+            points.forEach(([x, y]) => {
+                const rx = Math.round(x), ry = Math.round(y);
+                flat.push(rx - px, ry - py);
+                px = rx;
+                py = ry;
+            });
+            return flat;
+        });
     }
 
     async startGame() {
@@ -227,7 +257,8 @@ class MultiplayerNoseGame {
                     current_turn: data.current_turn,
                     game_status: data.game_status,
                     player1_name: player1Name,
-                    player2_name: player2Name
+                    player2_name: player2Name,
+                    version: data.version
                 };
                 
                 this.updatePlayerNames(player1Name, player2Name);
@@ -235,6 +266,7 @@ class MultiplayerNoseGame {
                 this.switchToGameScreen();
                 this.setupCamera();
                 this.startPlayerTurn();
+                this.subscribeToGameEvents();
             } else {
                 this.showAlert('Error starting game: ' + data.error, 'danger');
             }
@@ -249,6 +281,57 @@ class MultiplayerNoseGame {
         }
     }
 
+    subscribeToGameEvents() {
+        // Turn changes, scores and the winner are pushed by the server as they happen
+        this.closeGameEvents();
+        if (!window.EventSource) return;
+        this.events = new EventSource('/multiplayer/events');
+        this.events.addEventListener('state', (event) => {
+            this.applyGameState(JSON.parse(event.data));
+        });
+        this.events.addEventListener('ended', () => this.closeGameEvents());
+    }
+
+    closeGameEvents() {
+        if (this.events) {
+            this.events.close();
+            this.events = null;
+        }
+    }
+
+    applyGameState(state) {
+        // Pushed events and POST responses carry the same updates; apply each version once
+        if (!this.gameState || state.version === undefined || state.version <= this.gameState.version) return;
+        
+        const wasFinished = this.gameState.game_status === 'finished';
+        const roundChanged = state.current_turn !== this.gameState.current_turn ||
+            state.game_status !== this.gameState.game_status ||
+            (state.current_question !== undefined && state.current_question !== this.gameState.current_question);
+        
+        this.gameState.version = state.version;
+        this.gameState.current_turn = state.current_turn;
+        this.gameState.game_status = state.game_status;
+        if (state.current_question !== undefined) {
+            this.gameState.current_question = state.current_question;
+            this.updateQuestion(state.current_question);
+        }
+        if (state.player1_score !== undefined) {
+            document.getElementById('player1-score').textContent = Math.round(state.player1_score);
+            document.getElementById('player2-score').textContent = Math.round(state.player2_score);
+        }
+        
+        if (state.game_status === 'finished') {
+            if (!wasFinished) {
+                clearInterval(this.timer);
+                this.isTracking = false;
+                this.showResults(state);
+            }
+        } else if (roundChanged) {
+            this.switchToGameScreen();
+            this.startPlayerTurn();
+        }
+    }
+
     updatePlayerNames(player1Name, player2Name) {
         document.getElementById('player1-display').textContent = player1Name;
         document.getElementById('player2-display').textContent = player2Name;
@@ -477,33 +560,51 @@ class MultiplayerNoseGame {
         try {
             // Get the correct canvas for the player
             const canvas = document.getElementById(`player${currentPlayer}-canvas`);
-            const drawingData = canvas.toDataURL('image/png');
-            
-            const response = await fetch('/multiplayer/submit_drawing', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    drawing_data: drawingData,
-                    player: currentPlayer
-                })
-            });
+            const ctx = canvas.getContext('2d');
+            const strokes = this.strokes[canvas.id] || [];
+            
+            let response;
+            if (strokes.length > 0) {
+                // Send the stroke polylines; the server rasterizes them directly
+                response = await fetch('/multiplayer/submit_drawing', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        strokes: this.encodeStrokes(strokes),
+                        // The server draws the strokes on a canvas like this one, so they score like the image
+                        canvas: [canvas.width, canvas.height],
+                        pen: ctx.lineWidth,
+                        ink: ctx.strokeStyle,
+                        player: currentPlayer
+                    })
+                });
+            } else {
+                // Send a 28x28 grayscale buffer (784 bytes) instead of a base64 PNG
+                response = await fetch(`/multiplayer/submit_drawing?player=${currentPlayer}`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Image-Width': '28',
+                        'X-Image-Height': '28'
+                    },
+                    body: this.canvasToGrayscale(canvas, 28)
+                });
+            }
             
             const data = await response.json();
             
             if (data.success) {
-                // Update scores
-                document.getElementById(`player${currentPlayer}-score`).textContent = Math.round(data.score);
-                
-                if (data.game_status === 'finished') {
-                    this.showResults(data);
-                } else {
-                    // Switch to next player
-                    this.gameState.current_turn = data.current_turn;
-                    this.gameState.game_status = data.game_status;
-                    this.startPlayerTurn();
-                }
+                // Scores, next turn or results; a no-op if the pushed event got here first
+                this.applyGameState(data);
+            } else if (data.retry_after) {
+                // The server is shedding load; the turn is kept, so re-enable the buttons after the wait
+                this.showAlert(data.error, 'warning');
+                setTimeout(() => {
+                    if (submitBtn) submitBtn.disabled = false;
+                    if (clearBtn) clearBtn.disabled = false;
+                }, data.retry_after * 1000);
             } else {
                 this.showAlert('Error submitting drawing: ' + data.error, 'danger');
             }
@@ -580,6 +681,67 @@ class MultiplayerNoseGame {
         }, 3000);
     }
 
+    canvasToGrayscale(canvas, size) {
+        // Downsample the whole canvas the way the server's Preprocessor.resize does:
+        // PIL convert('L') luminance over white, a box reduction by the largest whole
+        // factor, then an area-weighted resize, so raw uploads match the image path
+        const width = canvas.width, height = canvas.height;
+        const rgba = canvas.getContext('2d').getImageData(0, 0, width, height).data;
+        const factor = Math.max(1, Math.min(Math.floor(height / size), Math.floor(width / size)));
+        const w = Math.floor(width / factor), h = Math.floor(height / factor);
+        const left = Math.floor((width - w * factor) / 2), top = Math.floor((height - h * factor) / 2);
+        const reduced = new Float64Array(w * h);
+        for (let y = 0; y < h * factor; y++) {
+            const row = (top + y) * width + left;
+            const out = Math.floor(y / factor) * w;
+            for (let x = 0; x < w * factor; x++) {
+                const i = (row + x) * 4;
+                const luma = Math.floor((rgba[i] * 299 + rgba[i + 1] * 587 + rgba[i + 2] * 114 + 500) / 1000);
+                // Transparent pixels are white background
+                reduced[out + Math.floor(x / factor)] += 255 - (255 - luma) * rgba[i + 3] / 255;
+            }
+        }
+        for (let i = 0; i < reduced.length; i++) {
+            reduced[i] = Math.round(reduced[i] / (factor * factor));
+        }
+        return this.areaResize(reduced, w, h, size);
+    }
+
+    areaResize(src, w, h, size) {
+        // Area-weighted resize of a w x h grayscale array to size x size (cv2's INTER_AREA when shrinking)
+        const spans = n => {
+            const scale = n / size;
+            return Array.from({ length: size }, (_, o) => {
+                const start = o * scale, end = start + scale, span = [];
+                for (let i = Math.floor(start); i < Math.min(n, Math.ceil(end)); i++) {
+                    const overlap = Math.min(end, i + 1) - Math.max(start, i);
+                    if (overlap > 1e-9) {
+                        span.push([i, overlap / scale]);
+                    }
+                }
+                return span;
+            });
+        };
+        const xs = spans(w), ys = spans(h);
+        const rows = new Float64Array(h * size);
+        for (let y = 0; y < h; y++) {
+            for (let x = 0; x < size; x++) {
+                let v = 0;
+                xs[x].forEach(([i, weight]) => { v += src[y * w + i] * weight; });
+                rows[y * size + x] = v;
+            }
+        }
+        const gray = new Uint8Array(size * size);
+        for (let y = 0; y < size; y++) {
+            for (let x = 0; x < size; x++) {
+                let v = 0;
+                ys[y].forEach(([i, weight]) => { v += rows[i * size + x] * weight; });
+                gray[y * size + x] = Math.round(v);
+            }
+        }
+        return gray;
+    }
+
     clearCanvas(player = null) {
         if (!this.gameState) return;
         
@@ -593,6 +755,7 @@ class MultiplayerNoseGame {
         if (canvas) {
             const ctx = canvas.getContext('2d');
             ctx.clearRect(0, 0, canvas.width, canvas.height);
+            this.strokes[canvas.id] = [];
         }
     }
 
@@ -616,13 +779,7 @@ class MultiplayerNoseGame {
             const data = await response.json();
             
             if (data.success) {
-                this.gameState.current_question = data.current_question;
-                this.gameState.game_status = data.game_status;
-                this.gameState.current_turn = data.current_turn;
-                
-                this.updateQuestion(data.current_question);
-                this.switchToGameScreen();
-                this.startPlayerTurn();
+                this.applyGameState(data);
             } else {
                 this.showAlert('Error starting next question: ' + data.error, 'danger');
             }
@@ -640,6 +797,7 @@ class MultiplayerNoseGame {
     }
 
     async endGame() {
+        this.closeGameEvents();
         try {
             await fetch('/multiplayer/end_game', {
                 method: 'POST',
@@ -19,25 +19,19 @@ class ScoreEvaluator:
         Evaluate a single drawing against the target shape.
         
         Args:
-            drawing_data: Base64 encoded image data of the drawing
+            drawing_data: Base64 encoded image data of the drawing, or an
+                already decoded PIL image
             target_shape: String description of the target shape
             
         Returns:
             float: Score between 0 and 100
         """
         try:
-            # Preprocess and decode image as needed, then use CNN evaluator
-            import base64
-            import io
-            from PIL import Image
-            if drawing_data.startswith('data:image'):
-                drawing_data = drawing_data.split(',')[1]
-            image_bytes = base64.b64decode(drawing_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            # Preprocess for CNN (28x28)
-            from recognizer import ImageRecognizer
-            user_img = ImageRecognizer().preprocess(image, size=(28, 28))
-            score = evaluate_with_cnn(user_img, target_shape)
+            # Decode image as needed, then use CNN evaluator
+            from drawing_upload import decode_data_url
+            image = decode_data_url(drawing_data) if isinstance(drawing_data, str) else drawing_data
+            # evaluate_with_cnn runs the shared preprocessing (preprocessing.py)
+            score = evaluate_with_cnn(image, target_shape)
             self.logger.debug(f"Drawing evaluated with score: {score}")
             return score
         except Exception as e:
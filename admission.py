@@ -0,0 +1,120 @@
+"""
+Admission control for CNN inference.
+
+At most INFERENCE_MAX_CONCURRENCY requests run the model at once (0 picks a
+default from the backend, see cnn_evaluator.py); up to INFERENCE_MAX_QUEUE
+more wait for a slot. A request is shed with Overloaded instead of queued
+when the queue is full, or when the expected wait - its place in the queue
+times the recent model time, spread over the slots - is already longer than
+INFERENCE_QUEUE_TIMEOUT seconds. A queued request that still has no slot at
+the deadline is shed too. The routes answer Overloaded with 503 and a
+Retry-After header, so a burst of submissions costs some children a quick
+"try again" instead of multi-second waits for everyone.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from inference_pool import InferenceError
+from stage_timing import span
+
+INFERENCE_MAX_CONCURRENCY = int(os.environ.get('INFERENCE_MAX_CONCURRENCY', '0'))
+INFERENCE_MAX_QUEUE = int(os.environ.get('INFERENCE_MAX_QUEUE', '32'))
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get('INFERENCE_QUEUE_TIMEOUT', '2'))
+
+EWMA_ALPHA = 0.2
+
+
+class Overloaded(InferenceError):
+    """Too much inference work queued; retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency, max_queue=INFERENCE_MAX_QUEUE, queue_timeout=INFERENCE_QUEUE_TIMEOUT):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._service_time = None  # EWMA of seconds spent holding a slot
+        self.counters = {'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_deadline': 0, 'shed_timeout': 0}
+        self.max_waiting = 0
+        self.queue_wait_seconds = 0.0
+
+    def _expected_wait(self, position):
+        if self._service_time is None:
+            return 0.0
+        return position * self._service_time / self.max_concurrency
+
+    def _retry_after(self):
+        # Whole seconds (as HTTP wants), long enough for the current queue to drain
+        return max(1, math.ceil(self._expected_wait(self._waiting + 1)))
+
+    def _shed(self, reason, message):
+        self.counters[reason] += 1
+        raise Overloaded(message, self._retry_after())
+
+    def acquire(self):
+        """Wait for a slot; raises Overloaded instead of waiting past the deadline."""
+        with self._cond:
+            if self._running < self.max_concurrency and self._waiting == 0:
+                self._running += 1
+                self.counters['admitted'] += 1
+                return
+            if self._waiting >= self.max_queue:
+                self._shed('shed_queue_full', f"inference queue is full ({self._waiting} waiting)")
+            if self._expected_wait(self._waiting + 1) > self.queue_timeout:
+                self._shed('shed_deadline', f"expected inference wait exceeds {self.queue_timeout}s")
+            self._waiting += 1
+            self.counters['queued'] += 1
+            self.max_waiting = max(self.max_waiting, self._waiting)
+            start = time.monotonic()
+            deadline = start + self.queue_timeout
+            try:
+                while self._running >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._shed('shed_timeout', f"no inference slot within {self.queue_timeout}s")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+                self.queue_wait_seconds += time.monotonic() - start
+            self._running += 1
+            self.counters['admitted'] += 1
+
+    def release(self, service_time):
+        with self._cond:
+            self._running -= 1
+            if self._service_time is None:
+                self._service_time = service_time
+            else:
+                self._service_time += EWMA_ALPHA * (service_time - self._service_time)
+            # Wake every waiter: one that is about to give up must not swallow the wakeup
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of the block; time spent waiting is timed as 'queue'."""
+        with span('queue'):
+            self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self):
+        with self._cond:
+            shed = self.counters['shed_queue_full'] + self.counters['shed_deadline'] + self.counters['shed_timeout']
+            return dict(self.counters, shed=shed, running=self._running, queue_depth=self._waiting,
+                        max_queue_depth=self.max_waiting, max_concurrency=self.max_concurrency,
+                        max_queue=self.max_queue, queue_timeout=self.queue_timeout,
+                        queue_wait_seconds=round(self.queue_wait_seconds, 4),
+                        service_time_ms=round(self._service_time * 1000, 3) if self._service_time else None)
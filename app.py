@@ -1,46 +1,139 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify
+import startup
+from flask import Flask, render_template, request, jsonify, url_for
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-import json
-import base64
-from PIL import Image
-import io
-from recognizer import ImageRecognizer
-from cnn_evaluator import evaluate_with_cnn
+from drawing_upload import read_drawing, UploadError
+from stroke_raster import StrokeError, parse_canvas
+from cnn_evaluator import (CORRECT_THRESHOLD, SCORE_SCALE, STAR_THRESHOLDS, TOP_K_CREDIT, evaluate_preprocessed,
+                           get_stars, preprocess_uint8, warm_up, model_info, model_status, result_cache, admission)
+from admission import Overloaded
+from debug_capture import capturer as debug_capture
+from drawing_archive import archive as drawing_archive
+from game_history import BOARDS, LEADERBOARD_SIZE, history as game_history
+from live_scoring import LIVE_SCORE_HZ, LiveNotFound, LiveSequenceError, live_scorer
+from local_scoring import local_scoring
+from question_bank import QUESTIONS_PER_PAGE_MAX, bank as question_bank
+from inference_pool import InferenceError, InferenceTimeout
+import metrics
+from stage_timing import span
+
+startup.checkpoint('imports')
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
+class Base(DeclarativeBase):
+    pass
+
+db = SQLAlchemy(model_class=Base)
+
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "nosedraw_secret_key_for_development")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Initialize image recognizer
-recognizer = ImageRecognizer()
-
-# Load questions
-with open('questions.json', 'r') as f:
-    questions_data = json.load(f)
+# Configure the database (used by the multiplayer session store when GAME_SESSION_STORE=sql)
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///nose_game.db")
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_recycle": 300,
+    "pool_pre_ping": True,
+}
+db.init_app(app)
+startup.checkpoint('app')
 
 # Register the multiplayer blueprint from NoseDrawDuel
 from NoseDrawDuel.multiplayer import multiplayer_bp
+from NoseDrawDuel.multiplayer.game_events import hub as game_events
+from NoseDrawDuel.multiplayer.room_routes import rooms as game_rooms
 app.register_blueprint(multiplayer_bp, url_prefix='/multiplayer')
+startup.checkpoint('blueprints')
 
-def get_stars(score):
-    if score >= 80:
-        return 5
-    elif score >= 60:
-        return 4
-    elif score >= 40:
-        return 3
-    elif score >= 20:
-        return 2
-    elif score >= 7:
-        return 1
-    else:
-        return 0
+# Stage timings, /metrics and sampled traces (see metrics.py)
+metrics.init_app(app)
+metrics.registry.callback('nosedraw_model_loaded', 'Whether the CNN is loaded.', lambda: int(model_status()[0]))
+metrics.registry.callback('nosedraw_ready', 'Whether startup warm-up has finished (see /health/ready).',
+                          lambda: int(startup.status() == 'ready'))
+metrics.registry.callback('nosedraw_model_warm', 'Whether the CNN has run its warm-up prediction.',
+                          lambda: int(model_status()[1]))
+
+def result_cache_lookups():
+    stats = result_cache.stats()
+    return {('hit',): stats['hits'], ('miss',): stats['misses']}
+
+metrics.registry.callback('nosedraw_result_cache_lookups_total', 'Result cache lookups.', result_cache_lookups,
+                          labels=('result',), type='counter')
+metrics.registry.callback('nosedraw_inference_queue_depth', 'Requests waiting for an inference slot.',
+                          lambda: admission.stats()['queue_depth'])
+metrics.registry.callback('nosedraw_inference_running', 'Requests holding an inference slot.',
+                          lambda: admission.stats()['running'])
+
+def inference_shed():
+    stats = admission.stats()
+    return {(reason,): stats[f'shed_{reason}'] for reason in ('queue_full', 'deadline', 'timeout')}
+
+metrics.registry.callback('nosedraw_inference_shed_total', 'Requests rejected by admission control.', inference_shed,
+                          labels=('reason',), type='counter')
+def local_scores():
+    stats = local_scoring.stats()
+    return {(outcome,): stats[outcome] for outcome in ('trusted', 'verified', 'mismatches', 'verify_skipped')}
+
+metrics.registry.callback('nosedraw_local_scores_total', 'Browser-scored drawings, by what the server did with them.',
+                          local_scores, labels=('outcome',), type='counter')
+metrics.registry.callback('nosedraw_live_predictions_total', 'Running-score predictions for drawings in progress.',
+                          lambda: live_scorer.stats()['predictions'], type='counter')
+def history_rows():
+    stats = game_history.stats()
+    return {(outcome,): stats[outcome] for outcome in ('written', 'dropped')}
+
+metrics.registry.callback('nosedraw_history_rows_total', 'Game results written to the history, or dropped.',
+                          history_rows, labels=('outcome',), type='counter')
+metrics.registry.callback('nosedraw_history_pending', 'Game results waiting to be written.',
+                          lambda: game_history.stats()['pending'])
+metrics.registry.callback('nosedraw_archived_drawings_total', 'Drawings appended to the drawing archive.',
+                          lambda: drawing_archive.stats()['written'], type='counter')
+metrics.registry.callback('nosedraw_game_event_streams', 'Open game event streams in this worker.',
+                          lambda: game_events.stats()['open_streams'])
+
+with app.app_context():
+    # Import models to ensure tables are created
+    from NoseDrawDuel import models
+    db.create_all()
+    models.upgrade_schema()
+# Scored drawings are written in batches off the request threads (see game_history.py)
+game_history.init_app(app, db, models.DrawingResult, models.LeaderboardEntry)
+startup.checkpoint('database')
+
+# Load the CNN and run one predict off the import path; /health/ready waits for it (see startup.py)
+startup.warm_up(warm_up)
+
+def read_level(data):
+    """The drawing's level from the request body (default 1); ValueError unless it is a positive integer"""
+    level = data.get('level', 1)
+    if isinstance(level, bool) or not isinstance(level, (int, str)):
+        raise ValueError('level must be a positive integer')
+    try:
+        level = int(level)
+    except ValueError:
+        raise ValueError('level must be a positive integer') from None
+    if level < 1:
+        raise ValueError('level must be a positive integer')
+    return level
+
+def drawing_result(similarity_score, level):
+    """The /evaluate response body for a scaled score"""
+    stars = get_stars(similarity_score)
+    # Use the scaled similarity_score for correctness
+    is_correct = similarity_score >= CORRECT_THRESHOLD
+    return {
+        'is_correct': bool(is_correct),
+        'stars': stars,
+        'score': similarity_score,
+        'level': level,
+        'feedback': 'Great job!' if is_correct else 'Try again! You can do it!'
+    }
 
 @app.route('/')
 def home():
@@ -52,53 +145,236 @@ def play():
 
 @app.route('/questions')
 def get_questions():
-    """Get all questions for the game"""
-    return jsonify(questions_data)
+    """Get the questions for the game, optionally ?level=, ?type= and ?page=&per_page= (see question_bank.py)"""
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', type=int)
+    return question_bank.respond(
+        request,
+        level=request.args.get('level', type=int),
+        type=request.args.get('type') or None,
+        page=max(1, page) if page is not None else None,
+        per_page=min(max(1, per_page), QUESTIONS_PER_PAGE_MAX) if per_page is not None else None,
+    )
 
 @app.route('/evaluate', methods=['POST'])
 def evaluate_drawing():
     """Evaluate the drawn image against the correct answer"""
     try:
-        data = request.get_json()
+        # JSON data URL, multipart PNG or raw grayscale bytes (see drawing_upload.py)
+        try:
+            with span('decode'):
+                image, data = read_drawing(request, 'image')
+        except UploadError as e:
+            metrics.count_error('upload')
+            return jsonify({'error': str(e)}), 400
         
-        if not data or 'image' not in data or 'answer' not in data:
+        if image is None or 'answer' not in data:
             return jsonify({'error': 'Missing image or answer data'}), 400
         
-        # Decode base64 image
-        image_data = data['image'].split(',')[1]  # Remove data:image/png;base64, prefix
-        image_bytes = base64.b64decode(image_data)
-        
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
-        
         # Get the correct answer and level
         correct_answer = data['answer'].upper()
-        level = data.get('level', 1)
+        try:
+            level = read_level(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Evaluate the drawing
-        similarity_score = evaluate_with_cnn(image, correct_answer)
-        similarity_score = similarity_score * 3.43  # Scale score as in multiplayer
-        stars = get_stars(similarity_score)
-        # Use the scaled similarity_score for correctness
-        is_correct = similarity_score >= 20
-        response = {
-            'is_correct': bool(is_correct),
-            'stars': stars,
-            'score': similarity_score,
-            'level': level,
-            'feedback': 'Great job!' if is_correct else 'Try again! You can do it!'
-        }
+        # Evaluate the drawing; the model input is kept for the archive
+        with span('preprocess'):
+            pixels = preprocess_uint8(image)
+        similarity_score = evaluate_preprocessed(pixels, correct_answer)
+        similarity_score = similarity_score * SCORE_SCALE  # Scale score as in multiplayer
+        local_scoring.server_evaluation()
+        response = drawing_result(similarity_score, level)
+        stars, is_correct = response['stars'], response['is_correct']
+        metrics.observe_score('single', similarity_score, stars)
+        game_history.record('single', correct_answer, similarity_score, stars, player_name=data.get('player_name'),
+                            level=level)
+        drawing_archive.record(pixels, correct_answer, similarity_score, stars, 'single', strokes=data.get('strokes'),
+                               preprocessed=True)
         app.logger.info(f"Evaluated drawing for '{correct_answer}' (Level {level}): stars={stars}, correct={is_correct}")
-        return jsonify(response)
+        with span('response'):
+            return jsonify(response)
         
+    except Overloaded as e:
+        # Shed by admission control: answer quickly and tell the client when to retry
+        app.logger.warning(f"Evaluation shed: {str(e)}")
+        metrics.count_error('overloaded')
+        response = jsonify({'error': 'Lots of drawings are being checked right now, please try again in a moment'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    except InferenceError as e:
+        app.logger.error(f"Inference failed: {str(e)}")
+        status = 504 if isinstance(e, InferenceTimeout) else 503
+        metrics.count_error('inference_timeout' if status == 504 else 'inference_unavailable')
+        return jsonify({'error': 'Scoring is temporarily unavailable, please try again'}), status
     except Exception as e:
         app.logger.error(f"Error evaluating drawing: {str(e)}")
+        metrics.count_error('internal')
         return jsonify({'error': 'Failed to evaluate drawing'}), 500
 
+@app.route('/evaluate_local/config')
+def local_scoring_config():
+    """Whether the browser should score drawings itself, with the model to use and the scoring rules"""
+    version = local_scoring.version()
+    if not local_scoring.available():
+        return jsonify({'enabled': False})
+    return jsonify({
+        'enabled': True,
+        'model_version': version,
+        'manifest_url': url_for('static', filename='model/emnist_cnn.json', v=version),
+        'scoring': {
+            'score_scale': SCORE_SCALE,
+            'top_k_credit': TOP_K_CREDIT.tolist(),
+            'star_thresholds': STAR_THRESHOLDS,
+            'correct_threshold': CORRECT_THRESHOLD
+        }
+    })
+
+@app.route('/evaluate_local', methods=['POST'])
+def evaluate_local():
+    """Record a drawing the browser scored; a sampled fraction is re-scored here (see local_scoring.py)"""
+    try:
+        with span('decode'):
+            image, data = read_drawing(request, 'image')
+    except UploadError as e:
+        metrics.count_error('upload')
+        return jsonify({'error': str(e)}), 400
+    if image is None or 'answer' not in data:
+        return jsonify({'error': 'Missing image or answer data'}), 400
+    try:
+        claimed = float(data['score'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Missing or invalid score'}), 400
+    if not 0 <= claimed <= 100 * SCORE_SCALE:
+        return jsonify({'error': 'Missing or invalid score'}), 400
+    try:
+        level = read_level(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    correct_answer = data['answer'].upper()
+    with span('preprocess'):
+        pixels = preprocess_uint8(image)
+    score, verified = claimed, False
+    if local_scoring.should_verify(data.get('model_version')):
+        try:
+            score = evaluate_preprocessed(pixels, correct_answer) * SCORE_SCALE
+            verified = True
+            if not local_scoring.verified(claimed, score, correct_answer):
+                debug_capture.capture('local', 'mismatch', image)
+        except InferenceError as e:
+            # The child already saw their stars; verification is the first thing to give up under load
+            app.logger.warning(f"Local score not verified: {str(e)}")
+            local_scoring.skipped()
+    else:
+        local_scoring.trusted()
+    response = dict(drawing_result(score, level), verified=verified)
+    metrics.observe_score('local', score, response['stars'])
+    if verified:
+        # Unverified claims are the browser's word; only scores the server computed reach the leaderboards
+        game_history.record('local', correct_answer, score, response['stars'], player_name=data.get('player_name'),
+                            level=level)
+    drawing_archive.record(pixels, correct_answer, score, response['stars'], 'local', preprocessed=True)
+    with span('response'):
+        return jsonify(response)
+
+@app.route('/leaderboard/<board>')
+def leaderboard(board):
+    """Top scores per question (keyed by answer), player or level, optionally ?key= and ?limit="""
+    if board not in BOARDS:
+        return jsonify({'error': f"Unknown leaderboard, expected one of {', '.join(BOARDS)}"}), 404
+    limit = min(max(1, request.args.get('limit', LEADERBOARD_SIZE, type=int)), LEADERBOARD_SIZE)
+    return jsonify({
+        'board': board,
+        'leaders': game_history.leaderboard(board, request.args.get('key') or None, limit),
+        'refreshed_at': game_history.stats()['refreshed_at']
+    })
+
+@app.route('/history')
+def player_history():
+    """A player's latest results, ?player=<name>&limit="""
+    player_name = (request.args.get('player') or '').strip()
+    if not player_name:
+        return jsonify({'error': 'Missing player'}), 400
+    limit = min(max(1, request.args.get('limit', 20, type=int)), 100)
+    return jsonify({'player_name': player_name, 'results': game_history.player_history(player_name, limit)})
+
+@app.route('/live', methods=['POST'])
+def open_live_scoring():
+    """Start a running score for a drawing in progress (see live_scoring.py)"""
+    data = request.get_json(silent=True) or {}
+    if not data.get('answer'):
+        return jsonify({'error': 'Missing answer'}), 400
+    try:
+        canvas = parse_canvas(data)
+    except StrokeError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'live_id': live_scorer.open(data['answer'], canvas), 'hz': LIVE_SCORE_HZ})
+
+@app.route('/live/<live_id>/strokes', methods=['POST'])
+def live_strokes(live_id):
+    """Add the points drawn since the last post; answers with the latest running score"""
+    data = request.get_json(silent=True) or {}
+    try:
+        result = live_scorer.update(live_id, int(data.get('seq', 0)), data.get('strokes', []),
+                                    continues=bool(data.get('continue')), reset=bool(data.get('reset')))
+    except LiveNotFound:
+        return jsonify({'error': 'No such live session'}), 404
+    except LiveSequenceError as e:
+        return jsonify({'error': str(e), 'expected': e.expected}), 409
+    except (StrokeError, ValueError) as e:
+        metrics.count_error('upload')
+        return jsonify({'error': str(e)}), 400
+    if result['score'] is not None:
+        result['score'] *= SCORE_SCALE
+        result['stars'] = get_stars(result['score'])
+    return jsonify(result)
+
+@app.route('/live/<live_id>', methods=['DELETE'])
+def close_live_scoring(live_id):
+    live_scorer.close(live_id)
+    return jsonify({'success': True})
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'NoseDraw'})
+    loaded, warm = model_status()
+    return jsonify({
+        'status': 'healthy',
+        'service': 'NoseDraw',
+        'ready': startup.status() == 'ready',
+        'model_loaded': loaded,
+        'model_warm': warm,
+        'model': model_info(),
+        'debug_capture': debug_capture.stats(),
+        'admission': admission.stats(),
+        'result_cache': result_cache.stats(),
+        'game_events': game_events.stats(),
+        'rooms': game_rooms.stats(),
+        'questions': question_bank.stats(),
+        'local_scoring': local_scoring.stats(),
+        'live_scoring': live_scorer.stats(),
+        'game_history': game_history.stats(),
+        'drawing_archive': drawing_archive.stats(),
+        'startup': startup.profile()
+    })
+
+@app.route('/health/live')
+def liveness_check():
+    """The process is up and serving requests"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready')
+def readiness_check():
+    """Ready for traffic: the model is loaded and has run its warm-up predict"""
+    status = startup.status()
+    # After a failed warm-up the model still loads on first use, so a loaded model counts
+    ready = status == 'ready' or (status == 'failed' and model_status()[0])
+    response = jsonify({'status': 'ready' if ready else status, 'startup': startup.profile()})
+    if not ready:
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return response
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
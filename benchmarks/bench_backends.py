@@ -0,0 +1,62 @@
+"""
+Startup time, resident memory and per-image latency of each CNN backend.
+
+Every backend is measured in a fresh interpreter so that import cost and RSS
+are not shared between runs.
+
+    python benchmarks/bench_backends.py --backends keras numpy tflite-int8 tflite-float16
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, resource, time
+start = time.perf_counter()
+import cnn_evaluator
+imported = time.perf_counter()
+cnn_evaluator.warm_up()
+ready = time.perf_counter()
+import numpy as np
+arr = np.random.default_rng(0).random((1, 28, 28, 1), dtype=np.float32)
+runs = []
+for _ in range(200):
+    t = time.perf_counter()
+    cnn_evaluator.predict(arr)
+    runs.append(time.perf_counter() - t)
+with open('/proc/self/status') as f:
+    rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+import sys
+print(json.dumps({
+    'import_seconds': round(imported - start, 3),
+    'ready_seconds': round(ready - start, 3),
+    'rss_mb': round(rss_kb / 1024, 1),
+    'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    'predict_p50_ms': round(float(np.percentile(runs, 50)) * 1000, 3),
+    'tensorflow_imported': 'tensorflow' in sys.modules,
+}))
+'''
+
+
+def measure(backend):
+    env = dict(os.environ, CNN_BACKEND=backend, TF_CPP_MIN_LOG_LEVEL='3')
+    if backend.startswith('tflite-'):
+        env.update(CNN_BACKEND='tflite', CNN_QUANTIZATION=backend.split('-', 1)[1])
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['keras', 'numpy'])
+    args = parser.parse_args()
+    print(json.dumps({backend: measure(backend) for backend in args.backends}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
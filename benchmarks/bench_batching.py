@@ -0,0 +1,83 @@
+"""
+Throughput / latency comparison of one-at-a-time CNN predictions versus the
+MicroBatcher, with N concurrent client threads.
+
+    python benchmarks/bench_batching.py --threads 16 --requests 400
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import cnn_evaluator  # noqa: E402
+from inference_batcher import MicroBatcher  # noqa: E402
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) * 1000.0
+
+
+def run(predict, images, threads):
+    latencies = []
+    lock = threading.Lock()
+    index = iter(range(len(images)))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(index, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            predict(images[i])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - start
+    return {
+        'requests': len(images),
+        'throughput_rps': round(len(images) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    images = [rng.random((1, 28, 28, 1), dtype=np.float32) for _ in range(args.requests)]
+    cnn_evaluator.warm_up()
+
+    batcher = MicroBatcher(cnn_evaluator.predict_batch, args.max_batch_size, args.max_wait_ms / 1000.0)
+    results = {
+        'single': run(lambda a: cnn_evaluator.predict_batch(a)[0], images, args.threads),
+        'batched': run(batcher.predict, images, args.threads),
+    }
+    results['batched']['batcher'] = batcher.stats()
+    results['config'] = vars(args)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
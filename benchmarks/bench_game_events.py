@@ -0,0 +1,149 @@
+"""
+Request rate per active multiplayer room with polling versus pushed events.
+
+Starts the app on a local threaded server. Each simulated room has an actor
+that plays turns: submit player 1, submit player 2, next question, every
+--turn-seconds. It also has an observer that follows the room's state:
+
+* poll - GET /multiplayer/get_game_state every --poll-interval seconds
+* sse  - one GET /multiplayer/events stream (EventSource equivalent)
+
+The report counts the requests the server handled per room per second and
+the observer's lag, measured from a submit returning to the observer seeing
+the new version.
+
+    CNN_BACKEND=numpy python benchmarks/bench_game_events.py --rooms 20 --seconds 15
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+os.environ.setdefault('GAME_EVENTS_KEEPALIVE', '5')
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import app  # noqa: E402
+
+DRAWING = np.full((28, 28), 255, dtype=np.uint8)
+DRAWING[6:22, 13:16] = 0
+
+
+class CountingMiddleware:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        with self.lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+        return self.wsgi_app(environ, start_response)
+
+
+def play(base, http, stop, submitted, turn_seconds):
+    """Actor: alternate submits and new rounds; records when each version became visible."""
+    while not stop.is_set():
+        for player in (1, 2):
+            r = http.post(f'{base}/multiplayer/submit_drawing?player={player}', data=DRAWING.tobytes(),
+                          headers={'Content-Type': 'application/octet-stream'})
+            submitted[r.json()['version']] = time.monotonic()
+            if stop.wait(turn_seconds):
+                return
+        r = http.post(f'{base}/multiplayer/next_question', json={})
+        submitted[r.json()['version']] = time.monotonic()
+        if stop.wait(turn_seconds):
+            return
+
+
+def poll(base, http, stop, seen, interval):
+    while not stop.is_set():
+        state = http.get(f'{base}/multiplayer/get_game_state').json()['game_state']
+        seen.setdefault(state['version'], time.monotonic())
+        stop.wait(interval)
+
+
+def stream(base, http, stop, seen):
+    with http.get(f'{base}/multiplayer/events', stream=True, timeout=30) as r:
+        for line in r.iter_lines(decode_unicode=True):
+            if line and line.startswith('id: '):
+                seen.setdefault(int(line[4:]), time.monotonic())
+            if stop.is_set():
+                return
+
+
+def run(mode, rooms, seconds, turn_seconds, poll_interval):
+    counter = CountingMiddleware(app.wsgi_app)
+    app.wsgi_app = counter
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    stop = threading.Event()
+    threads, lags = [], []
+    records = []
+    try:
+        for _ in range(rooms):
+            http = requests.Session()
+            http.post(f'{base}/multiplayer/start_game', json={})
+            observer = requests.Session()
+            observer.cookies.update(http.cookies)
+            submitted, seen = {}, {}
+            records.append((submitted, seen))
+            threads.append(threading.Thread(target=play, args=(base, http, stop, submitted, turn_seconds), daemon=True))
+            if mode == 'poll':
+                threads.append(threading.Thread(target=poll, args=(base, observer, stop, seen, poll_interval), daemon=True))
+            else:
+                threads.append(threading.Thread(target=stream, args=(base, observer, stop, seen), daemon=True))
+        with counter.lock:
+            counter.counts.clear()
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        with counter.lock:
+            counts = dict(counter.counts)
+        elapsed = time.monotonic() - start
+        stop.set()
+    finally:
+        server.shutdown()
+        app.wsgi_app = counter.wsgi_app
+    for submitted, seen in records:
+        lags.extend(max(0.0, seen[v] - t) for v, t in submitted.items() if v in seen)
+    total = sum(counts.values())
+    observer_path = '/multiplayer/get_game_state' if mode == 'poll' else '/multiplayer/events'
+    return {
+        'rooms': rooms,
+        'seconds': round(elapsed, 1),
+        'requests_per_room_per_sec': round(total / rooms / elapsed, 3),
+        'observer_requests_per_room_per_sec': round(counts.get(observer_path, 0) / rooms / elapsed, 3),
+        'requests_by_path': counts,
+        'updates_observed': len(lags),
+        'update_lag_p50_ms': round(float(np.percentile(lags, 50)) * 1000, 1) if lags else None,
+        'update_lag_p95_ms': round(float(np.percentile(lags, 95)) * 1000, 1) if lags else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--turn-seconds', type=float, default=2.0, help='pause between actions in a room')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--modes', nargs='+', choices=['poll', 'sse'], default=['poll', 'sse'])
+    args = parser.parse_args()
+    report = {mode: run(mode, args.rooms, args.seconds, args.turn_seconds, args.poll_interval) for mode in args.modes}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Cost of recording game results and reading leaderboards (game_history.py).
+
+--threads request threads each record --results results, two ways.
+'write_behind' calls history.record(), which only queues the row.
+'sync' inserts and commits each row on the request thread, as a route
+would without the writer. The run reports per-call latency on the
+request thread and the time until every row is in the database. It then
+times a leaderboard read from the LeaderboardEntry summary against the same
+ranking computed from the raw DrawingResult rows, with --history-rows more
+results in the history.
+
+    python benchmarks/bench_history.py --threads 8 --results 500
+    DATABASE_URL=postgresql://localhost/nosedraw python benchmarks/bench_history.py --approaches write_behind
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+os.environ['MODEL_WARMUP'] = '0'
+
+PLAYERS = [f'player{i}' for i in range(200)]
+ANSWERS = [str(d) for d in range(10)] + [chr(c) for c in range(ord('A'), ord('Z') + 1)]
+
+
+def percentiles(values):
+    ms = np.array(values) * 1000.0
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 4), 'p99_ms': round(float(np.percentile(ms, 99)), 4),
+            'max_ms': round(float(ms.max()), 3)}
+
+
+def run(approach, args, app, history, models):
+    db = app.db
+    with app.app.app_context():
+        db.session.execute(db.delete(models.DrawingResult))
+        db.session.commit()
+    latencies = [[] for _ in range(args.threads)]
+
+    def worker(n):
+        rng = np.random.default_rng(n)
+        with app.app.app_context():
+            for _ in range(args.results):
+                row = dict(mode='single', answer=ANSWERS[rng.integers(len(ANSWERS))], score=float(rng.uniform(0, 100)),
+                           stars=int(rng.integers(6)), player_name=PLAYERS[rng.integers(len(PLAYERS))],
+                           level=int(rng.integers(1, 11)))
+                start = time.perf_counter()
+                if approach == 'write_behind':
+                    history.record(**row)
+                else:
+                    db.session.add(models.DrawingResult(**row))
+                    db.session.commit()
+                latencies[n].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests_done = time.perf_counter() - start
+    history.flush()
+    persisted = time.perf_counter() - start
+    return dict(percentiles([t for per_thread in latencies for t in per_thread]),
+                rows=args.threads * args.results,
+                request_threads_s=round(requests_done, 3),
+                persisted_s=round(persisted, 3),
+                rows_per_s=round(args.threads * args.results / persisted, 1))
+
+
+def leaderboard_reads(args, app, history, models):
+    result = models.DrawingResult
+    db = app.db
+    rng = np.random.default_rng(0)
+    with app.app.app_context():
+        # A longer history than the recording runs leave, so the raw ranking has something to scan
+        for _ in range(0, args.history_rows, 10000):
+            db.session.execute(db.insert(result), [
+                dict(mode='single', answer=ANSWERS[a], score=float(s), stars=1, player_name=PLAYERS[p], level=1)
+                for a, s, p in zip(rng.integers(len(ANSWERS), size=10000), rng.uniform(0, 100, 10000),
+                                   rng.integers(len(PLAYERS), size=10000))])
+        db.session.commit()
+    history.refresh()
+    timings = {'summary': [], 'raw': []}
+    with app.app.app_context():
+        for i in range(args.reads):
+            player = PLAYERS[i % len(PLAYERS)]
+            start = time.perf_counter()
+            history.leaderboard('player', player)
+            timings['summary'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            rank = db.func.row_number().over(partition_by=result.player_name,
+                                             order_by=(result.score.desc(), result.created_at, result.id))
+            ranked = db.select(result.player_name, result.score, rank.label('rank')).subquery()
+            db.session.execute(db.select(ranked).where(ranked.c.player_name == player,
+                                                       ranked.c.rank <= history.board_size)).all()
+            timings['raw'].append(time.perf_counter() - start)
+        db.session.rollback()
+    return {name: percentiles(values) for name, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--approaches', nargs='+', default=['sync', 'write_behind'], choices=['sync', 'write_behind'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--results', type=int, default=500, help='results recorded per thread')
+    parser.add_argument('--reads', type=int, default=200, help='leaderboard reads to time')
+    parser.add_argument('--history-rows', type=int, default=100000, help='extra rows in the history for the reads')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ.setdefault('DATABASE_URL', f'sqlite:///{tmpdir}/history.db')
+        import app
+        from game_history import history
+        from NoseDrawDuel import models
+
+        report = {'config': vars(args), 'database': app.app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]}
+        for approach in args.approaches:
+            report[approach] = run(approach, args, app, history, models)
+        report['leaderboard_read'] = leaderboard_reads(args, app, history, models)
+        report['history'] = history.stats()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
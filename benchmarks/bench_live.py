@@ -0,0 +1,149 @@
+"""
+Cost of the running score (live_scoring.py) against resubmitting the whole
+drawing.
+
+Each of --sessions simulated players draws a synthetic glyph at
+--points-per-second. Every --post-ms the player posts what they drew since the
+last post, for two approaches. 'live' posts the stroke delta to
+/live/<id>/strokes. 'full' posts all strokes so far to /evaluate, which is
+what a client without the live endpoint would have to do. Both run in-process
+through the Flask test client. Each run reports the model predictions, the
+batches, the process CPU time per second of drawing and the post latency.
+
+    python benchmarks/bench_live.py --sessions 16 --post-ms 100
+    python benchmarks/bench_live.py --approaches live --sessions 64 --points-per-second 60
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+os.environ.setdefault('RESULT_CACHE_SIZE', '0')
+
+from synthetic_drawings import CANVASES, GLYPHS, encode_strokes, glyph_strokes, stroke_payload  # noqa: E402
+
+
+def timeline(rng, points_per_tick):
+    """(label, ticks) where each tick lists the (stroke index, points) drawn during it."""
+    label = str(rng.choice(sorted(GLYPHS)))
+    strokes = glyph_strokes(label, CANVASES['single'][0], rng)
+    flat = [(i, point) for i, stroke in enumerate(strokes) for point in stroke]
+    return label, [flat[i:i + points_per_tick] for i in range(0, len(flat), points_per_tick)]
+
+
+def live_post(client, session, tick):
+    """Post one tick's delta to the live endpoint; the first polyline continues the last stroke if it can."""
+    polylines, continues = [], False
+    for index, point in tick:
+        if polylines and index == session['stroke']:
+            polylines[-1].append(point)
+        else:
+            continues = continues or (not polylines and index == session['stroke'])
+            polylines.append([point])
+            session['stroke'] = index
+    session['seq'] += 1
+    return client.post(f"/live/{session['id']}/strokes",
+                       json={'seq': session['seq'], 'strokes': encode_strokes(polylines), 'continue': continues})
+
+
+def full_post(client, session, tick):
+    for index, point in tick:
+        while len(session['strokes']) <= index:
+            session['strokes'].append([])
+        session['strokes'][index].append(point)
+    return client.post('/evaluate', json=dict(stroke_payload(session['strokes']), answer=session['label']))
+
+
+def run(approach, args):
+    import app
+    from cnn_evaluator import score_preprocessed
+    from live_scoring import live_scorer
+
+    client = app.app.test_client()
+    rng = np.random.default_rng(args.seed)
+    points_per_tick = max(1, round(args.points_per_second * args.post_ms / 1000.0))
+    sessions = []
+    for _ in range(args.sessions):
+        label, ticks = timeline(rng, points_per_tick)
+        session = {'label': label, 'ticks': ticks, 'seq': 0, 'stroke': -1, 'strokes': []}
+        if approach == 'live':
+            opened = dict(stroke_payload([]), answer=label)
+            session['id'] = client.post('/live', json=opened).get_json()['live_id']
+        sessions.append(session)
+
+    calls = {'predictions': 0, 'batches': 0}
+
+    def counted(batch, labels):
+        calls['batches'] += 1
+        calls['predictions'] += len(batch)
+        return score_preprocessed(batch, labels)
+
+    live_scorer.score_fn = counted
+    latencies = []
+    errors = 0
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    tick = 0
+    while any(tick < len(s['ticks']) for s in sessions):
+        tick_start = time.perf_counter()
+        for session in sessions:
+            if tick < len(session['ticks']):
+                t0 = time.perf_counter()
+                response = (live_post if approach == 'live' else full_post)(client, session, session['ticks'][tick])
+                latencies.append(time.perf_counter() - t0)
+                errors += response.status_code != 200
+        tick += 1
+        time.sleep(max(0.0, args.post_ms / 1000.0 - (time.perf_counter() - tick_start)))
+    if approach == 'live':
+        time.sleep(2.0 / live_scorer.stats()['hz'])  # let the last round be scored
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    stats = live_scorer.stats()
+    if approach == 'full':
+        # /evaluate scores one drawing per request
+        calls = {'predictions': len(latencies) - errors, 'batches': len(latencies) - errors}
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        'posts': len(latencies),
+        'errors': errors,
+        'drawing_seconds': round(wall, 2),
+        'predictions': calls['predictions'],
+        'batches': calls['batches'],
+        'mean_batch': round(calls['predictions'] / calls['batches'], 2) if calls['batches'] else None,
+        'predictions_per_session_second': round(calls['predictions'] / (args.sessions * wall), 2),
+        'cpu_seconds': round(cpu, 3),
+        'cpu_per_drawing_second': round(cpu / wall, 3),
+        'post_p50_ms': round(float(np.percentile(latencies_ms, 50)), 2),
+        'post_p95_ms': round(float(np.percentile(latencies_ms, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--approaches', nargs='+', default=['live', 'full'], choices=['live', 'full'])
+    parser.add_argument('--sessions', type=int, default=16)
+    parser.add_argument('--post-ms', type=float, default=100.0, help='how often each player posts')
+    parser.add_argument('--points-per-second', type=float, default=30.0, help='nose tracker point rate')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ['DATABASE_URL'] = f'sqlite:///{tmpdir}/live.db'
+        os.environ['MODEL_WARMUP'] = '1'
+        report = {'config': vars(args), 'env': {'CNN_BACKEND': os.environ['CNN_BACKEND'],
+                                                'LIVE_SCORE_HZ': os.environ.get('LIVE_SCORE_HZ')}}
+        for approach in args.approaches:
+            report[approach] = run(approach, args)
+    if 'live' in report and 'full' in report and report['live']['cpu_seconds']:
+        report['cpu_ratio_full_over_live'] = round(report['full']['cpu_seconds'] / report['live']['cpu_seconds'], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
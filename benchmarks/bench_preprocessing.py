@@ -0,0 +1,72 @@
+"""
+Per-stage microbenchmark of the shared preprocessing pipeline against the
+previous PIL-based cnn_evaluator path, on the canvas sizes the apps send.
+
+    python benchmarks/bench_preprocessing.py --iterations 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from preprocessing import Preprocessor  # noqa: E402
+
+
+def sample_canvases():
+    """Single-player canvas (opaque RGB, blue pen) and multiplayer canvas (transparent RGBA, black pen)."""
+    single = Image.new('RGB', (640, 480), 'white')
+    ImageDraw.Draw(single).line([(200, 120), (440, 120), (300, 400)], fill=(0, 123, 255), width=4)
+    multi = Image.new('RGBA', (300, 300), (0, 0, 0, 0))
+    ImageDraw.Draw(multi).ellipse([(90, 60), (210, 240)], outline=(0, 0, 0, 255), width=4)
+    return {'single_640x480_rgb': single, 'multi_300x300_rgba': multi}
+
+
+def legacy_preprocess(image, size=(28, 28)):
+    """The cnn_evaluator.preprocess_image implementation this pipeline replaced."""
+    if image.mode == 'RGBA':
+        bg = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(bg, image)
+        image = image.convert('L')
+    elif image.mode != 'L':
+        image = image.convert('L')
+    image = image.resize(size)
+    arr = np.array(image).astype('float32') / 255.0
+    return arr.reshape(1, 28, 28, 1)
+
+
+def bench(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    results = {}
+    for name, image in sample_canvases().items():
+        entry = {'legacy_total_us': bench(lambda: legacy_preprocess(image), args.iterations)}
+        for label, pre in (('pipeline', Preprocessor(28)), ('pipeline_crop', Preprocessor(28, crop=True))):
+            timings = {}
+            for _ in range(args.iterations):
+                pre.run(image, timings)
+            entry[f'{label}_stages_us'] = {k: round(v / args.iterations * 1e6, 1) for k, v in timings.items()}
+            entry[f'{label}_total_us'] = bench(lambda: pre.run(image), args.iterations)
+        entry['max_abs_diff_vs_legacy'] = float(np.abs(Preprocessor(28).run(image) - legacy_preprocess(image)).max())
+        results[name] = entry
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
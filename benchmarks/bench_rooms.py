@@ -0,0 +1,109 @@
+"""
+Memory per room and batch scoring throughput of N-player rooms (rooms.py).
+
+Memory: opens --rooms rooms of --players players each, with every drawing
+submitted. It reports the store's own accounting next to what tracemalloc
+sees, and how many such rooms fit in ROOM_MEMORY_BUDGET_MB.
+
+Scoring: scores one full room with one score_preprocessed() batch, compared
+with one evaluate_with_cnn() call per player as the two-player routes do.
+Results are in rooms per second.
+
+    CNN_BACKEND=numpy python benchmarks/bench_rooms.py --rooms 2000 --players 30
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+os.environ.setdefault('RESULT_CACHE_SIZE', '0')
+
+import cnn_evaluator  # noqa: E402
+from NoseDrawDuel.multiplayer.rooms import RoomStore  # noqa: E402
+
+QUESTION = {'question': 'Draw the number 3', 'answer': '3'}
+
+
+def fill(store, rooms, players, rng):
+    codes = []
+    for r in range(rooms):
+        code = store.create(players)['code']
+        for p in range(players):
+            store.join(code, f'player {r}-{p}')
+        store.start_round(code, QUESTION)
+        for p in range(players):
+            store.submit(code, p, rng.integers(0, 256, (28, 28), dtype=np.uint8))
+        codes.append(code)
+    return codes
+
+
+def measure_memory(rooms, players):
+    rng = np.random.default_rng(0)
+    store = RoomStore(budget_bytes=1 << 40)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(store, rooms, players, rng)
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    accounted = store.stats()['bytes']
+    budget = RoomStore().budget_bytes
+    return {
+        'rooms': rooms,
+        'players': players,
+        'accounted_bytes_per_room': round(accounted / rooms),
+        'traced_bytes_per_room': round(traced / rooms),
+        'budget_bytes': budget,
+        'drawing_rooms_in_budget': budget * rooms // max(traced, 1),
+    }
+
+
+def measure_scoring(players, repeats):
+    rng = np.random.default_rng(1)
+    images = [rng.integers(0, 256, (28, 28), dtype=np.uint8) for _ in range(players)]
+    batch = np.stack([cnn_evaluator.preprocess_uint8(image) for image in images])
+    labels = ['3'] * players
+    cnn_evaluator.warm_up()
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cnn_evaluator.score_preprocessed(batch, labels)
+    batched = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for image in images:
+            cnn_evaluator.evaluate_with_cnn(image, '3')
+    single = (time.perf_counter() - start) / repeats
+    return {
+        'players': players,
+        'backend': cnn_evaluator.CNN_BACKEND,
+        'batched_ms_per_room': round(batched * 1000, 3),
+        'per_drawing_ms_per_room': round(single * 1000, 3),
+        'batched_rooms_per_sec': round(1 / batched, 1),
+        'per_drawing_rooms_per_sec': round(1 / single, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=2000)
+    parser.add_argument('--players', type=int, default=30)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    report = {
+        'memory': measure_memory(args.rooms, args.players),
+        'scoring': measure_scoring(args.players, args.repeats),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+Throughput and latency of the scoring endpoints, /evaluate and
+/multiplayer/submit_drawing.
+
+Synthetic drawings come from synthetic_drawings.py: stroke-rendered digits
+and letters plus the reference templates, on the real canvas sizes. They are
+sent in each upload format (PNG data URL, raw 28x28 bytes, strokes) at every
+requested concurrency level. The app runs either in-process through the Flask
+test client, or under gunicorn over HTTP. Each run reports throughput,
+p50/p95/p99 latency and a per-stage breakdown (decode, preprocess, model,
+session, response) read from the Server-Timing header.
+
+    CNN_BACKEND=numpy python benchmarks/bench_scoring.py --output bench.json
+    python benchmarks/bench_scoring.py --mode gunicorn --workers 2 --threads 4 --concurrency 1 8 16
+    CNN_BACKEND=keras python benchmarks/bench_scoring.py --endpoints evaluate --formats raw --rate 20 --concurrency 64
+    python benchmarks/bench_scoring.py --compare before.json after.json
+
+The result cache is disabled (RESULT_CACHE_SIZE=0) unless --with-cache is given.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+os.environ['SERVER_TIMING'] = '1'
+
+from synthetic_drawings import drawings, request_body  # noqa: E402
+
+ENDPOINTS = {
+    'evaluate': ('/evaluate', 'image'),
+    'submit': ('/multiplayer/submit_drawing', 'drawing_data'),
+}
+CONFIG_ENV = ('CNN_BACKEND', 'CNN_QUANTIZATION', 'CNN_BATCHING', 'INFERENCE_POOL_SIZE', 'PREPROCESS_CROP',
+              'RESULT_CACHE_SIZE', 'GAME_SESSION_STORE')
+
+
+def parse_server_timing(value):
+    stages = {}
+    for part in (value or '').split(','):
+        name, _, dur = part.strip().partition(';dur=')
+        if name and dur:
+            stages[name] = float(dur)
+    return stages
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, body=None, headers=None, query=None):
+        if body is None:
+            r = self.client.post(path, json={}, query_string=query or {})
+        else:
+            r = self.client.post(path, data=body, headers=headers or {}, query_string=query or {})
+        return r.status_code, r.headers.get('Server-Timing'), r.get_json(silent=True)
+
+
+class HTTPClient:
+    def __init__(self, base):
+        import requests
+        self.base = base
+        self.session = requests.Session()
+
+    def post(self, path, body=None, headers=None, query=None):
+        if body is None:
+            r = self.session.post(self.base + path, json={}, params=query)
+        else:
+            r = self.session.post(self.base + path, data=body, headers=headers, params=query)
+        try:
+            payload = r.json()
+        except ValueError:
+            payload = None
+        return r.status_code, r.headers.get('Server-Timing'), payload
+
+
+def build_requests(endpoint, fmt, samples):
+    path, field = ENDPOINTS[endpoint]
+    built = []
+    for label, canvas, strokes, image in samples:
+        body, headers = request_body(fmt, label, strokes, image, field, canvas)
+        if body is None:
+            continue
+        query = {'answer': label} if fmt == 'raw' and endpoint == 'evaluate' else {}
+        built.append((path, body, headers, query))
+    return built
+
+
+def run(make_client, endpoint, fmt, samples, total, concurrency, rate=None, seed=0):
+    """
+    Closed loop by default: each of the concurrency clients sends its next
+    request as soon as the previous one returns. With rate, requests arrive
+    open loop at that Poisson rate (req/s), served by up to concurrency
+    clients, and latency counts from the scheduled arrival.
+    """
+    reqs = build_requests(endpoint, fmt, samples)
+    lock = threading.Lock()
+    counter = iter(range(total))
+    latencies, stages, errors = [], [], {}
+    arrivals = np.cumsum(np.random.default_rng(seed).exponential(1.0 / rate, total)) if rate else None
+
+    def worker():
+        client = make_client()
+        if endpoint == 'submit':
+            client.post('/multiplayer/start_game')
+        turn = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            path, body, headers, query = reqs[i % len(reqs)]
+            if endpoint == 'submit':
+                turn += 1
+                query = dict(query, player=2 - turn % 2)
+            if arrivals is not None:
+                start = began + arrivals[i]
+                time.sleep(max(0.0, start - time.perf_counter()))
+            else:
+                start = time.perf_counter()
+            status, timing, _ = client.post(path, body, headers, query)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                    stages.append(parse_server_timing(timing))
+                else:
+                    errors[status] = errors.get(status, 0) + 1
+            if endpoint == 'submit' and turn % 2 == 0:
+                # Untimed, starts the next round. Sent without a body: next_question
+                # doesn't read one, and an unread body breaks gunicorn keep-alive
+                client.post('/multiplayer/next_question', b'')
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    began = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    result = {
+        'endpoint': endpoint, 'format': fmt, 'concurrency': concurrency, 'rate': rate,
+        'requests': total, 'ok': len(latencies), 'errors': {str(k): v for k, v in errors.items()},
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+    }
+    if latencies:
+        ms = np.array(latencies) * 1000
+        result.update({f'p{p}_ms': round(float(np.percentile(ms, p)), 3) for p in (50, 95, 99)})
+        names = sorted({name for entry in stages for name in entry})
+        result['stages_ms'] = {
+            name: {
+                'mean': round(float(np.mean([entry.get(name, 0.0) for entry in stages])), 3),
+                'p50': round(float(np.percentile([entry.get(name, 0.0) for entry in stages], 50)), 3),
+            }
+            for name in names
+        }
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, threads, env):
+    port = free_port()
+    cmd = ['gunicorn', '--workers', str(workers), '--threads', str(threads), '--bind', f'127.0.0.1:{port}',
+           '--log-level', 'warning', 'app:app']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    import requests
+    deadline = time.monotonic() + 180
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited: {proc.stderr.read()[-2000:]}")
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/health/ready', timeout=1).status_code == 200:
+                return proc, f'http://127.0.0.1:{port}'
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("gunicorn did not become healthy in time")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    """Relative change of throughput and latency for runs present in both reports."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def key(run):
+        return run['mode'], run['endpoint'], run['format'], run['concurrency'], run.get('rate')
+
+    baseline = {key(run): run for run in before['runs']}
+    changes = []
+    for run in after['runs']:
+        old = baseline.get(key(run))
+        if old is None:
+            continue
+        entry = dict(zip(('mode', 'endpoint', 'format', 'concurrency', 'rate'), key(run)))
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if old.get(metric) and run.get(metric) is not None:
+                entry[metric] = {'before': old[metric], 'after': run[metric],
+                                 'change_pct': round((run[metric] - old[metric]) / old[metric] * 100, 1)}
+        changes.append(entry)
+    return {'before': before['meta'].get('commit'), 'after': after['meta'].get('commit'), 'runs': changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['inprocess', 'gunicorn'], default='inprocess')
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--formats', nargs='+', choices=['png', 'raw', 'strokes'], default=['png', 'raw', 'strokes'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--requests', type=int, default=200, help='requests per run')
+    parser.add_argument('--rate', type=float, help='open-loop Poisson arrival rate (req/s) instead of closed-loop clients')
+    parser.add_argument('--drawings', type=int, default=100, help='distinct synthetic drawings')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--with-cache', action='store_true', help='keep the result cache enabled')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two JSON reports')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+
+    if not args.with_cache:
+        os.environ['RESULT_CACHE_SIZE'] = '0'
+    samples = drawings(args.drawings, args.seed, os.path.join(ROOT, 'NoseDrawDuel/multiplayer/static/assets/reference_templates'))
+
+    proc = None
+    tmpdir = None
+    if args.mode == 'gunicorn':
+        env = dict(os.environ, MODEL_WARMUP='1')
+        if args.workers > 1:
+            # Sessions have to be visible to every worker
+            tmpdir = tempfile.TemporaryDirectory()
+            env.setdefault('GAME_SESSION_STORE', 'sql')
+            env.setdefault('DATABASE_URL', f'sqlite:///{tmpdir.name}/bench.db')
+        proc, base = start_gunicorn(args.workers, args.threads, env)
+        make_client = lambda: HTTPClient(base)  # noqa: E731
+    else:
+        from app import app
+        make_client = lambda: InProcessClient(app)  # noqa: E731
+
+    runs = []
+    try:
+        for endpoint in args.endpoints:
+            for fmt in args.formats:
+                for concurrency in args.concurrency:
+                    result = run(make_client, endpoint, fmt, samples, args.requests, concurrency, args.rate, args.seed)
+                    runs.append(dict(result, mode=args.mode))
+                    print(f"{args.mode} {endpoint} {fmt} c={concurrency}: {result['throughput_rps']} req/s, "
+                          f"p50 {result.get('p50_ms')} ms, p99 {result.get('p99_ms')} ms, errors {result['errors']}",
+                          file=sys.stderr)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'mode': args.mode,
+            'workers': args.workers if args.mode == 'gunicorn' else None,
+            'threads': args.threads if args.mode == 'gunicorn' else None,
+            'drawings': len(samples),
+            'seed': args.seed,
+            'env': {name: os.environ.get(name) for name in CONFIG_ENV},
+        },
+        'runs': runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
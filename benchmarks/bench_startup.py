@@ -0,0 +1,142 @@
+"""
+Cold-start profile of app.py: import time, time to live and time to ready.
+
+Each repeat starts a fresh interpreter that imports app, then polls
+/health/live and /health/ready through the test client until both answer
+200. It reports the medians, the startup phases the app recorded itself (see
+startup.py), and the slowest top-level imports from `python -X importtime`.
+With --budget-ms the script exits 1 when the median import time is over
+budget, so CI can gate on it. --history appends each report as one JSON line
+to a file, so startup can be tracked across commits.
+
+    python benchmarks/bench_startup.py --repeats 5 --budget-ms 1500
+    CNN_BACKEND=keras python benchmarks/bench_startup.py --history startup_history.jsonl
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+import startup
+client = app.app.test_client()
+live = ready = None
+deadline = imported + 300
+while ready is None and time.perf_counter() < deadline:
+    if live is None and client.get('/health/live').status_code == 200:
+        live = time.perf_counter()
+    if client.get('/health/ready').status_code == 200:
+        ready = time.perf_counter()
+        break
+    time.sleep(0.01)
+print(json.dumps({
+    'import_s': imported - start,
+    'live_s': live - start if live else None,
+    'ready_s': ready - start if ready else None,
+    'process_ready_s': startup.profile()['ready_after_seconds'],
+    'profile': startup.profile(),
+    'modules': {name: name in sys.modules for name in ('cv2', 'tensorflow', 'sklearn', 'requests')},
+}))
+'''
+
+IMPORT_LINE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)')
+
+CONFIG_ENV = ('CNN_BACKEND', 'CNN_QUANTIZATION', 'INFERENCE_POOL_SIZE', 'CNN_BATCHING', 'MODEL_WARMUP')
+
+
+def child_env(tmpdir):
+    # A throwaway database keeps runs independent of each other and of instance/
+    return dict(os.environ, DATABASE_URL=f'sqlite:///{tmpdir}/startup.db', PYTHONPATH=ROOT)
+
+
+def run_once(tmpdir):
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=child_env(tmpdir),
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(tmpdir, top):
+    """Cumulative import time of each module app.py imports directly, slowest first."""
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+                         env=dict(child_env(tmpdir), MODEL_WARMUP='0'), capture_output=True, text=True,
+                         check=True).stderr
+    modules = []
+    for line in err.splitlines():
+        match = IMPORT_LINE.match(line)
+        # Indented one level below app, i.e. imported by app.py itself
+        if match and len(match.group(2)) == 3:
+            modules.append((int(match.group(1)) / 1000.0, match.group(3)))
+    modules.sort(reverse=True)
+    return [{'module': name, 'ms': round(ms, 1)} for ms, name in modules[:top]]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def median_ms(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    return round(statistics.median(values) * 1000, 1) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--budget-ms', type=float, help='fail when the median import time exceeds this')
+    parser.add_argument('--history', help='append the report to this JSON-lines file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        runs = [run_once(tmpdir) for _ in range(args.repeats)]
+        imports = slowest_imports(tmpdir, args.top)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'repeats': args.repeats,
+            'env': {name: os.environ.get(name) for name in CONFIG_ENV},
+        },
+        'import_ms': median_ms(runs, 'import_s'),
+        'live_ms': median_ms(runs, 'live_s'),
+        'ready_ms': median_ms(runs, 'ready_s'),
+        'ready_since_process_start_ms': median_ms(runs, 'process_ready_s'),
+        'budget_ms': args.budget_ms,
+        'phases': runs[-1]['profile']['phases'],
+        'loaded_at_ready': runs[-1]['modules'],
+        'slowest_imports': imports,
+    }
+    report['over_budget'] = args.budget_ms is not None and report['import_ms'] > args.budget_ms
+    print(json.dumps(report, indent=2))
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+    if report['over_budget']:
+        print(f"Import took {report['import_ms']} ms, over the {args.budget_ms} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Payload size and server latency of the three /evaluate upload formats:
+base64 PNG in JSON, multipart PNG and a client-downsampled 28x28 grayscale
+buffer. Requests go through the Flask test client, so latency covers request
+parsing, decode, preprocessing and the model, but not the network.
+
+    CNN_BACKEND=numpy python benchmarks/bench_upload.py --requests 200
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('MODEL_WARMUP', '1')
+
+from app import app  # noqa: E402
+
+
+def sample_canvas(width=640, height=480):
+    """A '7' drawn with a thick blue pen on the single-player canvas."""
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.line([(200, 120), (440, 120), (300, 400)], fill=(0, 123, 255), width=4, joint='curve')
+    return img
+
+
+def timed(fn, n):
+    runs = []
+    for _ in range(n):
+        start = time.perf_counter()
+        response = fn()
+        runs.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return {
+        'p50_ms': round(float(np.percentile(runs, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(runs, 99)) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    canvas = sample_canvas()
+    png = io.BytesIO()
+    canvas.save(png, 'PNG')
+    png = png.getvalue()
+    json_body = json.dumps({'image': 'data:image/png;base64,' + base64.b64encode(png).decode(), 'answer': '7', 'level': 1})
+    # What the browser's canvasToGrayscale() sends
+    raw = np.asarray(canvas.convert('L').resize((28, 28), Image.Resampling.BOX), dtype=np.uint8).tobytes()
+
+    client = app.test_client()
+    formats = {
+        'json_base64_png': (len(json_body), lambda: client.post(
+            '/evaluate', data=json_body, content_type='application/json')),
+        'multipart_png': (len(png), lambda: client.post(
+            '/evaluate', data={'image': (io.BytesIO(png), 'drawing.png'), 'answer': '7', 'level': '1'},
+            content_type='multipart/form-data')),
+        'raw_gray_28x28': (len(raw), lambda: client.post(
+            '/evaluate?answer=7&level=1', data=raw, content_type='application/octet-stream',
+            headers={'X-Image-Width': '28', 'X-Image-Height': '28'})),
+    }
+    results = {}
+    for name, (size, send) in formats.items():
+        results[name] = dict(payload_bytes=size, **timed(send, args.requests))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
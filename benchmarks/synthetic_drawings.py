@@ -0,0 +1,164 @@
+"""
+Synthetic drawings for the benchmarks.
+
+Digits and letters are drawn from hand-made polylines with random placement,
+size, rotation and wobble, densified to one point every few pixels like the
+nose tracker produces. They are rendered the way each client does: the
+single-player 640x480 opaque canvas with a blue 4 px pen, or the
+multiplayer 300x300 transparent canvas with a black pen. The reference
+template PNGs are also pasted onto the same canvases.
+"""
+import base64
+import io
+import json
+import math
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def _arc(cx, cy, rx, ry, start, stop, steps=16):
+    return [(cx + rx * math.cos(math.radians(a)), cy + ry * math.sin(math.radians(a)))
+            for a in np.linspace(start, stop, steps)]
+
+
+# Strokes in a unit box, (0, 0) top left
+GLYPHS = {
+    '0': [_arc(0.5, 0.5, 0.35, 0.5, -90, 270)],
+    '1': [[(0.35, 0.15), (0.55, 0.0), (0.55, 1.0)]],
+    '2': [[(0.15, 0.25), (0.3, 0.05), (0.7, 0.05), (0.85, 0.25), (0.8, 0.45), (0.15, 1.0), (0.9, 1.0)]],
+    '3': [[(0.15, 0.1), (0.5, 0.0), (0.85, 0.15), (0.8, 0.4), (0.45, 0.5), (0.85, 0.6), (0.9, 0.85),
+           (0.5, 1.0), (0.1, 0.9)]],
+    '4': [[(0.7, 1.0), (0.7, 0.0), (0.1, 0.7), (0.95, 0.7)]],
+    '5': [[(0.85, 0.0), (0.2, 0.0), (0.15, 0.45), (0.6, 0.4), (0.85, 0.6), (0.8, 0.9), (0.5, 1.0), (0.15, 0.9)]],
+    '6': [[(0.8, 0.05), (0.4, 0.1), (0.15, 0.5), (0.2, 0.9), (0.5, 1.0), (0.8, 0.85), (0.8, 0.6), (0.5, 0.5),
+           (0.2, 0.65)]],
+    '7': [[(0.1, 0.0), (0.9, 0.0), (0.4, 1.0)]],
+    '8': [[(0.5, 0.5), (0.2, 0.3), (0.5, 0.0), (0.8, 0.3), (0.5, 0.5), (0.15, 0.75), (0.5, 1.0), (0.85, 0.75),
+           (0.5, 0.5)]],
+    '9': [[(0.8, 0.35), (0.5, 0.5), (0.2, 0.35), (0.3, 0.05), (0.7, 0.05), (0.8, 0.35), (0.75, 1.0)]],
+    'A': [[(0.1, 1.0), (0.5, 0.0), (0.9, 1.0)], [(0.28, 0.6), (0.72, 0.6)]],
+    'B': [[(0.2, 1.0), (0.2, 0.0)], [(0.2, 0.0), (0.7, 0.05), (0.75, 0.25), (0.2, 0.5), (0.8, 0.65), (0.75, 0.95),
+                                     (0.2, 1.0)]],
+    'C': [_arc(0.55, 0.5, 0.4, 0.5, -50, -310)],
+    'D': [[(0.2, 0.0), (0.2, 1.0)], [(0.2, 0.0), (0.7, 0.15), (0.85, 0.5), (0.7, 0.85), (0.2, 1.0)]],
+    'E': [[(0.85, 0.0), (0.2, 0.0), (0.2, 1.0), (0.85, 1.0)], [(0.2, 0.5), (0.7, 0.5)]],
+}
+
+CANVASES = {
+    # name: (size, PIL mode, background, pen colour) as the clients draw them
+    'single': ((640, 480), 'RGB', 'white', (0, 123, 255)),
+    'multi': ((300, 300), 'RGBA', (0, 0, 0, 0), (0, 0, 0, 255)),
+}
+PEN_WIDTH = 4
+
+
+def glyph_strokes(label, canvas_size, rng, step=4.0):
+    """Randomly placed, densified strokes (lists of (x, y) canvas points) for a label."""
+    width, height = canvas_size
+    scale = rng.uniform(0.35, 0.7) * min(width, height)
+    angle = math.radians(rng.uniform(-10, 10))
+    cx = width / 2 + rng.uniform(-0.15, 0.15) * width
+    cy = height / 2 + rng.uniform(-0.1, 0.1) * height
+    cos, sin = math.cos(angle), math.sin(angle)
+    strokes = []
+    for stroke in GLYPHS[label]:
+        pts = np.array(stroke, dtype=np.float64) - 0.5
+        pts[:, 0] *= 0.75  # glyphs are taller than wide
+        pts = pts @ np.array([[cos, sin], [-sin, cos]]) * scale + (cx, cy)
+        dense = [pts[0]]
+        for a, b in zip(pts[:-1], pts[1:]):
+            n = max(1, int(np.linalg.norm(b - a) / step))
+            dense.extend(a + (b - a) * (i / n) for i in range(1, n + 1))
+        dense = np.array(dense) + rng.normal(0, 0.6, size=(len(dense), 2))
+        strokes.append([(float(x), float(y)) for x, y in dense])
+    return strokes
+
+
+def render(strokes, canvas='single'):
+    size, mode, background, pen = CANVASES[canvas]
+    img = Image.new(mode, size, background)
+    draw = ImageDraw.Draw(img)
+    for stroke in strokes:
+        draw.line([(round(x), round(y)) for x, y in stroke], fill=pen, width=PEN_WIDTH, joint='curve')
+    return img
+
+
+def template_canvas(path, canvas, rng):
+    """A reference template pasted onto a client-sized canvas."""
+    size, mode, background, _ = CANVASES[canvas]
+    img = Image.new(mode, size, background)
+    with Image.open(path) as template:
+        template = template.convert('RGBA')
+        side = int(min(size) * rng.uniform(0.5, 0.8))
+        template = template.resize((side, side))
+        img.paste(template, ((size[0] - side) // 2, (size[1] - side) // 2), template)
+    return img
+
+
+def encode_strokes(strokes):
+    """Delta encoding of stroke_raster / encodeStrokes() in the clients."""
+    encoded = []
+    for stroke in strokes:
+        pts = np.round(np.array(stroke)).astype(np.int64)
+        deltas = np.diff(pts, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+        encoded.append(deltas.ravel().tolist())
+    return encoded
+
+
+def stroke_payload(strokes, canvas='single'):
+    """JSON fields of a stroke submission drawn on a client canvas."""
+    size, _, _, pen = CANVASES[canvas]
+    return {'strokes': encode_strokes(strokes), 'canvas': list(size), 'pen': PEN_WIDTH,
+            'ink': '#{:02x}{:02x}{:02x}'.format(*pen[:3])}
+
+
+def to_grayscale(img, size=28):
+    """What the clients' canvasToGrayscale() sends: white background, dark ink, box-downsampled."""
+    if img.mode == 'RGBA':
+        white = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(white, img)
+    return np.asarray(img.convert('L').resize((size, size), Image.Resampling.BOX), dtype=np.uint8).tobytes()
+
+
+def to_data_url(img):
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode()
+
+
+def drawings(count, seed=0, reference_dir=None):
+    """
+    count (label, canvas, strokes or None, image) tuples; about one in five
+    is a reference template when reference_dir has any.
+    """
+    rng = np.random.default_rng(seed)
+    templates = []
+    if reference_dir and os.path.isdir(reference_dir):
+        templates = sorted(os.path.join(reference_dir, n) for n in os.listdir(reference_dir) if n.endswith('.png'))
+    labels = sorted(GLYPHS)
+    out = []
+    for i in range(count):
+        canvas = 'single' if i % 2 == 0 else 'multi'
+        if templates and i % 5 == 4:
+            path = templates[rng.integers(len(templates))]
+            out.append((os.path.splitext(os.path.basename(path))[0], canvas, None, template_canvas(path, canvas, rng)))
+        else:
+            label = labels[rng.integers(len(labels))]
+            strokes = glyph_strokes(label, CANVASES[canvas][0], rng)
+            out.append((label, canvas, strokes, render(strokes, canvas)))
+    return out
+
+
+def request_body(fmt, label, strokes, image, field, canvas='single'):
+    """(body, headers) for one upload format: 'png' (JSON data URL), 'raw' (28x28 bytes) or 'strokes'."""
+    if fmt == 'png':
+        return json.dumps({field: to_data_url(image), 'answer': label}), {'Content-Type': 'application/json'}
+    if fmt == 'raw':
+        return to_grayscale(image), {'Content-Type': 'application/octet-stream'}
+    if fmt == 'strokes':
+        if strokes is None:
+            return None, None
+        return json.dumps(dict(stroke_payload(strokes, canvas), answer=label)), {'Content-Type': 'application/json'}
+    raise ValueError(f"unknown format {fmt}")
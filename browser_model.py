@@ -0,0 +1,121 @@
+"""
+Browser export of the EMNIST CNN for in-browser scoring (static/js/cnn.js).
+
+The NumPy export (numpy_cnn.py) is written as a JSON manifest (the layer
+spec, plus each array's shape and offset) and one raw little-endian float32
+file. The page fetches both once and runs the forward pass itself. The
+manifest's version is a hash of the weights. The browser reports it with
+every local score, so the server can tell when a page scored with an
+outdated model.
+
+    python browser_model.py export        # emnist_cnn_model.npz (or .h5) -> static/model/emnist_cnn.{json,bin}
+    python browser_model.py check         # parity of cnn.js (run with node) against NumpyCNN
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from numpy_cnn import H5_PATH, NPZ_PATH, NumpyCNN, export_npz
+
+MANIFEST_PATH = 'static/model/emnist_cnn.json'
+WEIGHTS_FILE = 'emnist_cnn.bin'
+
+
+def export_browser(npz_path=NPZ_PATH, manifest_path=MANIFEST_PATH):
+    """Write the manifest and weights file for cnn.js; the .npz is exported from the .h5 first if missing."""
+    if not os.path.exists(npz_path):
+        export_npz(H5_PATH, npz_path)
+    model = NumpyCNN(npz_path)
+    tensors = {}
+    offset = 0
+    chunks = []
+    for name in sorted(model.params):
+        arr = np.ascontiguousarray(model.params[name], dtype='<f4')
+        tensors[name] = {'shape': list(arr.shape), 'offset': offset, 'length': int(arr.size)}
+        offset += arr.nbytes
+        chunks.append(arr.tobytes())
+    weights = b''.join(chunks)
+    manifest = {
+        'format': 'nosedraw-cnn/1',
+        'version': hashlib.sha256(weights).hexdigest()[:16],
+        'input': [28, 28, 1],
+        'layers': model.spec,
+        'weights': WEIGHTS_FILE,
+        'byte_length': len(weights),
+        'tensors': tensors,
+    }
+    directory = os.path.dirname(manifest_path)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, WEIGHTS_FILE), 'wb') as f:
+        f.write(weights)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest_path
+
+
+def read_manifest(manifest_path=MANIFEST_PATH):
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+NODE_CHECK = r'''
+const fs = require('fs');
+const path = require('path');
+const { BrowserCNN } = require(process.argv[1]);
+const manifestPath = process.argv[2];
+const manifest = JSON.parse(fs.readFileSync(manifestPath, 'utf8'));
+const bin = fs.readFileSync(path.join(path.dirname(manifestPath), manifest.weights));
+const model = new BrowserCNN(manifest, bin.buffer.slice(bin.byteOffset, bin.byteOffset + bin.byteLength));
+const inputs = JSON.parse(fs.readFileSync(0, 'utf8'));
+const start = process.hrtime.bigint();
+const outputs = inputs.map(pixels => Array.from(model.predict(Uint8Array.from(pixels))));
+const ms = Number(process.hrtime.bigint() - start) / 1e6;
+console.log(JSON.stringify({ outputs, ms_per_drawing: ms / inputs.length }));
+'''
+
+
+def check_parity(manifest_path=MANIFEST_PATH, npz_path=NPZ_PATH, samples=64):
+    """Run cnn.js under node on random drawings and the reference templates and compare with NumpyCNN."""
+    import cnn_evaluator
+
+    rng = np.random.default_rng(0)
+    drawings = list(rng.integers(0, 256, (samples, 28, 28), dtype=np.uint8))
+    reference_dir = cnn_evaluator.REFERENCE_PATH
+    if os.path.isdir(reference_dir):
+        for name in sorted(os.listdir(reference_dir)):
+            if name.endswith('.png'):
+                image = cnn_evaluator.get_reference_image(os.path.splitext(name)[0], reference_dir)
+                drawings.append(cnn_evaluator.preprocess_uint8(image))
+    script = os.path.abspath('static/js/cnn.js')
+    out = subprocess.run(['node', '-e', NODE_CHECK, script, os.path.abspath(manifest_path)],
+                         input=json.dumps([d.ravel().tolist() for d in drawings]),
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout)
+    actual = np.array(result['outputs'], dtype=np.float32)
+    batch = np.stack(drawings).reshape(-1, 28, 28, 1).astype(np.float32) / 255.0
+    expected = NumpyCNN(npz_path).predict(batch)
+    max_diff = float(np.abs(expected - actual).max())
+    return {
+        'drawings': len(drawings),
+        'max_abs_prob_diff': max_diff,
+        # Upper bound on the change of the scaled score shown to players
+        'max_abs_scaled_score_diff': max_diff * 100.0 * cnn_evaluator.SCORE_SCALE,
+        'top1_agreement': float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()),
+        'node_ms_per_drawing': round(result['ms_per_drawing'], 3),
+    }
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    if command == 'export':
+        path = export_browser()
+        print(f"Wrote {path} and {os.path.join(os.path.dirname(path), WEIGHTS_FILE)}")
+    elif command == 'check':
+        print(json.dumps(check_parity(), indent=2))
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -1,22 +1,62 @@
+import bisect
+import logging
 import os
+import threading
+import time
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model, Model
 from PIL import Image
-import requests
-from sklearn.metrics.pairwise import cosine_similarity
+from admission import INFERENCE_MAX_CONCURRENCY, AdmissionController
+from inference_batcher import MicroBatcher
+from inference_pool import INFERENCE_POOL_SIZE, InferencePool
+from numpy_cnn import NPZ_PATH, NumpyCNN
+from reference_index import ReferenceIndex, l2_normalize
+from result_cache import ResultCache
+from stage_timing import span
+from startup import phase
+from tflite_cnn import TFLITE_PATHS, TFLiteCNN
+
+# TensorFlow and requests are imported lazily so that workers
+# running the 'numpy' backend never pay for them. preprocessing (cv2) is
+# imported on first use, which warm_up() does off the import path.
+
+logger = logging.getLogger(__name__)
 
 MODEL_PATH = 'emnist_cnn_model.h5'
 MODEL_URL = 'https://huggingface.co/keras-io/emnist-balanced-keras/resolve/main/emnist-balanced-keras.h5'
 
+# 'keras' loads MODEL_PATH with TensorFlow; 'numpy' runs the exported weights
+# in CNN_NPZ_PATH (see numpy_cnn.py) without importing TensorFlow at all;
+# 'tflite' runs the CNN_QUANTIZATION (int8 or float16) variant from tflite_cnn.py
+CNN_BACKEND = os.environ.get('CNN_BACKEND', 'keras')
+CNN_NPZ_PATH = os.environ.get('CNN_NPZ_PATH', NPZ_PATH)
+CNN_QUANTIZATION = os.environ.get('CNN_QUANTIZATION', 'int8')
+CNN_TFLITE_PATH = os.environ.get('CNN_TFLITE_PATH') or TFLITE_PATHS.get(CNN_QUANTIZATION, TFLITE_PATHS['int8'])
+
+# How often (seconds) the registry checks the .h5 file for changes; 0 disables hot reload
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '5'))
+
+# Micro-batching of concurrent predictions (see inference_batcher.py)
+CNN_BATCHING = os.environ.get('CNN_BATCHING', '0') == '1'
+CNN_BATCH_MAX_SIZE = int(os.environ.get('CNN_BATCH_MAX_SIZE', '32'))
+CNN_BATCH_MAX_WAIT_MS = float(os.environ.get('CNN_BATCH_MAX_WAIT_MS', '5'))
+
+# Cache of scores for identical drawings (see result_cache.py); size 0 disables it
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '4096'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))
+
 # Map label to index for EMNIST (0-9, A-Z)
 LABEL_MAP = {str(i): i for i in range(10)}
 LABEL_MAP.update({chr(ord('A')+i): 10+i for i in range(26)})
 
-REFERENCE_PATH = 'static/assets/reference_templates'
+# Reference templates (<label>.png); the multiplayer app ships the only copy
+REFERENCE_PATH = os.environ.get('REFERENCE_PATH') or next(
+    (path for path in ('static/assets/reference_templates',
+                       'NoseDrawDuel/multiplayer/static/assets/reference_templates') if os.path.isdir(path)),
+    'static/assets/reference_templates')
 
 
 def download_emnist_model():
+    import requests
     print(f"Downloading EMNIST model from {MODEL_URL} ...")
     r = requests.get(MODEL_URL)
     with open(MODEL_PATH, 'wb') as f:
@@ -27,46 +67,280 @@ def ensure_emnist_model():
     if not os.path.exists(MODEL_PATH):
         download_emnist_model()
 
-def get_model():
+
+def load_keras_model(path):
+    from tensorflow.keras.models import load_model
     ensure_emnist_model()
-    model = load_model(MODEL_PATH)
-    return model, None
+    return load_model(path)
+
+
+def load_numpy_model(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run 'python numpy_cnn.py export' first")
+    return NumpyCNN(path)
+
+
+def load_tflite_model(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run 'python tflite_cnn.py export {CNN_QUANTIZATION}' first")
+    return TFLiteCNN(path)
+
+
+def _rss_bytes():
+    """Current resident set size of this process, or None if unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the EMNIST model.
+
+    The model is loaded once (on first use or via warm_up) and shared by all
+    request threads. If the model file changes on disk the next call that
+    notices it reloads the model; other threads keep using the old model until
+    the new one is ready.
+    """
+
+    def __init__(self, path=MODEL_PATH, loader=load_keras_model, reload_interval=MODEL_RELOAD_INTERVAL):
+        self.path = path
+        self.loader = loader
+        self.reload_interval = reload_interval
+        self._load_lock = threading.Lock()
+        self._model = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._warm = False
+        self._stats = {}
+        self._embedding = None  # (generation, penultimate-layer model)
+        # Bumped on every (re)load so caches can tell model versions apart
+        self.generation = 0
+
+    def get(self):
+        model = self._model
+        if model is None or self._reload_due():
+            model = self._load()
+        return model
+
+    def _reload_due(self):
+        if self.reload_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        try:
+            return os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return False
+
+    def _load(self):
+        with self._load_lock:
+            # Another thread may have finished the load while we waited
+            if self._model is not None and self._mtime == self._current_mtime():
+                return self._model
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            model = self.loader(self.path)
+            mtime = self._current_mtime()
+            load_seconds = time.perf_counter() - start
+            rss_after = _rss_bytes()
+            reloaded = self._model is not None
+            self._model = model
+            self.generation += 1
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+            self._warm = False
+            self._stats = {
+                'path': self.path,
+                'backend': f'{CNN_BACKEND}-{CNN_QUANTIZATION}' if CNN_BACKEND == 'tflite' else CNN_BACKEND,
+                'load_seconds': round(load_seconds, 4),
+                'weights_bytes': int(sum(w.nbytes for w in model.get_weights())),
+                'rss_delta_bytes': (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+                'loaded_at': time.time(),
+                'reload_count': self._stats.get('reload_count', 0) + (1 if reloaded else 0),
+            }
+            logger.info(f"Loaded {self.path} in {load_seconds:.2f}s")
+            return model
+
+    def _current_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def warm_up(self):
+        """Load the model and run one dummy prediction so the first request is fast."""
+        model = self.get()
+        start = time.perf_counter()
+        model.predict(np.zeros((1, 28, 28, 1), dtype='float32'), verbose=0)
+        self._stats['warmup_seconds'] = round(time.perf_counter() - start, 4)
+        self._warm = True
+        return model
+
+    def embedding_model(self):
+        """Model with the same predict() API that returns penultimate-layer activations."""
+        model = self.get()
+        cached = self._embedding
+        if cached is not None and cached[0] == self.generation:
+            return cached[1]
+        if hasattr(model, 'embedding_model'):
+            embedding = model.embedding_model()
+        else:
+            from tensorflow.keras.models import Model
+            embedding = Model(inputs=model.inputs, outputs=model.layers[-2].output)
+        self._embedding = (self.generation, embedding)
+        return embedding
+
+    def info(self):
+        """Load time, resident size and state of the current model."""
+        return dict(self._stats, loaded=self._model is not None, warm=self._warm)
+
+
+if CNN_BACKEND == 'numpy':
+    registry = ModelRegistry(CNN_NPZ_PATH, load_numpy_model)
+elif CNN_BACKEND == 'tflite':
+    registry = ModelRegistry(CNN_TFLITE_PATH, load_tflite_model)
+else:
+    registry = ModelRegistry(MODEL_PATH, load_keras_model)
+
+
+def get_model():
+    """(classifier, embedding model) for the current weights."""
+    return registry.get(), registry.embedding_model()
+
+
+# With INFERENCE_POOL_SIZE > 0 the model only lives in worker processes (see inference_pool.py)
+pool = InferencePool(INFERENCE_POOL_SIZE) if INFERENCE_POOL_SIZE > 0 else None
+
+
+def predict_batch(arr):
+    """Run the model on a preprocessed (N, 28, 28, 1) array and return (N, classes) probabilities."""
+    if pool is not None:
+        return pool.predict(arr)
+    return registry.get().predict(arr, verbose=0)
+
+
+def embed_batch(arr):
+    """Penultimate-layer embeddings for a preprocessed (N, 28, 28, 1) array."""
+    if pool is not None:
+        return pool.embed(arr)
+    return np.asarray(registry.embedding_model().predict(arr, verbose=0))
+
+
+def model_version():
+    """Identifies the weights currently used for scoring (cache keys, reference index)."""
+    if pool is not None:
+        # Workers reload on their own; the file's mtime is what they converge to
+        return registry._current_mtime()
+    registry.get()
+    return registry.generation
+
+
+def _embed_images(images):
+    return embed_batch(np.concatenate([preprocess_image(image) for image in images], axis=0))
+
+
+def _model_tag():
+    return f'{CNN_BACKEND}:{registry.path}:{model_version()}'
+
+
+reference_index = ReferenceIndex(REFERENCE_PATH, _embed_images, _model_tag)
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+batcher = MicroBatcher(predict_batch, CNN_BATCH_MAX_SIZE, CNN_BATCH_MAX_WAIT_MS / 1000.0) if CNN_BATCHING else None
+
+# Bounded queue in front of the model (see admission.py). By default as many
+# requests run at once as the backend can use: a full micro-batch, one per
+# pool worker, or one per CPU
+admission = AdmissionController(
+    INFERENCE_MAX_CONCURRENCY
+    or (CNN_BATCH_MAX_SIZE if CNN_BATCHING else INFERENCE_POOL_SIZE if pool is not None else os.cpu_count() or 1)
+)
+
+
+def predict(arr):
+    """Predictions for a single preprocessed (1, 28, 28, 1) image, batched with concurrent callers when enabled."""
+    if batcher is not None:
+        return batcher.predict(arr)
+    return predict_batch(arr)[0]
+
+
+def warm_up():
+    with phase('warmup_preprocess'):
+        preprocess_image(np.full((28, 28), 255, dtype=np.uint8))
+    if pool is not None:
+        with phase('warmup_pool'):
+            pool.wait_ready()
+    else:
+        with phase('model_load'):
+            registry.get()
+        with phase('warmup_predict'):
+            registry.warm_up()
+    try:
+        with phase('reference_index'):
+            reference_index.build()
+    except FileNotFoundError as e:
+        logger.warning(f"Reference index not built: {e}")
+
+
+def model_status():
+    """(loaded, warm) for /health; pool workers load and warm up their model before the handshake."""
+    if pool is not None:
+        return pool.ready, pool.ready
+    info = registry.info()
+    return info['loaded'], info['warm']
+
+
+def model_info():
+    info = dict(registry.info(), reference_index=reference_index.info())
+    if pool is not None:
+        info['pool'] = pool.stats()
+    return info
 
 
 def preprocess_image(image, size=(28, 28)):
-    # Handle both PIL Image and numpy array
-    if isinstance(image, np.ndarray):
+    # PIL images and 2-D uint8 arrays go through the shared pipeline (preprocessing.py)
+    if isinstance(image, np.ndarray) and image.dtype != np.uint8:
         arr = image.astype('float32') / 255.0
         arr = arr.reshape(1, 28, 28, 1)
         return arr
-    # Convert RGBA to white background for PIL Image
-    if image.mode == 'RGBA':
-        bg = Image.new('RGBA', image.size, (255, 255, 255, 255))
-        image = Image.alpha_composite(bg, image)
-        image = image.convert('L')
-    elif image.mode != 'L':
-        image = image.convert('L')
-    image = image.resize(size)
-    arr = np.array(image).astype('float32') / 255.0
-    arr = arr.reshape(1, 28, 28, 1)
-    return arr
+    from preprocessing import get_preprocessor
+    return get_preprocessor(size).run(image)
 
 
 def get_embedding(image):
-    _, embedding_model = get_model()
-    arr = preprocess_image(image)
-    embedding = embedding_model.predict(arr)
-    return embedding
+    """(1, dims) penultimate-layer embedding of a drawing."""
+    return embed_batch(preprocess_image(image))
 
 
 def evaluate_similarity(player_image, target_image):
-    emb1 = get_embedding(player_image)
-    emb2 = get_embedding(target_image)
-    sim = cosine_similarity(emb1, emb2)[0, 0]
+    """
+    Cosine similarity (0-100) between a drawing and a target.
+
+    target_image may be a label, looked up in the precomputed reference index,
+    or an image, which is embedded on the fly.
+    """
+    embedding = get_embedding(player_image)
+    if isinstance(target_image, str):
+        sim = reference_index.similarity(embedding, target_image)
+    else:
+        sim = float(l2_normalize(embedding)[0] @ l2_normalize(get_embedding(target_image))[0])
     sim = max(0.0, min(1.0, sim))
     return sim * 100  # as percentage
 
 
+def similarity_scores(player_image):
+    """Similarity (0-100) of a drawing with every reference template, as {label: score}."""
+    sims = reference_index.similarities(get_embedding(player_image))
+    return {label: max(0.0, min(1.0, sim)) * 100 for label, sim in sims.items()}
+
+
 def get_reference_image(character, reference_path=REFERENCE_PATH):
     path = os.path.join(reference_path, f'{character}.png')
     if not os.path.exists(path):
@@ -75,22 +349,102 @@ def get_reference_image(character, reference_path=REFERENCE_PATH):
     return img
 
 
+# Partial credit by rank of the target label: full credit for top-1, 70% for
+# top-2, 50% for top-3 and (as before) the raw confidence below that
+TOP_K_CREDIT = np.array([1.0, 0.7, 0.5])
+
+# Game scores are those percentages times SCORE_SCALE. STAR_THRESHOLDS are
+# the game scores for 1-5 stars, and CORRECT_THRESHOLD counts a drawing as
+# correct. Every mode and the browser (/evaluate_local/config) use these
+# values; rescore.py shows what changing them would do to past drawings
+SCORE_SCALE = 3.43
+STAR_THRESHOLDS = (7, 20, 40, 60, 80)
+CORRECT_THRESHOLD = 20
+
+
+def get_stars(score, thresholds=STAR_THRESHOLDS):
+    return bisect.bisect_right(thresholds, score)
+
+
+def label_indices(labels):
+    """Model output index for each label, or -1 for labels the model does not know."""
+    return np.array([LABEL_MAP.get(str(label).upper(), -1) for label in labels], dtype=np.int64)
+
+
+def partial_credit_scores(preds, target_indices):
+    """
+    Vectorized top-k partial-credit scoring.
+
+    preds is an (N, classes) array of probabilities and target_indices an (N,)
+    array of label indices (-1 for unknown). Returns N percentage scores.
+    """
+    preds = np.asarray(preds)
+    n, classes = preds.shape
+    target_indices = np.asarray(target_indices)
+    valid = (target_indices >= 0) & (target_indices < classes)
+    safe = np.where(valid, target_indices, 0)
+    confidence = preds[np.arange(n), safe].astype(np.float64)
+    top_k = np.argsort(preds, axis=1)[:, ::-1][:, :len(TOP_K_CREDIT)]
+    hits = top_k == safe[:, None]
+    credit = np.where(hits.any(axis=1), TOP_K_CREDIT[hits.argmax(axis=1)], 1.0)
+    return np.where(valid, confidence * credit * 100.0, 0.0)
+
+
+def score_many(images, labels):
+    """Score each image against its own label with a single forward pass."""
+    arr = np.concatenate([preprocess_image(image) for image in images], axis=0)
+    with admission.slot(), span('model'):
+        preds = predict_batch(arr)
+    return partial_credit_scores(preds, label_indices(labels))
+
+
+def preprocess_uint8(image, size=(28, 28)):
+    """Model input as a (28, 28) uint8 array, 784 bytes instead of 3136 (see rooms.py)."""
+    if isinstance(image, np.ndarray) and image.dtype != np.uint8:
+        return np.clip(np.asarray(image).reshape(28, 28), 0, 255).astype(np.uint8)
+    from preprocessing import get_preprocessor
+    return get_preprocessor(size).run_uint8(image)
+
+
+def score_preprocessed(batch, labels):
+    """Score an (N, 28, 28) uint8 batch from preprocess_uint8 in one forward pass, behind admission control."""
+    arr = np.multiply(batch.reshape(-1, 28, 28, 1), np.float32(1.0 / 255.0), dtype=np.float32)
+    with admission.slot(), span('model'):
+        preds = predict_batch(arr)
+    return partial_credit_scores(preds, label_indices(labels))
+
+
+def rank_labels(image, candidates):
+    """Score one image against every candidate label; returns (label, score) pairs, best first."""
+    arr = preprocess_image(image)
+    with admission.slot(), span('model'):
+        preds = predict(arr)
+    scores = partial_credit_scores(np.broadcast_to(preds, (len(candidates), preds.shape[-1])),
+                                   label_indices(candidates))
+    order = np.argsort(-scores, kind='stable')
+    return [(candidates[i], float(scores[i])) for i in order]
+
+
 def evaluate_with_cnn(player_image, target_label):
-    arr = preprocess_image(player_image)
-    model, _ = get_model()
-    preds = model.predict(arr)[0]
-    target_idx = LABEL_MAP.get(target_label.upper(), None)
-    if target_idx is None or target_idx >= 36:
-        return 0.0
-    confidence = float(preds[target_idx])
-    # Improved scoring: partial credit for top-3
-    top3 = np.argsort(preds)[::-1][:3]
-    if target_idx == top3[0]:
-        score = confidence * 100.0
-    elif target_idx == top3[1]:
-        score = confidence * 0.7 * 100.0
-    elif target_idx == top3[2]:
-        score = confidence * 0.5 * 100.0
-    else:
-        score = confidence * 100.0
-    return score 
\ No newline at end of file
+    with span('preprocess'):
+        arr = preprocess_image(player_image)
+    return _evaluate(arr, target_label)
+
+
+def evaluate_preprocessed(pixels, target_label):
+    """evaluate_with_cnn for the (28, 28) uint8 output of preprocess_uint8, which the caller keeps."""
+    return _evaluate(np.multiply(pixels.reshape(1, 28, 28, 1), np.float32(1.0 / 255.0), dtype=np.float32),
+                     target_label)
+
+
+def _evaluate(arr, target_label):
+    # Resubmitted drawings (retries, double clicks) are answered from the cache;
+    # the key carries the model version that will score it
+    key = result_cache.make_key(arr, target_label, model_version())
+    score = result_cache.get(key)
+    if score is None:
+        with admission.slot(), span('model'):
+            preds = predict(arr)
+        score = float(partial_credit_scores(preds[None, :], label_indices([target_label]))[0])
+        result_cache.put(key, score)
+    return score
@@ -0,0 +1,114 @@
+"""
+Sampled capture of submitted drawings for debugging.
+
+Off by default. With DEBUG_CAPTURE_RATE > 0 that fraction of submissions is
+handed to a background thread through a bounded queue and written as PNG to
+DEBUG_CAPTURE_DIR/<session id>/. Request threads never encode or touch the
+disk; if the queue is full the capture is dropped and counted instead.
+Only the newest DEBUG_CAPTURE_KEEP files per session and the newest
+DEBUG_CAPTURE_MAX_SESSIONS session directories are kept.
+"""
+import logging
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+DEBUG_CAPTURE_RATE = float(os.environ.get('DEBUG_CAPTURE_RATE', '0'))
+DEBUG_CAPTURE_DIR = os.environ.get('DEBUG_CAPTURE_DIR', 'debug_captures')
+DEBUG_CAPTURE_QUEUE = int(os.environ.get('DEBUG_CAPTURE_QUEUE', '64'))
+DEBUG_CAPTURE_KEEP = int(os.environ.get('DEBUG_CAPTURE_KEEP', '20'))
+DEBUG_CAPTURE_MAX_SESSIONS = int(os.environ.get('DEBUG_CAPTURE_MAX_SESSIONS', '50'))
+
+logger = logging.getLogger(__name__)
+
+
+class DebugCapture:
+    def __init__(self, directory=DEBUG_CAPTURE_DIR, rate=DEBUG_CAPTURE_RATE, queue_size=DEBUG_CAPTURE_QUEUE,
+                 keep_per_session=DEBUG_CAPTURE_KEEP, max_sessions=DEBUG_CAPTURE_MAX_SESSIONS):
+        self.directory = directory
+        self.rate = rate
+        self.keep_per_session = keep_per_session
+        self.max_sessions = max_sessions
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counters = {'sampled_out': 0, 'queued': 0, 'dropped': 0, 'written': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def capture(self, session_id, name, image):
+        """Maybe queue a drawing (PIL image or uint8 array) for writing; never blocks."""
+        if self.rate <= 0:
+            return False
+        if self.rate < 1 and random.random() >= self.rate:
+            self._count('sampled_out')
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((str(session_id), name, image, time.time()))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='debug-capture', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            session_id, name, image, timestamp = self._queue.get()
+            try:
+                self._write(session_id, name, image, timestamp)
+                self._count('written')
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Debug capture failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, session_id, name, image, timestamp):
+        session_dir = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_-]', '_', session_id) or 'unknown')
+        is_new = not os.path.isdir(session_dir)
+        os.makedirs(session_dir, exist_ok=True)
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)) + f'{timestamp % 1:.3f}'[1:]
+        image.save(os.path.join(session_dir, f'{stamp}_{re.sub(r"[^A-Za-z0-9_-]", "_", name)}.png'))
+        self._rotate(session_dir)
+        if is_new:
+            self._rotate_sessions()
+
+    def _rotate(self, session_dir):
+        files = sorted(f for f in os.listdir(session_dir) if f.endswith('.png'))
+        for old in files[:max(0, len(files) - self.keep_per_session)]:
+            os.remove(os.path.join(session_dir, old))
+
+    def _rotate_sessions(self):
+        dirs = [os.path.join(self.directory, d) for d in os.listdir(self.directory)]
+        dirs = sorted((d for d in dirs if os.path.isdir(d)), key=os.path.getmtime)
+        for old in dirs[:max(0, len(dirs) - self.max_sessions)]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def flush(self):
+        """Wait until every queued capture has been written (for tests and shutdown)."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, pending=self._queue.qsize(), rate=self.rate)
+
+
+capturer = DebugCapture()
@@ -0,0 +1,346 @@
+"""
+Append-only archive of submitted drawings.
+
+Every scored submission is kept as one fixed-size record:
+
+    timestamp  float64   seconds since the epoch
+    mode       S12       single, local, multiplayer or room
+    session    S32       game session or room code
+    label      S8        the answer it was scored against
+    score      float32   the game score (x SCORE_SCALE) it was given
+    stars      uint8
+    pixels     uint8 (28, 28)   the model input, white background, dark ink
+    stroke_offset, stroke_points   where its points are in the stroke file, if it was sent as strokes
+
+Records go to ARCHIVE_DIR/drawings-NNNNNN.rec. Each file is a 64-byte header
+followed by packed records, so it can be opened as a NumPy array without
+copying anything:
+
+    np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE)
+
+segments() does that for every file. The stroke points of a segment go
+to drawings-NNNNNN.strokes, an int16 (n, 2) array of absolute canvas points.
+A (STROKE_BREAK, STROKE_BREAK) row separates strokes.
+
+Request threads only queue the drawing. A background thread preprocesses
+the queued drawings and appends them in batches. Each batch is one write,
+made while holding an exclusive flock on the segment, so any number of
+worker processes can append to the same archive. A segment that would grow
+past ARCHIVE_SEGMENT_MB is closed, and the next number is started. If the
+queue is full, drawings are dropped and counted.
+
+The archive is off unless DRAWING_ARCHIVE=1. Whenever a segment is started,
+the oldest segments (with their stroke files) are deleted until the archive
+fits ARCHIVE_MAX_MB again (0 keeps everything).
+
+    python drawing_archive.py stats [directory]
+"""
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # POSIX only; without it, only appends from a single process are safe
+    fcntl = None
+
+DRAWING_ARCHIVE = os.environ.get('DRAWING_ARCHIVE', '0') == '1'
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'drawing_archive')
+ARCHIVE_SEGMENT_MB = float(os.environ.get('ARCHIVE_SEGMENT_MB', '64'))
+ARCHIVE_MAX_MB = float(os.environ.get('ARCHIVE_MAX_MB', '2048'))
+ARCHIVE_QUEUE = int(os.environ.get('ARCHIVE_QUEUE', '1024'))
+ARCHIVE_BATCH_MAX = int(os.environ.get('ARCHIVE_BATCH_MAX', '256'))
+
+MAGIC = b'NOSEDRAW-ARCHIVE'
+VERSION = 1
+HEADER_SIZE = 64
+STROKE_BREAK = np.iinfo(np.int16).min
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('stroke_offset', '<i8'),
+    ('stroke_points', '<u4'),
+    ('score', '<f4'),
+    ('mode', 'S12'),
+    ('session', 'S32'),
+    ('label', 'S8'),
+    ('stars', 'u1'),
+    ('pixels', 'u1', (28, 28)),
+], align=True)
+
+SEGMENT_NAME = re.compile(r'^drawings-(\d{6})\.rec$')
+
+logger = logging.getLogger(__name__)
+
+
+def _header():
+    # Magic, format version and record size, so readers can refuse a layout they do not know
+    header = MAGIC + np.array([VERSION, RECORD_DTYPE.itemsize], dtype='<u4').tobytes()
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def segment_paths(directory=ARCHIVE_DIR):
+    """Segment files, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if SEGMENT_NAME.match(name)]
+
+
+def open_segment(path):
+    """The records of one segment as a read-only memory-mapped array (records still being written are left out)."""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        return np.empty(0, dtype=RECORD_DTYPE)  # just started by a writer
+    if not header.startswith(MAGIC):
+        raise ValueError(f"{path} is not a drawing archive segment")
+    version, itemsize = np.frombuffer(header, dtype='<u4', count=2, offset=len(MAGIC))
+    if version != VERSION or itemsize != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} has format {version} with {itemsize}-byte records, expected "
+                         f"{VERSION} with {RECORD_DTYPE.itemsize}")
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def segments(directory=ARCHIVE_DIR):
+    """(path, records) for every segment, oldest first."""
+    for path in segment_paths(directory):
+        yield path, open_segment(path)
+
+
+def stroke_points(segment_path, record):
+    """The strokes of one record as a list of (k, 2) int16 arrays, or [] if it was not sent as strokes."""
+    if not record['stroke_points']:
+        return []
+    points = np.memmap(os.path.splitext(segment_path)[0] + '.strokes', dtype='<i2', mode='r')
+    start = int(record['stroke_offset']) * 2
+    flat = np.asarray(points[start:start + int(record['stroke_points']) * 2]).reshape(-1, 2)
+    pieces = np.split(flat, np.flatnonzero(flat[:, 0] == STROKE_BREAK))
+    # Every piece after the first starts with its break row
+    return [pieces[0]] + [piece[1:] for piece in pieces[1:]]
+
+
+def _encode_strokes(polylines):
+    parts = []
+    for i, points in enumerate(polylines):
+        if i:
+            parts.append(np.full((1, 2), STROKE_BREAK, dtype='<i2'))
+        parts.append(np.clip(np.round(points), STROKE_BREAK + 1, np.iinfo(np.int16).max).astype('<i2'))
+    return np.concatenate(parts) if parts else np.empty((0, 2), dtype='<i2')
+
+
+class DrawingArchive:
+    def __init__(self, directory=ARCHIVE_DIR, enabled=DRAWING_ARCHIVE, segment_bytes=int(ARCHIVE_SEGMENT_MB * 1024 * 1024),
+                 queue_size=ARCHIVE_QUEUE, batch_max=ARCHIVE_BATCH_MAX, max_bytes=int(ARCHIVE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.enabled = enabled
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.batch_max = batch_max
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counters = {'queued': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'errors': 0, 'segments_started': 0,
+                         'segments_pruned': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='drawing-archive', daemon=True)
+                self._thread.start()
+
+    def record(self, image, label, score, stars, mode, session=None, strokes=None, preprocessed=False):
+        """
+        Queue a scored drawing for the archive; never blocks. image is
+        anything preprocess_uint8 accepts, or with preprocessed=True its
+        (28, 28) uint8 output. strokes is the delta-encoded payload, if the
+        drawing was sent as strokes.
+        """
+        if not self.enabled:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), image, preprocessed, label, score, stars, mode, session, strokes))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.batch_max:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                records, strokes = self._pack(items)
+                if len(records):
+                    self.append(records, strokes)
+                    self._count('written', len(records))
+                    self._count('batches')
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Could not archive {len(items)} drawings: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _pack(self, items):
+        """Records and stroke points for a batch of queued drawings."""
+        from cnn_evaluator import preprocess_uint8
+        from stroke_raster import decode_strokes
+
+        packed, strokes = [], []
+        for timestamp, image, preprocessed, label, score, stars, mode, session, payload in items:
+            try:
+                pixels = np.asarray(image).reshape(28, 28) if preprocessed else preprocess_uint8(image)
+                points = _encode_strokes(decode_strokes(payload)) if payload else np.empty((0, 2), dtype='<i2')
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Could not archive a drawing for '{label}': {e}")
+                continue
+            packed.append((timestamp, pixels, label, score, stars, mode, session, points))
+            strokes.append(points)
+        records = np.zeros(len(packed), dtype=RECORD_DTYPE)
+        for record, (timestamp, pixels, label, score, stars, mode, session, points) in zip(records, packed):
+            record['timestamp'] = timestamp
+            record['score'] = score
+            record['stars'] = stars
+            record['mode'] = str(mode).encode()[:12]
+            record['session'] = str(session or '').encode()[:32]
+            record['label'] = str(label).upper().encode()[:8]
+            record['pixels'] = pixels
+            record['stroke_points'] = len(points)
+        return records, strokes
+
+    def _open_current(self):
+        """Open and lock the newest segment with room left, starting a new one when it is full."""
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            paths = segment_paths(self.directory)
+            number = int(SEGMENT_NAME.match(os.path.basename(paths[-1])).group(1)) if paths else 1
+            path = os.path.join(self.directory, f'drawings-{number:06d}.rec')
+            f = open(path, 'ab')
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                f.write(_header())
+                f.flush()
+                self._count('segments_started')
+                self.prune()
+                return path, f
+            if segment_paths(self.directory)[-1] != path:
+                f.close()  # another worker started a newer segment while we waited for the lock
+                continue
+            if size + RECORD_DTYPE.itemsize <= self.segment_bytes:
+                return path, f
+            # Full: start the next one (whoever gets there first writes its header)
+            f.close()
+            open(os.path.join(self.directory, f'drawings-{number + 1:06d}.rec'), 'ab').close()
+
+    def append(self, records, strokes):
+        """Append packed records (and their stroke points) to the archive, holding the segment lock."""
+        path, f = self._open_current()
+        try:
+            room = max(1, (self.segment_bytes - os.fstat(f.fileno()).st_size) // RECORD_DTYPE.itemsize)
+            if room < len(records):
+                # Split at the segment boundary; the rest goes to the next segment
+                self._write(path, f, records[:room], strokes[:room])
+                f.close()
+                f = None
+                self.append(records[room:], strokes[room:])
+                return
+            self._write(path, f, records, strokes)
+        finally:
+            if f is not None:
+                f.close()  # also releases the lock
+
+    @staticmethod
+    def _write(path, f, records, strokes):
+        if any(len(points) for points in strokes):
+            with open(os.path.splitext(path)[0] + '.strokes', 'ab') as sidecar:
+                offset = sidecar.tell() // 4
+                for record, points in zip(records, strokes):
+                    record['stroke_offset'] = offset
+                    offset += len(points)
+                sidecar.write(b''.join(points.tobytes() for points in strokes))
+        f.write(records.tobytes())
+        f.flush()
+
+    def prune(self):
+        """Delete the oldest segments until the archive fits max_bytes; the newest one is always kept."""
+        if self.max_bytes <= 0:
+            return
+        paths = segment_paths(self.directory)
+        sizes = []
+        for path in paths:
+            strokes = os.path.splitext(path)[0] + '.strokes'
+            try:
+                sizes.append(os.path.getsize(path) + (os.path.getsize(strokes) if os.path.exists(strokes) else 0))
+            except OSError:
+                sizes.append(0)  # pruned by another worker meanwhile
+        total = sum(sizes)
+        for path, size in zip(paths[:-1], sizes):
+            if total <= self.max_bytes:
+                break
+            for name in (path, os.path.splitext(path)[0] + '.strokes'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self._count('segments_pruned')
+            logger.info(f"Pruned {path} to keep the drawing archive under {self.max_bytes} bytes")
+
+    def flush(self):
+        """Wait until every queued drawing has been written (for tests and shutdown)."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        paths = segment_paths(self.directory)
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass  # pruned by another worker meanwhile
+        return dict(counters, enabled=self.enabled, pending=self._queue.qsize(), directory=self.directory,
+                    segments=len(paths), bytes=size, max_bytes=self.max_bytes)
+
+
+archive = DrawingArchive()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    directory = sys.argv[2] if len(sys.argv) > 2 else ARCHIVE_DIR
+    if command != 'stats':
+        print(__doc__)
+        sys.exit(2)
+    total = 0
+    for path, records in segments(directory):
+        total += len(records)
+        labels = np.unique(records['label'])
+        modes, mode_counts = np.unique(records['mode'], return_counts=True)
+        print(f"{path}: {len(records)} drawings, mean score {records['score'].mean() if len(records) else 0:.1f}, "
+              f"modes {dict(zip((m.decode() for m in modes), mode_counts.tolist()))}, "
+              f"{len(labels)} labels")
+    print(f"{total} drawings in {directory}")
@@ -0,0 +1,98 @@
+"""
+Decoding of drawing uploads.
+
+Three request formats are accepted by /evaluate and /multiplayer/submit_drawing:
+
+* application/json - the original format, a base64 PNG data URL in a JSON field,
+  or a "strokes" list that is rasterized on the server (see stroke_raster.py)
+* multipart/form-data - the PNG file itself in the same field, other values as form fields
+* application/octet-stream - raw 8-bit grayscale pixels (white background, dark strokes)
+  that the client already downsampled; the size comes from the X-Image-Width /
+  X-Image-Height headers (default 28x28) and other values from the query string
+"""
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+from stage_timing import span
+from stroke_raster import StrokeError, strokes_to_image
+
+RAW_SIZE = 28
+MAX_RAW_SIDE = 1024
+
+
+class UploadError(ValueError):
+    """The request body is not a drawing we can decode."""
+
+
+def decode_data_url(data):
+    """PIL image from a base64 PNG, with or without the data:image/png;base64, prefix."""
+    if data.startswith('data:image'):
+        data = data.split(',', 1)[1]
+    with span('base64'):
+        png = base64.b64decode(data)
+    return open_image(io.BytesIO(png))
+
+
+def open_image(stream):
+    with span('image_open'):
+        image = Image.open(stream)
+        # PIL decodes lazily; do it here so PNG decoding is timed here, not as 'preprocess'
+        image.load()
+    return image
+
+
+def decode_raw_gray(body, width=RAW_SIZE, height=RAW_SIZE):
+    """
+    Wrap a raw grayscale byte buffer without copying it.
+
+    A 28x28 buffer is returned as a read-only uint8 view that preprocess_image
+    consumes directly; other sizes are wrapped in a PIL image (sharing the
+    buffer) so the usual resize applies.
+    """
+    if not (0 < width <= MAX_RAW_SIDE and 0 < height <= MAX_RAW_SIDE):
+        raise UploadError(f"Unsupported raw image size {width}x{height}")
+    if len(body) != width * height:
+        raise UploadError(f"Expected {width * height} bytes for a {width}x{height} image, got {len(body)}")
+    if (width, height) == (RAW_SIZE, RAW_SIZE):
+        return np.frombuffer(body, dtype=np.uint8).reshape(height, width)
+    return Image.frombuffer('L', (width, height), body, 'raw', 'L', 0, 1)
+
+
+def read_drawing(req, field):
+    """
+    Return (image, fields) for a Flask request in any supported format.
+
+    image is a PIL image or a uint8 array (28x28 raw, or the canvas drawn from
+    strokes); fields holds the remaining request values (answer, level,
+    player, ...).
+    """
+    if req.is_json:
+        data = req.get_json(silent=True) or {}
+        drawing = data.get(field)
+        if not drawing and 'strokes' in data:
+            try:
+                return strokes_to_image(data), data
+            except StrokeError as e:
+                raise UploadError(str(e))
+        if not drawing:
+            return None, data
+        return decode_data_url(drawing), data
+    if req.mimetype == 'multipart/form-data':
+        upload = req.files.get(field)
+        if upload is None:
+            return None, req.form.to_dict()
+        return open_image(upload.stream), req.form.to_dict()
+    if req.mimetype == 'application/octet-stream':
+        try:
+            width = int(req.headers.get('X-Image-Width', RAW_SIZE))
+            height = int(req.headers.get('X-Image-Height', RAW_SIZE))
+        except ValueError:
+            raise UploadError("X-Image-Width and X-Image-Height must be integers")
+        body = req.get_data(cache=False)
+        if not body:
+            return None, req.args.to_dict()
+        return decode_raw_gray(body, width, height), req.args.to_dict()
+    raise UploadError(f"Unsupported content type: {req.mimetype or 'none'}")
@@ -0,0 +1,238 @@
+"""
+Game history and leaderboards, written behind the request threads.
+
+Every drawing the server scored (single-player, browser-scored ones it
+re-scored, multiplayer and rooms) is handed to record(), which only appends
+it to a bounded in-memory queue. Unverified browser claims are never
+recorded, since they could put any score on the leaderboards. A
+background thread writes the queue as a single multi-row INSERT in a single
+transaction every HISTORY_FLUSH_INTERVAL seconds (at most HISTORY_BATCH_MAX
+rows per transaction). So request threads never wait for a SQLite or
+Postgres commit. If the database is down, a batch is kept and retried. If the
+queue is full, results are dropped and counted rather than blocking.
+
+The leaderboards are served from the LeaderboardEntry table, a materialized
+summary of the top LEADERBOARD_SIZE results per question (keyed by answer),
+per player and per level. The thread rebuilds it from DrawingResult in one
+transaction every LEADERBOARD_REFRESH_INTERVAL seconds, after new rows were
+written. A read is then an indexed range scan of a few rows, never a
+ranking of the raw history.
+
+Each worker runs its own writer, and any of them may refresh the summary.
+Two rebuilds must not overlap, though: under Postgres READ COMMITTED both
+would delete the old rows and both insert theirs, leaving every rank twice.
+On Postgres a rebuild first takes a transaction-level advisory lock, and a
+worker that finds it taken skips the rebuild and tries again on its next
+pass. SQLite already lets only one transaction write at a time.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+GAME_HISTORY = os.environ.get('GAME_HISTORY', '1') == '1'
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '2'))
+HISTORY_BATCH_MAX = int(os.environ.get('HISTORY_BATCH_MAX', '500'))
+HISTORY_QUEUE_MAX = int(os.environ.get('HISTORY_QUEUE_MAX', '10000'))
+LEADERBOARD_REFRESH_INTERVAL = float(os.environ.get('LEADERBOARD_REFRESH_INTERVAL', '60'))
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '10'))
+LEADERBOARD_LOCK_ID = 0x4E4F5345  # Postgres advisory lock key held while rebuilding the summary
+
+BOARDS = ('question', 'player', 'level')
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    def __init__(self, enabled=GAME_HISTORY, flush_interval=HISTORY_FLUSH_INTERVAL, batch_max=HISTORY_BATCH_MAX,
+                 queue_size=HISTORY_QUEUE_MAX, refresh_interval=LEADERBOARD_REFRESH_INTERVAL,
+                 board_size=LEADERBOARD_SIZE):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.batch_max = batch_max
+        self.refresh_interval = refresh_interval
+        self.board_size = board_size
+        self.app = self.db = self.result_model = self.summary_model = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._retry = []  # rows of a batch whose transaction failed
+        self._write_lock = threading.Lock()  # one flush or refresh at a time
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._dirty = True  # rebuild the summary once after startup
+        self._last_refresh = 0.0
+        self.refreshed_at = None
+        self.counters = {'recorded': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'failed_batches': 0,
+                         'refreshes': 0, 'failed_refreshes': 0, 'skipped_refreshes': 0}
+        self.timings = {'last_flush_ms': None, 'last_refresh_ms': None}
+
+    def init_app(self, app, db, result_model, summary_model):
+        """Attach to the app's database; the tables must exist."""
+        self.app = app
+        self.db = db
+        self.result_model = result_model
+        self.summary_model = summary_model
+        atexit.register(self.flush)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='game-history', daemon=True)
+                self._thread.start()
+
+    def record(self, mode, answer, score, stars, player_name=None, session_key=None, question=None, level=None):
+        """Queue one scored drawing for writing; never blocks."""
+        if not self.enabled or self.app is None:
+            return False
+        self._ensure_started()
+        # The name comes straight from the request body, so it may be any JSON value
+        name = str(player_name).strip()[:100] if player_name is not None else ''
+        row = {'mode': mode, 'player_name': name or None, 'session_key': session_key,
+               'question': question, 'answer': str(answer).upper(), 'level': level, 'score': float(score),
+               'stars': int(stars), 'created_at': datetime.utcnow()}
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('recorded')
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._dirty and time.monotonic() - self._last_refresh >= self.refresh_interval:
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Game history writer failed: {e}")
+
+    def _take(self):
+        rows, self._retry = self._retry, []
+        while len(rows) < self.batch_max:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self):
+        """Write everything queued so far, one transaction per batch (also used by tests and at exit)."""
+        if self.app is None:
+            return 0
+        written = 0
+        with self._write_lock, self.app.app_context():
+            while True:
+                rows = self._take()
+                if not rows:
+                    return written
+                start = time.perf_counter()
+                try:
+                    self.db.session.execute(self.db.insert(self.result_model), rows)
+                    self.db.session.commit()
+                except Exception as e:
+                    self.db.session.rollback()
+                    self._count('failed_batches')
+                    logger.error(f"Could not write {len(rows)} game results, retrying next interval: {e}")
+                    # Keep the batch, minus what no longer fits alongside the queue
+                    keep = max(0, self._queue.maxsize - self._queue.qsize())
+                    self._retry = rows[:keep]
+                    self._count('dropped', len(rows) - len(self._retry))
+                    return written
+                self.timings['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                self._count('written', len(rows))
+                self._count('batches')
+                self._dirty = True
+                written += len(rows)
+
+    def refresh(self):
+        """Rebuild the leaderboard summary from the raw results in one transaction, holding the rebuild lock."""
+        if self.app is None:
+            return
+        db, result, summary = self.db, self.result_model, self.summary_model
+        start = time.perf_counter()
+        with self._write_lock, self.app.app_context():
+            self._dirty = False
+            now = datetime.utcnow()
+            try:
+                if not self._lock_summary():
+                    # Another worker is rebuilding it; try again next interval
+                    db.session.rollback()
+                    self._dirty = True
+                    self._count('skipped_refreshes')
+                    return
+                db.session.execute(db.delete(summary))
+                for board, column in (('question', result.answer), ('player', result.player_name),
+                                      ('level', result.level)):
+                    rank = db.func.row_number().over(partition_by=column,
+                                                     order_by=(result.score.desc(), result.created_at, result.id))
+                    ranked = db.select(column.label('key'), rank.label('rank'), result.player_name, result.answer,
+                                       result.level, result.score, result.stars, result.created_at) \
+                        .where(column.is_not(None)).subquery()
+                    top = db.select(db.literal(board), db.cast(ranked.c.key, db.String), ranked.c.rank,
+                                    ranked.c.player_name, ranked.c.answer, ranked.c.level, ranked.c.score,
+                                    ranked.c.stars, ranked.c.created_at, db.literal(now)) \
+                        .where(ranked.c.rank <= self.board_size)
+                    db.session.execute(db.insert(summary).from_select(
+                        ['board', 'key', 'rank', 'player_name', 'answer', 'level', 'score', 'stars', 'created_at',
+                         'refreshed_at'], top))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self._dirty = True
+                self._count('failed_refreshes')
+                logger.error(f"Could not refresh the leaderboards: {e}")
+                return
+        self._last_refresh = time.monotonic()
+        self.refreshed_at = now
+        self.timings['last_refresh_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        self._count('refreshes')
+
+    def _lock_summary(self):
+        """Take the rebuild lock for this transaction; False if another worker holds it."""
+        if self.db.engine.dialect.name != 'postgresql':
+            return True
+        return self.db.session.execute(self.db.select(self.db.func.pg_try_advisory_xact_lock(LEADERBOARD_LOCK_ID))) \
+            .scalar()
+
+    def leaderboard(self, board, key=None, limit=LEADERBOARD_SIZE):
+        """
+        Top results of one board from the summary, as {key: [entries]}, or
+        only the given key's. Must be called inside an app context.
+        """
+        if board not in BOARDS:
+            raise ValueError(f"unknown leaderboard {board!r} (expected one of {', '.join(BOARDS)})")
+        summary = self.summary_model
+        query = self.db.select(summary).where(summary.board == board, summary.rank <= limit)
+        if key is not None:
+            query = query.where(summary.key == (str(key).upper() if board == 'question' else str(key)))
+        boards = {}
+        for entry in self.db.session.execute(query.order_by(summary.key, summary.rank)).scalars():
+            boards.setdefault(entry.key, []).append(entry.to_dict())
+        return boards
+
+    def player_history(self, player_name, limit=20):
+        """A player's latest results, newest first. Must be called inside an app context."""
+        result = self.result_model
+        query = self.db.select(result).where(result.player_name == player_name) \
+            .order_by(result.created_at.desc(), result.id.desc()).limit(limit)
+        return [row.to_dict() for row in self.db.session.execute(query).scalars()]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters, **self.timings, enabled=self.enabled, pending=self._queue.qsize() + len(self._retry),
+                    mean_batch=round(counters['written'] / counters['batches'], 2) if counters['batches'] else None,
+                    refreshed_at=self.refreshed_at.isoformat() if self.refreshed_at else None)
+
+
+history = HistoryWriter()
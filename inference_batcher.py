@@ -0,0 +1,89 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects single-image predictions from many request threads and runs them
+    through the model as one batch.
+
+    A batch is flushed as soon as it holds max_batch_size images or the oldest
+    image has waited max_wait seconds, whichever comes first. Each caller gets
+    back only its own row of the prediction.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait=0.005):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='cnn-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, arr):
+        """Queue a (1, 28, 28, 1) array and return a Future for its prediction row."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((arr, future))
+        return future
+
+    def predict(self, arr, timeout=None):
+        """Blocking helper: predictions for a (1, 28, 28, 1) array."""
+        return self.submit(arr).result(timeout=timeout)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            live = [(a, f) for a, f in items if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            futures = [f for _, f in live]
+            try:
+                preds = self.predict_fn(np.concatenate([a for a, _ in live], axis=0))
+            except Exception as e:
+                logger.error(f"Batched prediction failed: {e}")
+                for f in futures:
+                    f.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(futures)
+            for i, f in enumerate(futures):
+                f.set_result(preds[i])
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'images': self.images,
+            'mean_batch_size': round(self.images / self.batches, 2) if self.batches else 0.0,
+            'queued': self._queue.qsize(),
+        }
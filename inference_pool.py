@@ -0,0 +1,348 @@
+"""
+Out-of-process inference workers.
+
+With INFERENCE_POOL_SIZE > 0, cnn_evaluator sends predictions to a pool of
+worker processes instead of running the model in the request thread. Each
+worker is a separate interpreter (``python -m inference_pool``) that loads the
+configured backend once. A slow predict then no longer ties up a web worker,
+and a crash in TensorFlow only takes down one worker.
+
+Images travel through one shared-memory block per worker. The request thread
+writes the preprocessed float32 batch into it and sends a 9-byte command over
+the worker's stdin. The worker writes its output back into the same block and
+replies on stdout. No pickling is involved.
+
+Requests that take longer than INFERENCE_TIMEOUT raise InferenceTimeout. The
+worker is killed and replaced, so /evaluate returns an error instead of
+hanging. While the replacement loads its model, a request that gets it
+waits at most INFERENCE_TIMEOUT and then fails with WorkerStarting (an
+InferenceError, so a 503). A monitor thread pings idle workers every
+INFERENCE_POOL_HEALTH_INTERVAL seconds and restarts dead or unresponsive ones.
+"""
+import atexit
+import logging
+import os
+import queue
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+INFERENCE_POOL_SIZE = int(os.environ.get('INFERENCE_POOL_SIZE', '0'))
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', '10'))
+# Loading TensorFlow and the .h5 takes several seconds, much longer than a predict
+INFERENCE_POOL_START_TIMEOUT = float(os.environ.get('INFERENCE_POOL_START_TIMEOUT', '60'))
+INFERENCE_POOL_HEALTH_INTERVAL = float(os.environ.get('INFERENCE_POOL_HEALTH_INTERVAL', '5'))
+INFERENCE_POOL_MAX_BATCH = int(os.environ.get('INFERENCE_POOL_MAX_BATCH', '64'))
+
+IMAGE_SHAPE = (28, 28, 1)
+MAX_OUTPUT_WIDTH = 256  # floats per image for the reply (10 classes or a 128-d embedding)
+
+# Commands: op (P=predict, E=embed, H=ping), request id, batch size
+REQUEST = struct.Struct('<cII')
+# Replies: request id, status (0=ok, 1=error), output width or error message length
+REPLY = struct.Struct('<IBI')
+READY = b'R'
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceError(RuntimeError):
+    """A prediction could not be completed by the worker pool."""
+
+
+class InferenceTimeout(InferenceError):
+    """A worker did not answer within INFERENCE_TIMEOUT."""
+
+
+class WorkerStarting(InferenceError):
+    """The free worker is still loading its model (it was just restarted)."""
+
+
+def _buffer_bytes(max_batch):
+    return max_batch * max(int(np.prod(IMAGE_SHAPE)), MAX_OUTPUT_WIDTH) * 4
+
+
+class _Worker:
+    """One worker process and its shared-memory block, used by one request at a time."""
+
+    def __init__(self, index, max_batch):
+        self.index = index
+        self.max_batch = max_batch
+        self.shm = shared_memory.SharedMemory(create=True, size=_buffer_bytes(max_batch))
+        env = dict(os.environ, INFERENCE_POOL_SIZE='0')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'inference_pool', self.shm.name, str(max_batch)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.ready = False
+        self.started_at = time.monotonic()
+        self._next_id = 0
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def _read(self, size, deadline):
+        data = b''
+        fd = self.process.stdout.fileno()
+        while len(data) < size:
+            # A past deadline still picks up what is already there
+            remaining = max(0.0, deadline - time.monotonic())
+            if not select.select([fd], [], [], remaining)[0]:
+                raise InferenceTimeout(f"inference worker {self.index} did not answer in time")
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                raise InferenceError(f"inference worker {self.index} exited (code {self.process.poll()})")
+            data += chunk
+        return data
+
+    def wait_ready(self, timeout, limit=None):
+        """
+        Wait for the model-loaded handshake, until timeout seconds after the
+        worker was started (InferenceTimeout). With limit, wait at most that
+        long from now, and raise WorkerStarting if it is still loading then.
+        """
+        if self.ready:
+            return
+        deadline = self.started_at + timeout
+        if limit is not None and time.monotonic() + limit < deadline:
+            try:
+                handshake = self._read(1, time.monotonic() + limit)
+            except InferenceTimeout:
+                raise WorkerStarting(f"inference worker {self.index} is still loading its model")
+        else:
+            handshake = self._read(1, deadline)
+        if handshake != READY:
+            raise InferenceError(f"inference worker {self.index} sent an invalid handshake")
+        self.ready = True
+
+    def _send(self, op, arr, n):
+        if n:
+            np.ndarray((n,) + IMAGE_SHAPE, dtype=np.float32, buffer=self.shm.buf)[:] = arr
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        try:
+            self.process.stdin.write(REQUEST.pack(op, self._next_id, n))
+        except (BrokenPipeError, OSError):
+            raise InferenceError(f"inference worker {self.index} exited (code {self.process.poll()})")
+        return self._next_id
+
+    def call(self, op, arr, timeout):
+        """Run op on arr (N <= max_batch images) and return an (N, width) array."""
+        n = 0 if arr is None else len(arr)
+        deadline = time.monotonic() + timeout
+        expected = self._send(op, arr, n)
+        clobbered = False
+        while True:
+            request_id, status, length = REPLY.unpack(self._read(REPLY.size, deadline))
+            message = self._read(length, deadline) if status else b''
+            if request_id != expected:
+                # A late reply to a request that was given up on: never this request's answer, whatever its status
+                logger.warning(f"inference worker {self.index} answered request {request_id} late; discarded")
+                # A late result was written into the shared block, over this request's input
+                clobbered = clobbered or not status
+                continue
+            if clobbered:
+                # Every earlier command is answered now, so the input can be written again safely
+                expected, clobbered = self._send(op, arr, n), False
+                continue
+            break
+        if status:
+            raise InferenceError(message.decode('utf-8', 'replace'))
+        return np.ndarray((n, length), dtype=np.float32, buffer=self.shm.buf).copy()
+
+    def stop(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class InferencePool:
+    def __init__(self, size=INFERENCE_POOL_SIZE, timeout=INFERENCE_TIMEOUT, max_batch=INFERENCE_POOL_MAX_BATCH,
+                 start_timeout=INFERENCE_POOL_START_TIMEOUT, health_interval=INFERENCE_POOL_HEALTH_INTERVAL):
+        self.size = size
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._monitor = None
+        self.ready = False  # every worker has loaded and warmed up its model once
+        self.counters = {'requests': 0, 'images': 0, 'timeouts': 0, 'errors': 0, 'restarts': 0, 'health_checks': 0,
+                         'worker_starting': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def start(self):
+        """Spawn the workers (once) and start the health monitor."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for index in range(self.size):
+                self._idle.put(_Worker(index, self.max_batch))
+            if self.health_interval > 0:
+                self._monitor = threading.Thread(target=self._monitor_loop, name='inference-pool-monitor', daemon=True)
+                self._monitor.start()
+            atexit.register(self.close)
+
+    def close(self):
+        """Stop idle workers and free their shared memory (at interpreter exit)."""
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def wait_ready(self):
+        """Block until every worker has loaded its model (used at boot)."""
+        self.start()
+        workers = [self._idle.get() for _ in range(self.size)]
+        try:
+            for worker in workers:
+                try:
+                    worker.wait_ready(self.start_timeout)
+                except InferenceError as e:
+                    logger.error(f"{e}; restarting")
+                    workers[workers.index(worker)] = self._replace(worker)
+            self.ready = True
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def _replace(self, worker):
+        worker.stop()
+        self._count('restarts')
+        return _Worker(worker.index, self.max_batch)
+
+    def _call(self, op, arr):
+        self.start()
+        deadline = time.monotonic() + self.timeout
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count('timeouts')
+            raise InferenceTimeout("no inference worker became free in time")
+        try:
+            # A restarted worker may take INFERENCE_POOL_START_TIMEOUT to load; a request waits at most its own timeout
+            worker.wait_ready(self.start_timeout, limit=max(0.0, deadline - time.monotonic()))
+            result = worker.call(op, arr, self.timeout)
+        except WorkerStarting:
+            self._count('worker_starting')
+            raise
+        except InferenceTimeout:
+            self._count('timeouts')
+            worker = self._replace(worker)
+            raise
+        except InferenceError:
+            self._count('errors')
+            if not worker.alive():
+                worker = self._replace(worker)
+            raise
+        finally:
+            self._idle.put(worker)
+        return result
+
+    def _run(self, op, arr):
+        arr = np.asarray(arr, dtype=np.float32)
+        self._count('requests')
+        self._count('images', len(arr))
+        chunks = [self._call(op, arr[i:i + self.max_batch]) for i in range(0, max(len(arr), 1), self.max_batch)]
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks, axis=0)
+
+    def predict(self, arr):
+        """(N, classes) probabilities for a preprocessed (N, 28, 28, 1) array."""
+        return self._run(b'P', arr)
+
+    def embed(self, arr):
+        """(N, dims) penultimate-layer embeddings for a preprocessed (N, 28, 28, 1) array."""
+        return self._run(b'E', arr)
+
+    def _monitor_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            # Only idle workers are checked; busy ones are covered by the request timeout
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not worker.alive():
+                        raise InferenceError(f"inference worker {worker.index} exited (code {worker.process.poll()})")
+                    # Picks up the handshake of a restarted worker, so requests do not have to
+                    worker.wait_ready(self.start_timeout, limit=0)
+                    worker.call(b'H', None, self.timeout)
+                    self._count('health_checks')
+                except WorkerStarting:
+                    pass
+                except InferenceError as e:
+                    logger.warning(f"Health check failed: {e}; restarting")
+                    worker = self._replace(worker)
+                finally:
+                    self._idle.put(worker)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=self.size, idle=self._idle.qsize(), started=self._started, ready=self.ready)
+
+
+def _worker_main(shm_name, max_batch):
+    """Worker process: load the model, then serve commands from stdin until it closes."""
+    from multiprocessing import resource_tracker
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # The parent owns the block; don't let this process's tracker unlink it on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    # Keep library chatter off the reply channel
+    sys.stdout = sys.stderr
+
+    import cnn_evaluator
+    cnn_evaluator.registry.warm_up()
+    stdout.write(READY)
+    stdout.flush()
+
+    inputs = np.ndarray((max_batch,) + IMAGE_SHAPE, dtype=np.float32, buffer=shm.buf)
+    while True:
+        header = stdin.read(REQUEST.size)
+        if len(header) < REQUEST.size:
+            break
+        op, request_id, n = REQUEST.unpack(header)
+        try:
+            if op == b'H':
+                out = np.empty((0, 0), dtype=np.float32)
+            else:
+                model = cnn_evaluator.registry.embedding_model() if op == b'E' else cnn_evaluator.registry.get()
+                out = np.asarray(model.predict(inputs[:n].copy(), verbose=0), dtype=np.float32).reshape(n, -1)
+                if out.shape[1] > MAX_OUTPUT_WIDTH:
+                    raise ValueError(f"model output width {out.shape[1]} exceeds {MAX_OUTPUT_WIDTH}")
+                np.ndarray(out.shape, dtype=np.float32, buffer=shm.buf)[:] = out
+            stdout.write(REPLY.pack(request_id, 0, out.shape[1]))
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}".encode('utf-8')
+            stdout.write(REPLY.pack(request_id, 1, len(message)) + message)
+        stdout.flush()
+    shm.close()
+
+
+if __name__ == '__main__':
+    _worker_main(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,253 @@
+"""
+Running score while the player is still drawing.
+
+While the player draws, the page posts the points added since its last post
+to /live/<id>/strokes. Each post is delta-encoded as in stroke_raster.py and
+numbered with a sequence number:
+
+    {"seq": 7, "strokes": [[x0, y0, dx1, dy1, ...], ...], "continue": true}
+
+"continue" means the first polyline extends the last stroke of the previous
+post. A live session is opened with the canvas the page draws on, as for a
+stroke submission ("canvas", "pen" and "ink"). Every session keeps that
+canvas drawn stroke_raster.reduction() times smaller (320x240 bytes for the
+single-player canvas) and draws only the new segments into it. It is
+preprocessed like any other upload when it is scored, so the running score
+and the final /evaluate score see the same frame.
+
+One scorer thread per worker looks for sessions that changed since their
+last score and were last scored at least 1/LIVE_SCORE_HZ seconds ago. It
+scores all of them in one score_preprocessed() batch. Each post returns
+the latest running score straight away and never waits for the model. So a
+session costs at most LIVE_SCORE_HZ predictions per second however often
+the page posts, and those predictions share batches with every other live
+session. LIVE_SCORE_HZ must be positive; the worker refuses to start otherwise. Live scores are optional, so a round is skipped while submissions
+are queued for the model, or when admission control sheds it.
+
+Like MemorySessionStore this is per process: route a live session to the
+worker that opened it.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from cnn_evaluator import admission, preprocess_uint8, score_preprocessed
+from inference_pool import InferenceError
+from stroke_raster import (MAX_STROKE_POINTS, RASTER_SIZE, StrokeError, blank_canvas, decode_strokes, draw_strokes,
+                           reduction)
+
+LIVE_SCORE_HZ = float(os.environ.get('LIVE_SCORE_HZ', '4'))
+LIVE_SESSION_TTL = float(os.environ.get('LIVE_SESSION_TTL', '120'))
+LIVE_MAX_SESSIONS = int(os.environ.get('LIVE_MAX_SESSIONS', '2000'))
+LIVE_BATCH_MAX = int(os.environ.get('LIVE_BATCH_MAX', '64'))
+
+
+class LiveNotFound(KeyError):
+    """No such live session (never opened, or expired)."""
+
+
+class LiveSequenceError(ValueError):
+    """A post arrived out of order; the page should resend everything with "reset"."""
+
+    def __init__(self, expected):
+        super().__init__(f"expected seq {expected}")
+        self.expected = expected
+
+
+class LiveDrawing:
+    """The strokes and incrementally drawn canvas of one live session."""
+
+    __slots__ = ('answer', 'canvas', 'factor', 'strokes', 'points', 'raster', 'seq', 'version', 'scored_version',
+                 'scored_seq', 'scored_at', 'score', 'touched')
+
+    def __init__(self, answer, canvas):
+        self.answer = answer
+        self.canvas = canvas
+        self.factor = reduction(canvas)
+        self.strokes = []
+        self.points = 0
+        self.raster = blank_canvas(canvas, self.factor)
+        self.seq = 0
+        self.version = 0
+        self.scored_version = 0
+        self.scored_seq = None
+        self.scored_at = 0.0
+        self.score = None
+        self.touched = time.monotonic()
+
+    def reset(self):
+        self.strokes = []
+        self.points = 0
+        self.raster = blank_canvas(self.canvas, self.factor)
+        self.score = self.scored_seq = None
+
+    def add(self, polylines, continues):
+        """Append decoded polylines and draw their segments into the canvas."""
+        if self.points + sum(len(points) for points in polylines) > MAX_STROKE_POINTS:
+            raise StrokeError(f"too many points (max {MAX_STROKE_POINTS})")
+        new = []
+        for i, points in enumerate(polylines):
+            if i == 0 and continues and self.strokes:
+                last = self.strokes[-1]
+                # Start from the stroke's last point so the joining segment is drawn too
+                new.append(np.concatenate([last[-1:], points]))
+                self.strokes[-1] = np.concatenate([last, points])
+            else:
+                new.append(points)
+                self.strokes.append(points)
+            self.points += len(points)
+        draw_strokes(self.raster, new, self.canvas, self.factor)
+
+    def render(self):
+        """The model input for the drawing so far."""
+        return preprocess_uint8(self.raster)
+
+
+class LiveScorer:
+    def __init__(self, score_fn=score_preprocessed, hz=LIVE_SCORE_HZ, ttl=LIVE_SESSION_TTL,
+                 max_sessions=LIVE_MAX_SESSIONS, max_batch=LIVE_BATCH_MAX,
+                 busy=lambda: admission.stats()['queue_depth'] > 0):
+        if not hz > 0:
+            # Scoring without a limit would spin the scorer thread while the model is busy
+            raise ValueError(f"LIVE_SCORE_HZ must be a positive rate in scores per second, got {hz}")
+        self.score_fn = score_fn
+        self.interval = 1.0 / hz
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_batch = max_batch
+        self.busy = busy
+        self._cond = threading.Condition()
+        self._sessions = OrderedDict()  # least recently updated first
+        self._thread = None
+        self.counters = {'opened': 0, 'expired': 0, 'evicted': 0, 'posts': 0, 'duplicate_posts': 0,
+                         'predictions': 0, 'batches': 0,
+                         'deferred_busy': 0, 'shed': 0}
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='live-scorer', daemon=True)
+            self._thread.start()
+
+    def _expire(self, now):
+        while self._sessions:
+            live_id, drawing = next(iter(self._sessions.items()))
+            if now - drawing.touched < self.ttl:
+                break
+            del self._sessions[live_id]
+            self.counters['expired'] += 1
+
+    def open(self, answer, canvas):
+        """Start a live session for one drawing of answer on a stroke_raster.Canvas; returns its id."""
+        with self._cond:
+            self._expire(time.monotonic())
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.counters['evicted'] += 1
+            live_id = secrets.token_urlsafe(9)
+            self._sessions[live_id] = LiveDrawing(str(answer).upper(), canvas)
+            self.counters['opened'] += 1
+            self._ensure_started()
+            return live_id
+
+    def update(self, live_id, seq, strokes, continues=False, reset=False):
+        """
+        Apply one post and return the latest running score.
+
+        Raises LiveNotFound, LiveSequenceError, or StrokeError for a malformed
+        delta.
+        """
+        polylines = decode_strokes(strokes)
+        with self._cond:
+            drawing = self._sessions.get(live_id)
+            if drawing is None:
+                raise LiveNotFound(live_id)
+            self.counters['posts'] += 1
+            if reset:
+                drawing.reset()
+            elif seq <= drawing.seq:
+                # A retried post that was already applied
+                self.counters['duplicate_posts'] += 1
+                return self._result(drawing)
+            elif seq != drawing.seq + 1:
+                raise LiveSequenceError(drawing.seq + 1)
+            drawing.add(polylines, continues and not reset)
+            drawing.seq = seq
+            drawing.version += 1
+            drawing.touched = time.monotonic()
+            self._sessions.move_to_end(live_id)
+            self._cond.notify()
+            return self._result(drawing)
+
+    def close(self, live_id):
+        with self._cond:
+            self._sessions.pop(live_id, None)
+
+    @staticmethod
+    def _result(drawing):
+        # score is the raw partial-credit percentage; the route scales it like /evaluate
+        return {'seq': drawing.seq, 'scored_seq': drawing.scored_seq, 'score': drawing.score}
+
+    def _collect(self, now):
+        """Sessions due for a score, and how long until the next one is due otherwise."""
+        due, wait = [], None
+        for drawing in self._sessions.values():
+            if drawing.version == drawing.scored_version or not drawing.strokes:
+                continue
+            ready_at = drawing.scored_at + self.interval
+            if ready_at <= now:
+                due.append(drawing)
+                if len(due) >= self.max_batch:
+                    break
+            elif wait is None or ready_at - now < wait:
+                wait = ready_at - now
+        return due, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._expire(now)
+                due, wait = self._collect(now)
+                if not due:
+                    self._cond.wait(wait)
+                    continue
+                if self.busy():
+                    # Submissions waiting for the model come first; try again next interval
+                    self.counters['deferred_busy'] += 1
+                    for drawing in due:
+                        drawing.scored_at = now
+                    continue
+                batch = np.empty((len(due), RASTER_SIZE, RASTER_SIZE), dtype=np.uint8)
+                for i, drawing in enumerate(due):
+                    batch[i] = drawing.render()
+                labels = [drawing.answer for drawing in due]
+                versions = [(drawing.version, drawing.seq) for drawing in due]
+            try:
+                scores = self.score_fn(batch, labels)
+            except InferenceError:
+                scores = None
+            with self._cond:
+                for drawing in due:
+                    drawing.scored_at = now
+                if scores is None:
+                    self.counters['shed'] += 1
+                    continue
+                for drawing, (version, seq), score in zip(due, versions, scores):
+                    drawing.score = float(score)
+                    drawing.scored_version = version
+                    drawing.scored_seq = seq
+                self.counters['batches'] += 1
+                self.counters['predictions'] += len(due)
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, sessions=len(self._sessions), hz=round(1.0 / self.interval, 3),
+                        mean_batch=round(self.counters['predictions'] / self.counters['batches'], 2)
+                        if self.counters['batches'] else None)
+
+
+live_scorer = LiveScorer()
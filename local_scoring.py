@@ -0,0 +1,122 @@
+"""
+Server side of in-browser scoring.
+
+With the browser export present (python browser_model.py export), the
+single-player page loads the CNN and scores drawings itself (see
+static/js/cnn.js). It shows the stars right away and then posts only the
+claimed score and the 28x28 input it scored to /evaluate_local.
+
+The page downsamples the whole canvas the way Preprocessor.resize does,
+which is the frame every server path uses for an image or strokes. So
+whether the model loaded does not change the stars. PREPROCESS_CROP frames
+drawings differently on the server, so local scoring is off with it.
+
+The server trusts most claims. It re-scores a random LOCAL_VERIFY_FRACTION
+of them through evaluate_with_cnn, plus every claim made with a different
+model version than the current export. A verified score that differs from
+the claim by more than LOCAL_SCORE_TOLERANCE (scaled points) is counted
+and logged as a mismatch, which means tampering or drift. When inference is
+overloaded, verification is skipped, since the child already has their
+result.
+
+stats() reports how many model calls the browsers took off the server.
+"""
+import logging
+import os
+import random
+import threading
+
+from browser_model import MANIFEST_PATH, read_manifest
+
+LOCAL_SCORING = os.environ.get('LOCAL_SCORING', '1') == '1'
+LOCAL_VERIFY_FRACTION = float(os.environ.get('LOCAL_VERIFY_FRACTION', '0.1'))
+LOCAL_SCORE_TOLERANCE = float(os.environ.get('LOCAL_SCORE_TOLERANCE', '1.0'))
+# Same switch as preprocessing.py, read here so importing this module does not load cv2
+PREPROCESS_CROP = os.environ.get('PREPROCESS_CROP', '0') == '1'
+
+logger = logging.getLogger(__name__)
+
+
+class LocalScoring:
+    def __init__(self, manifest_path=MANIFEST_PATH, verify_fraction=LOCAL_VERIFY_FRACTION,
+                 tolerance=LOCAL_SCORE_TOLERANCE, enabled=LOCAL_SCORING):
+        self.manifest_path = manifest_path
+        self.verify_fraction = verify_fraction
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._mtime = None
+        # The browser scores the uncropped 28x28 canvas, so it only matches the server without cropping
+        self.enabled = enabled and not PREPROCESS_CROP
+        self.counters = {'submissions': 0, 'trusted': 0, 'verified': 0, 'mismatches': 0, 'stale_model': 0,
+                         'verify_skipped': 0, 'server_evaluations': 0}
+
+    def version(self):
+        """Version of the current browser export, or None if there is none."""
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                try:
+                    self._manifest = read_manifest(self.manifest_path)
+                    self._mtime = mtime
+                except (OSError, ValueError) as e:
+                    logger.error(f"Could not read {self.manifest_path}: {e}")
+                    return None
+        return self._manifest['version']
+
+    def available(self):
+        return self.enabled and self.version() is not None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def should_verify(self, claimed_version):
+        """Whether to re-score this claim on the server; counts the submission."""
+        self._count('submissions')
+        if not self.available():
+            return True
+        if claimed_version != self.version():
+            self._count('stale_model')
+            return True
+        return random.random() < self.verify_fraction
+
+    def trusted(self):
+        self._count('trusted')
+
+    def verified(self, claimed, actual, answer):
+        """Record a re-scored claim; returns False when it does not match."""
+        self._count('verified')
+        if abs(claimed - actual) <= self.tolerance:
+            return True
+        self._count('mismatches')
+        logger.warning(f"Local score mismatch for '{answer}': browser {claimed:.2f}, server {actual:.2f}")
+        return False
+
+    def skipped(self):
+        self._count('verify_skipped')
+
+    def server_evaluation(self):
+        """Count a drawing scored by /evaluate, for the offload ratio."""
+        self._count('server_evaluations')
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        avoided = counters['trusted'] + counters['verify_skipped']
+        model_calls = counters['verified'] + counters['server_evaluations']
+        return dict(
+            counters,
+            enabled=self.available(),
+            model_version=self.version(),
+            verify_fraction=self.verify_fraction,
+            model_calls_avoided=avoided,
+            # Share of single-player drawings that never reached the server's model
+            offload_ratio=round(avoided / (avoided + model_calls), 4) if avoided + model_calls else None,
+        )
+
+
+local_scoring = LocalScoring()
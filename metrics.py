@@ -0,0 +1,229 @@
+"""
+Prometheus metrics for the NoseDraw apps.
+
+init_app(app) serves GET /metrics in the Prometheus text format, next to
+/health, and installs request hooks that feed every request's stage_timing
+spans (base64, image_open, decode, preprocess, model, session, response)
+into latency histograms. Routes add counters for errors, scaled scores and
+stars; callback gauges such as the number of active game sessions are read
+at scrape time. There is no client library dependency: an observation is a
+bisect and a few additions under one lock.
+
+A fraction METRICS_TRACE_SAMPLE of requests, and any request sent with an
+X-Trace: 1 header, is traced in detail (start offset and duration of every
+span); the newest METRICS_TRACE_KEEP traces are served as JSON from
+GET /metrics/traces.
+"""
+import logging
+import math
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import Response, jsonify, request
+
+import stage_timing
+from cnn_evaluator import SCORE_SCALE, STAR_THRESHOLDS
+
+METRICS_TRACE_SAMPLE = float(os.environ.get('METRICS_TRACE_SAMPLE', '0'))
+METRICS_TRACE_KEEP = int(os.environ.get('METRICS_TRACE_KEEP', '100'))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Scaled scores (0 to 100 x SCORE_SCALE): the star thresholds, then the 5-star range split up to the maximum
+SCORE_BUCKETS = STAR_THRESHOLDS + (100, 200, round(100 * SCORE_SCALE, 2))
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_labels(self.labels, key)} {_number(value)}' for key, value in sorted(values.items())]
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.type = 'histogram'
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Callback:
+    """
+    Value read at scrape time: fn() returns a number, or {label values: number}.
+    Errors are logged and the metric is left out of that scrape.
+    """
+
+    def __init__(self, name, help, fn, labels=(), type='gauge'):
+        self.name, self.help, self.labels, self.type = name, help, tuple(labels), type
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning(f"Metric {self.name} failed: {e}")
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f'{self.name}{_labels(self.labels, key)} {_number(v)}' for key, v in sorted(value.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, fn, labels=(), type='gauge'):
+        return self.register(Callback(name, help, fn, labels, type))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter('nosedraw_requests_total', 'HTTP requests handled.', ('endpoint', 'status'))
+request_seconds = registry.histogram('nosedraw_request_duration_seconds', 'Time spent in the request handler.',
+                                     ('endpoint',))
+stage_seconds = registry.histogram('nosedraw_stage_duration_seconds',
+                                   'Time spent per stage (base64, image_open, decode, preprocess, model, session, '
+                                   'response).', ('stage',))
+errors_total = registry.counter('nosedraw_errors_total', 'Failed scoring requests by kind.', ('endpoint', 'kind'))
+scores = registry.histogram('nosedraw_score', f'Scaled drawing scores (0-{100 * SCORE_SCALE:g}).', ('mode',), SCORE_BUCKETS)
+stars_total = registry.counter('nosedraw_stars_total', 'Drawings scored, by stars awarded.', ('mode', 'stars'))
+traces_total = registry.counter('nosedraw_traces_sampled_total', 'Requests traced in detail.')
+
+_traces = deque(maxlen=METRICS_TRACE_KEEP)
+
+
+def observe_score(mode, score, stars):
+    scores.observe(score, mode)
+    stars_total.inc(mode, stars)
+
+
+def count_error(kind):
+    errors_total.inc(request.endpoint or 'unmatched', kind)
+
+
+def _begin():
+    trace = request.headers.get('X-Trace') == '1' or (
+        METRICS_TRACE_SAMPLE > 0 and random.random() < METRICS_TRACE_SAMPLE)
+    stage_timing.begin(trace)
+
+
+def _finish(response):
+    trace = stage_timing.take_trace()
+    stages = stage_timing.end()
+    endpoint = request.endpoint or 'unmatched'
+    requests_total.inc(endpoint, response.status_code)
+    for stage, seconds in stages.items():
+        if stage == 'total':
+            request_seconds.observe(seconds, endpoint)
+        else:
+            stage_seconds.observe(seconds, stage)
+    if trace is not None:
+        traces_total.inc()
+        _traces.append({
+            'at': time.time(),
+            'endpoint': endpoint,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(stages.get('total', 0.0) * 1000, 3),
+            'spans': [{'stage': stage, 'start_ms': round(start * 1000, 3), 'duration_ms': round(seconds * 1000, 3)}
+                      for stage, start, seconds in sorted(trace, key=lambda span: span[1])],
+        })
+    if stage_timing.SERVER_TIMING and stages:
+        response.headers['Server-Timing'] = stage_timing.server_timing_header(stages)
+    return response
+
+
+def metrics_endpoint():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def traces_endpoint():
+    return jsonify({'sample_rate': METRICS_TRACE_SAMPLE, 'traces': list(_traces)})
+
+
+def init_app(app):
+    """Install the timing hooks and the /metrics and /metrics/traces endpoints."""
+    app.before_request(_begin)
+    app.after_request(_finish)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    app.add_url_rule('/metrics/traces', 'metrics_traces', traces_endpoint)
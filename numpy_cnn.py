@@ -0,0 +1,170 @@
+"""
+Pure-NumPy forward pass for the EMNIST CNN.
+
+The Keras model is exported once to a compact .npz (weights plus a small
+layer spec) so web workers can score drawings without importing TensorFlow:
+
+    python numpy_cnn.py export            # emnist_cnn_model.h5 -> emnist_cnn_model.npz
+    python numpy_cnn.py check             # score parity against Keras
+"""
+import json
+import os
+import sys
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+H5_PATH = 'emnist_cnn_model.h5'
+NPZ_PATH = 'emnist_cnn_model.npz'
+
+SUPPORTED_LAYERS = ('Conv2D', 'MaxPooling2D', 'Flatten', 'Dense', 'Dropout', 'InputLayer')
+
+
+def export_npz(h5_path=H5_PATH, npz_path=NPZ_PATH):
+    """Convert a Keras .h5 Sequential model to the .npz format read by NumpyCNN."""
+    from tensorflow.keras.models import load_model
+
+    model = load_model(h5_path)
+    spec = []
+    arrays = {}
+    for i, layer in enumerate(model.layers):
+        kind = type(layer).__name__
+        if kind not in SUPPORTED_LAYERS:
+            raise ValueError(f"Unsupported layer for NumPy export: {layer.name} ({kind})")
+        config = layer.get_config()
+        entry = {'type': kind, 'name': layer.name}
+        if kind == 'Conv2D':
+            if config.get('padding') != 'valid' or tuple(config.get('strides', (1, 1))) != (1, 1):
+                raise ValueError(f"Only stride-1 'valid' convolutions are supported ({layer.name})")
+            entry['activation'] = config.get('activation', 'linear')
+        elif kind == 'Dense':
+            entry['activation'] = config.get('activation', 'linear')
+        elif kind == 'MaxPooling2D':
+            entry['pool_size'] = list(config.get('pool_size', (2, 2)))
+        weights = layer.get_weights()
+        if weights:
+            arrays[f'{i}_kernel'] = weights[0].astype(np.float32)
+            arrays[f'{i}_bias'] = weights[1].astype(np.float32)
+        spec.append(entry)
+    arrays['spec'] = np.frombuffer(json.dumps(spec).encode('utf-8'), dtype=np.uint8)
+    np.savez(npz_path, **arrays)
+    return npz_path
+
+
+def _activate(x, name):
+    if name == 'relu':
+        return np.maximum(x, 0.0, out=x)
+    if name == 'softmax':
+        x -= x.max(axis=-1, keepdims=True)
+        np.exp(x, out=x)
+        x /= x.sum(axis=-1, keepdims=True)
+        return x
+    if name in (None, 'linear'):
+        return x
+    raise ValueError(f"Unsupported activation: {name}")
+
+
+class NumpyCNN:
+    """Drop-in replacement for the Keras model's predict() backed by NumPy."""
+
+    def __init__(self, npz_path=NPZ_PATH):
+        with np.load(npz_path) as data:
+            self.spec = json.loads(data['spec'].tobytes().decode('utf-8'))
+            self.params = {k: data[k] for k in data.files if k != 'spec'}
+        self.path = npz_path
+
+    def get_weights(self):
+        return list(self.params.values())
+
+    def _conv2d(self, x, kernel, bias):
+        kh, kw, cin, cout = kernel.shape
+        n, h, w, _ = x.shape
+        # (n, h', w', c, kh, kw) view -> (n*h'*w', kh*kw*c) patches matching the kernel layout
+        windows = sliding_window_view(x, (kh, kw), axis=(1, 2))
+        oh, ow = windows.shape[1], windows.shape[2]
+        patches = windows.transpose(0, 1, 2, 4, 5, 3).reshape(n * oh * ow, kh * kw * cin)
+        out = patches @ kernel.reshape(kh * kw * cin, cout)
+        out += bias
+        return out.reshape(n, oh, ow, cout)
+
+    @staticmethod
+    def _max_pool(x, pool_size):
+        ph, pw = pool_size
+        n, h, w, c = x.shape
+        oh, ow = h // ph, w // pw
+        x = x[:, :oh * ph, :ow * pw, :]
+        return x.reshape(n, oh, ph, ow, pw, c).max(axis=(2, 4))
+
+    def forward(self, arr, stop_before=None):
+        """Run the layers in order; stop_before=-1 returns the penultimate activations."""
+        x = np.asarray(arr, dtype=np.float32)
+        layers = self.spec if stop_before is None else self.spec[:stop_before]
+        for i, layer in enumerate(layers):
+            kind = layer['type']
+            if kind == 'Conv2D':
+                x = _activate(self._conv2d(x, self.params[f'{i}_kernel'], self.params[f'{i}_bias']), layer['activation'])
+            elif kind == 'MaxPooling2D':
+                x = self._max_pool(x, layer['pool_size'])
+            elif kind == 'Flatten':
+                x = x.reshape(x.shape[0], -1)
+            elif kind == 'Dense':
+                x = x @ self.params[f'{i}_kernel']
+                x += self.params[f'{i}_bias']
+                x = _activate(x, layer['activation'])
+        return x
+
+    def predict(self, arr, verbose=0):
+        return self.forward(arr)
+
+    def embedding_model(self):
+        return NumpyEmbedding(self)
+
+
+class NumpyEmbedding:
+    """predict()-compatible view of a NumpyCNN that returns penultimate-layer activations."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, arr, verbose=0):
+        return self.model.forward(arr, stop_before=-1)
+
+
+def check_parity(h5_path=H5_PATH, npz_path=NPZ_PATH, samples=256):
+    """Compare NumPy and Keras outputs on random inputs and the reference templates."""
+    from tensorflow.keras.models import load_model
+    import cnn_evaluator
+
+    keras_model = load_model(h5_path)
+    numpy_model = NumpyCNN(npz_path)
+    rng = np.random.default_rng(0)
+    batch = [rng.random((samples, 28, 28, 1), dtype=np.float32)]
+    for reference_dir in (cnn_evaluator.REFERENCE_PATH, 'NoseDrawDuel/multiplayer/static/assets/reference_templates'):
+        if not os.path.isdir(reference_dir):
+            continue
+        for name in sorted(os.listdir(reference_dir)):
+            if name.endswith('.png'):
+                img = cnn_evaluator.get_reference_image(os.path.splitext(name)[0], reference_dir)
+                batch.append(cnn_evaluator.preprocess_image(img))
+    batch = np.concatenate(batch, axis=0)
+    expected = keras_model.predict(batch, verbose=0)
+    actual = numpy_model.predict(batch)
+    max_diff = float(np.abs(expected - actual).max())
+    return {
+        'images': int(batch.shape[0]),
+        'max_abs_prob_diff': max_diff,
+        # Upper bound on the change of the scaled score shown to players
+        'max_abs_scaled_score_diff': max_diff * 100.0 * cnn_evaluator.SCORE_SCALE,
+        'top1_agreement': float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()),
+    }
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    if command == 'export':
+        print(f"Wrote {export_npz()}")
+    elif command == 'check':
+        print(json.dumps(check_parity(), indent=2))
+    else:
+        print(__doc__)
+        sys.exit(2)
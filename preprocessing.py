@@ -0,0 +1,158 @@
+"""
+Shared drawing preprocessing for every evaluator.
+
+All paths that turn a drawing into model input (cnn_evaluator, both
+ImageRecognizer classes, ScoreEvaluator) go through Preprocessor, so the two
+apps feed the CNN exactly the same tensor for the same drawing.
+
+Stages, each writing into per-thread buffers that are reused between calls:
+
+    gray       -> composite on white and convert to 8-bit luminance
+    binarize   -> optional threshold + morphological cleanup
+    crop       -> optional square crop around the ink, centered with a margin
+    resize     -> cv2 INTER_AREA straight to the target size
+    normalize  -> float32 in [0, 1], shaped (1, h, w, 1)
+
+The output convention is the one the model was used with: white background
+(1.0) and dark ink.
+"""
+import os
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# Crop to the ink and center it before resizing (off keeps the whole canvas)
+PREPROCESS_CROP = os.environ.get('PREPROCESS_CROP', '0') == '1'
+# Empty border around the cropped ink, as a fraction of its larger side
+PREPROCESS_MARGIN = float(os.environ.get('PREPROCESS_MARGIN', '0.15'))
+
+INK_LEVEL = 250  # pixels darker than this count as ink when cropping
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+
+
+class Preprocessor:
+    def __init__(self, size=28, crop=False, margin=PREPROCESS_MARGIN, binarize=False):
+        self.width, self.height = (size, size) if isinstance(size, int) else size
+        self.crop = crop
+        self.margin = margin
+        self.binarize = binarize
+        self._local = threading.local()
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        buf = buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def gray(self, image):
+        """8-bit grayscale of a PIL image, transparent areas composited onto white."""
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        # PIL's C conversion of a single channel is much cheaper than
+        # copying the full RGB(A) array into NumPy first
+        gray = np.asarray(image.convert('L') if image.mode != 'L' else image)
+        if 'A' not in image.getbands():
+            return gray
+        alpha = np.asarray(image.getchannel('A'))
+        out = self._buffer('gray', gray.shape)
+        # out = 255 - (255 - gray) * alpha / 255, i.e. alpha-composite over white
+        cv2.subtract(255, gray, dst=out)
+        cv2.multiply(out, alpha, dst=out, scale=1.0 / 255)
+        cv2.subtract(255, out, dst=out)
+        return out
+
+    def clean(self, gray):
+        """Threshold to black/white and remove specks and gaps."""
+        out = self._buffer('binary', gray.shape)
+        cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY, dst=out)
+        # Ink is dark here, so closing removes dark specks and opening fills small gaps in strokes
+        cv2.morphologyEx(out, cv2.MORPH_CLOSE, MORPH_KERNEL, dst=out)
+        cv2.morphologyEx(out, cv2.MORPH_OPEN, MORPH_KERNEL, dst=out)
+        return out
+
+    def crop_to_ink(self, gray):
+        """Square region around the ink with a margin, padded with white where needed."""
+        mask = self._buffer('mask', gray.shape)
+        cv2.threshold(gray, INK_LEVEL, 255, cv2.THRESH_BINARY_INV, dst=mask)
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            return gray
+        side = int(round(max(w, h) * (1 + 2 * self.margin)))
+        left = x + w // 2 - side // 2
+        top = y + h // 2 - side // 2
+        if left >= 0 and top >= 0 and left + side <= gray.shape[1] and top + side <= gray.shape[0]:
+            return gray[top:top + side, left:left + side]
+        square = np.full((side, side), 255, dtype=np.uint8)
+        sx, sy = max(0, left), max(0, top)
+        ex, ey = min(gray.shape[1], left + side), min(gray.shape[0], top + side)
+        square[sy - top:ey - top, sx - left:ex - left] = gray[sy:ey, sx:ex]
+        return square
+
+    def resize(self, gray):
+        """Area-downsample to the target size."""
+        if gray.shape == (self.height, self.width):
+            return gray
+        # cv2's INTER_AREA is several times faster for exact integer factors, so
+        # first reduce by the largest whole factor (trimming < factor edge pixels)
+        factor = min(gray.shape[0] // self.height, gray.shape[1] // self.width)
+        if factor >= 2:
+            h, w = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+            top, left = (gray.shape[0] - h) // 2, (gray.shape[1] - w) // 2
+            reduced = self._buffer('reduced', (h // factor, w // factor))
+            gray = cv2.resize(gray[top:top + h, left:left + w], (w // factor, h // factor),
+                              dst=reduced, interpolation=cv2.INTER_AREA)
+            if gray.shape == (self.height, self.width):
+                return gray
+        out = self._buffer('small', (self.height, self.width))
+        return cv2.resize(gray, (self.width, self.height), dst=out, interpolation=cv2.INTER_AREA)
+
+    def _stages(self, image, timings):
+        clock = time.perf_counter
+        t0 = clock()
+        if isinstance(image, np.ndarray):
+            gray = image
+        else:
+            gray = self.gray(image)
+        t1 = clock()
+        if self.binarize:
+            gray = self.clean(gray)
+        t2 = clock()
+        if self.crop:
+            gray = self.crop_to_ink(gray)
+        t3 = clock()
+        small = self.resize(gray)
+        t4 = clock()
+        if timings is not None:
+            for stage, seconds in (('gray', t1 - t0), ('binarize', t2 - t1), ('crop', t3 - t2), ('resize', t4 - t3)):
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return small
+
+    def run_uint8(self, image, timings=None):
+        """
+        Preprocessed drawing as a new (height, width) uint8 array.
+
+        image may be a PIL image or a 2-D uint8 array (already grayscale). If
+        timings is a dict, the seconds spent in each stage are added to it.
+        """
+        return self._stages(image, timings).copy()
+
+    def run(self, image, timings=None):
+        """Model input: float32 in [0, 1] shaped (1, height, width, 1)."""
+        small = self._stages(image, timings)
+        start = time.perf_counter()
+        out = np.empty((1, self.height, self.width, 1), dtype=np.float32)
+        np.multiply(small, np.float32(1.0 / 255.0), out=out.reshape(self.height, self.width))
+        if timings is not None:
+            timings['normalize'] = timings.get('normalize', 0.0) + time.perf_counter() - start
+        return out
+
+
+@lru_cache(maxsize=None)
+def get_preprocessor(size=28, crop=PREPROCESS_CROP, margin=PREPROCESS_MARGIN, binarize=False):
+    """Shared Preprocessor for a configuration (instances hold per-thread buffers)."""
+    return Preprocessor(size, crop=crop, margin=margin, binarize=binarize)
+
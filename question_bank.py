@@ -0,0 +1,171 @@
+"""
+The question bank shared by the single-player and multiplayer games.
+
+questions.json is parsed once into an immutable snapshot. The snapshot
+holds the questions, lookup indexes by id, level and type, and the
+/questions response pre-serialized as plain and gzip bytes under a strong
+ETag. Filtered and paginated responses (?level=, ?type=, ?page=&per_page=)
+are serialized on first use and then kept with the snapshot.
+
+respond() answers If-None-Match with 304 Not Modified. It sends the gzip
+bytes when the client accepts them.
+
+The file is checked at most every QUESTIONS_RELOAD_INTERVAL seconds. An
+edit takes effect without a restart, and changes the ETag. A file that
+fails to parse is logged, and the last good snapshot is kept.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import Response
+
+QUESTIONS_PATH = os.environ.get('QUESTIONS_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'questions.json')
+QUESTIONS_RELOAD_INTERVAL = float(os.environ.get('QUESTIONS_RELOAD_INTERVAL', '2'))
+QUESTIONS_PER_PAGE_MAX = 100
+
+MAX_CACHED_VARIANTS = 256
+
+logger = logging.getLogger(__name__)
+
+
+class Encoded:
+    """One serialized response body: plain bytes, gzip bytes and their ETags."""
+
+    __slots__ = ('body', 'gzip_body', 'etag', 'gzip_etag')
+
+    def __init__(self, payload):
+        self.body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        # mtime=0 keeps the gzip bytes (and so the ETag) stable across reloads of the same content
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = digest
+        self.gzip_etag = f'{digest}-gzip'
+
+
+class Snapshot:
+    def __init__(self, data):
+        self.questions = list(data['questions'])
+        self.by_id = {q['id']: q for q in self.questions if 'id' in q}
+        self.by_level, self.by_type = {}, {}
+        for q in self.questions:
+            self.by_level.setdefault(q.get('level'), []).append(q)
+            self.by_type.setdefault(q.get('type'), []).append(q)
+        self.full = Encoded(data)
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def select(self, level=None, type=None):
+        if level is not None and type is not None:
+            return [q for q in self.by_level.get(level, ()) if q.get('type') == type]
+        if level is not None:
+            return self.by_level.get(level, [])
+        if type is not None:
+            return self.by_type.get(type, [])
+        return self.questions
+
+    def encoded(self, level=None, type=None, page=None, per_page=None):
+        """The Encoded response for a filter/page, built on first use."""
+        key = (level, type, page, per_page)
+        if key == (None, None, None, None):
+            return self.full
+        with self._lock:
+            variant = self._variants.get(key)
+        if variant is not None:
+            return variant
+        questions = self.select(level, type)
+        payload = {'questions': questions}
+        if page is not None:
+            per_page = per_page or 10
+            start = (page - 1) * per_page
+            payload = {'questions': questions[start:start + per_page], 'page': page, 'per_page': per_page,
+                       'total': len(questions), 'pages': -(-len(questions) // per_page)}
+        variant = Encoded(payload)
+        with self._lock:
+            if len(self._variants) >= MAX_CACHED_VARIANTS:
+                self._variants.clear()
+            self._variants[key] = variant
+        return variant
+
+
+class QuestionBank:
+    def __init__(self, path=QUESTIONS_PATH, reload_interval=QUESTIONS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._signature = None
+        self._checked_at = 0.0
+        self.counters = {'loads': 0, 'load_errors': 0, 'responses': 0, 'not_modified': 0, 'gzip': 0}
+
+    def _file_signature(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def snapshot(self):
+        """The current Snapshot, reloaded first if questions.json changed."""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and (self.reload_interval <= 0 or now - self._checked_at < self.reload_interval):
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and now - self._checked_at < self.reload_interval:
+                return self._snapshot
+            self._checked_at = now
+            try:
+                signature = self._file_signature()
+                if signature != self._signature:
+                    with open(self.path, 'rb') as f:
+                        self._snapshot = Snapshot(json.load(f))
+                    self._signature = signature
+                    self.counters['loads'] += 1
+                    logger.info(f"Loaded {len(self._snapshot.questions)} questions from {self.path}")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.counters['load_errors'] += 1
+                if self._snapshot is None:
+                    raise
+                logger.error(f"Keeping the previous question bank, {self.path} could not be loaded: {e}")
+            return self._snapshot
+
+    def questions(self, level=None, type=None):
+        return self.snapshot().select(level, type)
+
+    def get(self, question_id):
+        return self.snapshot().by_id.get(question_id)
+
+    def random_question(self, level=None, type=None):
+        snapshot = self.snapshot()
+        return random.choice(snapshot.select(level, type) or snapshot.questions)
+
+    def respond(self, request, level=None, type=None, page=None, per_page=None):
+        """Flask response for /questions: 304 if the client's copy is current, gzip when accepted."""
+        encoded = self.snapshot().encoded(level, type, page, per_page)
+        self.counters['responses'] += 1
+        use_gzip = request.accept_encodings['gzip'] > 0
+        etag = encoded.gzip_etag if use_gzip else encoded.etag
+        headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains(encoded.etag) or request.if_none_match.contains(encoded.gzip_etag):
+            self.counters['not_modified'] += 1
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(encoded.gzip_body if use_gzip else encoded.body, mimetype='application/json',
+                                headers=headers)
+            if use_gzip:
+                self.counters['gzip'] += 1
+                response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag)
+        return response
+
+    def stats(self):
+        snapshot = self._snapshot
+        return dict(self.counters, path=self.path, questions=len(snapshot.questions) if snapshot else 0,
+                    etag=snapshot.full.etag if snapshot else None)
+
+
+bank = QuestionBank()
@@ -0,0 +1,140 @@
+"""
+Embedding index of the reference templates.
+
+Every <label>.png in the reference directory is embedded once with the CNN's
+penultimate layer and stored as one L2-normalized (labels, dims) float32
+matrix, so comparing a drawing with one template, or with all of them, is a
+single matrix-vector product instead of two forward passes.
+
+The matrix is persisted to REFERENCE_INDEX_PATH together with a fingerprint
+of the template files (name, size, mtime) and the model that embedded them.
+It is rebuilt when the fingerprint no longer matches, e.g. after a template
+is edited or the model is reloaded.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+REFERENCE_INDEX_PATH = os.environ.get('REFERENCE_INDEX_PATH', 'reference_index.npz')
+# How often (seconds) the template directory is checked for changes; 0 disables the check
+REFERENCE_INDEX_CHECK_INTERVAL = float(os.environ.get('REFERENCE_INDEX_CHECK_INTERVAL', '5'))
+
+logger = logging.getLogger(__name__)
+
+
+def l2_normalize(x):
+    """Rows of x scaled to unit length (all-zero rows stay zero)."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+class ReferenceIndex:
+    """
+    embed_fn turns a list of PIL images into an (N, dims) array; model_tag()
+    returns a string identifying the current model (part of the fingerprint).
+    """
+
+    def __init__(self, directory, embed_fn, model_tag, cache_path=REFERENCE_INDEX_PATH,
+                 check_interval=REFERENCE_INDEX_CHECK_INTERVAL):
+        self.directory = directory
+        self.embed_fn = embed_fn
+        self.model_tag = model_tag
+        self.cache_path = cache_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state = None  # (fingerprint, labels, row by label, matrix)
+        self._checked_at = 0.0
+        self.stats = {'builds': 0, 'loads': 0}
+
+    def _template_files(self):
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"Reference template directory not found: {self.directory}")
+        names = sorted(n for n in os.listdir(self.directory) if n.lower().endswith('.png'))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _fingerprint(self, files):
+        digest = hashlib.sha1(self.model_tag().encode('utf-8'))
+        for path in files:
+            st = os.stat(path)
+            digest.update(f'{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns};'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _current(self):
+        state = self._state
+        if state is not None and self.check_interval <= 0:
+            return state
+        now = time.monotonic()
+        if state is not None and now - self._checked_at < self.check_interval:
+            return state
+        with self._lock:
+            self._checked_at = now
+            files = self._template_files()
+            fingerprint = self._fingerprint(files)
+            if self._state is None or self._state[0] != fingerprint:
+                self._state = self._load(fingerprint) or self._build(files, fingerprint)
+            return self._state
+
+    def _load(self, fingerprint):
+        try:
+            with np.load(self.cache_path) as data:
+                if str(data['fingerprint']) != fingerprint:
+                    return None
+                labels = [str(label) for label in data['labels']]
+                matrix = data['matrix']
+        except (OSError, KeyError, ValueError):
+            return None
+        self.stats['loads'] += 1
+        return fingerprint, labels, {label: i for i, label in enumerate(labels)}, matrix
+
+    def _build(self, files, fingerprint):
+        start = time.perf_counter()
+        labels = [os.path.splitext(os.path.basename(path))[0].upper() for path in files]
+        images = []
+        for path in files:
+            with Image.open(path) as img:
+                img.load()
+                images.append(img)
+        matrix = l2_normalize(self.embed_fn(images)) if images else np.zeros((0, 0), np.float32)
+        try:
+            tmp = self.cache_path + '.tmp.npz'
+            np.savez(tmp, matrix=matrix, labels=np.array(labels), fingerprint=np.array(fingerprint))
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not persist reference index to {self.cache_path}: {e}")
+        self.stats['builds'] += 1
+        self.stats['build_seconds'] = round(time.perf_counter() - start, 4)
+        logger.info(f"Built reference index of {len(labels)} templates in {self.stats['build_seconds']}s")
+        return fingerprint, labels, {label: i for i, label in enumerate(labels)}, matrix
+
+    def build(self):
+        """Load or build the index now (e.g. at startup)."""
+        return self._current()
+
+    @property
+    def labels(self):
+        return list(self._current()[1])
+
+    def similarities(self, embedding):
+        """Cosine similarity of one embedding with every template, as {label: similarity}."""
+        _, labels, _, matrix = self._current()
+        sims = matrix @ l2_normalize(np.ravel(embedding))
+        return dict(zip(labels, sims.tolist()))
+
+    def similarity(self, embedding, label):
+        """Cosine similarity of one embedding with the template for label."""
+        _, _, rows, matrix = self._current()
+        row = rows.get(str(label).upper())
+        if row is None:
+            raise FileNotFoundError(f"Reference template not found: {label}")
+        return float(matrix[row] @ l2_normalize(np.ravel(embedding)))
+
+    def info(self):
+        state = self._state
+        return dict(self.stats, templates=len(state[1]) if state else 0,
+                    dims=int(state[3].shape[1]) if state and state[3].ndim == 2 else 0)
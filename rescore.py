@@ -0,0 +1,402 @@
+"""
+Offline re-scoring of saved drawings, to see what a change of SCORE_SCALE,
+STAR_THRESHOLDS or the model would have done to past results.
+
+Drawings are read one at a time, in a stable order, from a drawing archive
+directory (see drawing_archive.py) or from a directory, .zip or .tar(.gz) of
+PNGs. An archive record already carries its answer and the score it was
+given. For PNGs, the answer comes from --labels, a CSV with columns path and
+answer, and optionally score, which is the game score it was given at the
+time. Without --labels the answer comes from the file name (--label-from).
+Drawings go through the same preprocessing and partial-credit scoring as
+evaluate_with_cnn, in batches of --batch-size. Each batch is one forward
+pass, and --workers processes (default: every CPU) score batches in
+parallel.
+
+"old" is the recorded score when the archive or the labels give one. Otherwise it is the
+current model (or --old-model, a NumPy .npz export) under the current
+rules. "new" is the configured backend (CNN_BACKEND...) under --scale and
+--star-thresholds. Each drawing becomes one CSV row, or a Parquet part file
+per checkpoint with --format parquet (needs pyarrow). After each batch
+<output>.checkpoint.json records how far the run got; --resume continues
+from there. A JSON summary is printed at the end: star changes, correctness
+flips and images per second.
+
+    python rescore.py drawing_archive --output rescore.csv
+    python rescore.py drawings/ --label-from parent
+    python rescore.py drawings.zip --labels labels.csv --scale 3.6 --star-thresholds 8,22,40,60,80
+    CNN_BACKEND=numpy python rescore.py drawings.tar.gz --format parquet --output rescore.parquet --resume
+"""
+import argparse
+import collections
+import csv
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+COLUMNS = ['id', 'answer', 'old_score', 'old_stars', 'new_score', 'new_stars', 'star_change', 'old_correct',
+           'new_correct', 'error']
+
+
+# -- sources --
+
+def _label_for(name, label_from):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if label_from == 'parent':
+        return os.path.basename(os.path.dirname(name)) or None
+    if label_from == 'prefix':
+        return stem.split('_', 1)[0]
+    return stem
+
+
+def iter_drawings(source):
+    """(id, read) for every image in a directory, zip or tar, in a stable order; read() returns the bytes."""
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+        for path in paths:
+            yield os.path.relpath(path, source), lambda path=path: open(path, 'rb').read()
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield name, lambda name=name: archive.read(name)
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            members = sorted((m for m in archive.getmembers() if m.isfile() and m.name.lower().endswith(IMAGE_EXTENSIONS)),
+                             key=lambda m: m.name)
+            for member in members:
+                yield member.name, lambda member=member: archive.extractfile(member).read()
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+
+def read_labels(path):
+    """{id: (answer, recorded score or None)} from a CSV with columns path, answer[, score]."""
+    labels = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            score = row.get('score')
+            labels[row['path']] = (row['answer'], float(score) if score not in (None, '') else None)
+    return labels
+
+
+def labelled(drawings, labels, label_from):
+    """(id, answer, recorded score, read) for every drawing that has an answer."""
+    for drawing_id, read in drawings:
+        if labels is not None:
+            if drawing_id not in labels:
+                continue
+            answer, recorded = labels[drawing_id]
+        else:
+            answer, recorded = _label_for(drawing_id, label_from), None
+        if answer:
+            yield drawing_id, answer.upper(), recorded, read
+
+
+def iter_archive(directory, modes=None):
+    """(id, answer, recorded score, read) for every archived drawing; read() returns its memory-mapped pixels."""
+    from drawing_archive import segments
+
+    for path, records in segments(directory):
+        name = os.path.basename(path)
+        for i in range(len(records)):
+            record = records[i]
+            if modes and record['mode'].decode() not in modes:
+                continue
+            yield f'{name}:{i}', record['label'].decode(), float(record['score']), \
+                lambda records=records, i=i: records['pixels'][i]
+
+
+# -- scoring (runs in the worker processes) --
+
+_old_model = None
+
+
+def _init_worker(old_model_path):
+    global _old_model
+    if old_model_path:
+        from numpy_cnn import NumpyCNN
+        _old_model = NumpyCNN(old_model_path)
+
+
+def score_batch(items):
+    """
+    [(id, answer, recorded, image bytes or archived pixels)] ->
+    [(id, answer, recorded, old raw, new raw, error)], in one forward pass.
+    """
+    from PIL import Image
+    from cnn_evaluator import label_indices, partial_credit_scores, predict_batch, preprocess_image
+
+    arrays, ok, out = [], [], []
+    for drawing_id, answer, recorded, data in items:
+        try:
+            if isinstance(data, np.ndarray):
+                # Archived pixels are already the model input
+                arrays.append(np.multiply(data.reshape(1, 28, 28, 1), np.float32(1.0 / 255.0), dtype=np.float32))
+            else:
+                arrays.append(preprocess_image(Image.open(io.BytesIO(data))))
+            ok.append((drawing_id, answer, recorded))
+        except Exception as e:
+            out.append((drawing_id, answer, recorded, None, None, f'{type(e).__name__}: {e}'))
+    if not ok:
+        return out
+    arr = np.concatenate(arrays, axis=0)
+    targets = label_indices([answer for _, answer, _ in ok])
+    new = partial_credit_scores(predict_batch(arr), targets)
+    old = partial_credit_scores(_old_model.predict(arr), targets) if _old_model is not None else new
+    out.extend((drawing_id, answer, recorded, float(o), float(n), None)
+               for (drawing_id, answer, recorded), o, n in zip(ok, old, new))
+    return out
+
+
+class InlineScorer:
+    """Scores in this process (--workers 1)."""
+
+    def __init__(self, old_model_path):
+        _init_worker(old_model_path)
+
+    def map(self, batches):
+        for batch in batches:
+            yield score_batch(batch)
+
+    def close(self):
+        pass
+
+
+class ProcessScorer:
+    """Scores batches in worker processes, at most two per worker in flight, results in input order."""
+
+    def __init__(self, workers, old_model_path):
+        import multiprocessing
+        # One BLAS thread per worker: the parallelism comes from the processes
+        for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+            os.environ.setdefault(name, '1')
+        self.workers = workers
+        self.pool = multiprocessing.get_context('spawn').Pool(workers, _init_worker, (old_model_path,))
+
+    def map(self, batches):
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(self.pool.apply_async(score_batch, (batch,)))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        self.pool.terminate()
+
+
+# -- output and checkpoints --
+
+class CSVOutput:
+    def __init__(self, path, offset=None):
+        exists = offset is not None and os.path.exists(path)
+        self.file = open(path, 'r+' if exists else 'w', newline='')
+        if exists:
+            # Drop rows written after the last checkpoint; they are scored again
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows([row[column] for column in COLUMNS] for row in rows)
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    """A directory of part files, one per checkpoint, readable as one Parquet dataset."""
+
+    def __init__(self, path, offset=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("--format parquet needs pyarrow (pip install pyarrow)")
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        self.parts = offset or 0
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            # Parts written after the last checkpoint are scored again
+            if name.startswith('part-') and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+    def checkpoint(self):
+        if self.rows:
+            table = self.pa.Table.from_pylist(self.rows)
+            self.pq.write_table(table, os.path.join(self.path, f'part-{self.parts:05d}.parquet'))
+            self.parts += 1
+            self.rows = []
+        return self.parts
+
+    def close(self):
+        pass
+
+
+OUTPUTS = {'csv': CSVOutput, 'parquet': ParquetOutput}
+
+
+def write_checkpoint(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+# -- the run --
+
+def parse_thresholds(value):
+    thresholds = tuple(float(v) for v in value.split(','))
+    if list(thresholds) != sorted(thresholds):
+        raise argparse.ArgumentTypeError("star thresholds must be increasing")
+    return thresholds
+
+
+def batched(items, size):
+    batch = []
+    for drawing_id, answer, recorded, read in items:
+        batch.append((drawing_id, answer, recorded, read()))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def rescore(args):
+    from cnn_evaluator import CORRECT_THRESHOLD, SCORE_SCALE, STAR_THRESHOLDS, get_stars
+
+    output_path = args.output
+    checkpoint_path = output_path + '.checkpoint.json'
+    # Everything that changes the rows; resuming with a different config would mix two runs
+    config = {'source': os.path.abspath(args.source), 'labels': args.labels, 'label_from': args.label_from,
+              'modes': args.modes,
+              'old_model': args.old_model, 'scale': args.scale, 'star_thresholds': list(args.star_thresholds),
+              'correct_threshold': args.correct_threshold, 'format': args.format,
+              'backend': os.environ.get('CNN_BACKEND', 'keras')}
+    done, offset = 0, None
+    if args.resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+        if state['config'] != config:
+            raise SystemExit(f"{checkpoint_path} was written with different options; rerun without --resume")
+        done, offset = state['done'], state['offset']
+        print(f"Resuming after {done} drawings", file=sys.stderr)
+
+    from drawing_archive import segment_paths
+
+    if segment_paths(args.source):
+        items = iter_archive(args.source, args.modes)
+    else:
+        labels = read_labels(args.labels) if args.labels else None
+        items = labelled(iter_drawings(args.source), labels, args.label_from)
+    skipped = 0
+    for _ in range(done):
+        if next(items, None) is None:
+            break
+        skipped += 1
+    if args.limit is not None:
+        items = (item for _, item in zip(range(args.limit), items))
+
+    output = OUTPUTS[args.format](output_path, offset)
+    workers = max(1, args.workers or os.cpu_count() or 1)
+    scorer = ProcessScorer(workers, args.old_model) if workers > 1 else InlineScorer(args.old_model)
+    summary = {'drawings': 0, 'errors': 0, 'star_changes': collections.Counter(), 'score_change_sum': 0.0,
+               'became_correct': 0, 'became_incorrect': 0}
+    start = time.perf_counter()
+    try:
+        for results in scorer.map(batched(items, args.batch_size)):
+            rows = []
+            for drawing_id, answer, recorded, old_raw, new_raw, error in results:
+                row = dict.fromkeys(COLUMNS)
+                row.update(id=drawing_id, answer=answer, error=error)
+                if error is None:
+                    old_score = recorded if recorded is not None else old_raw * SCORE_SCALE
+                    new_score = new_raw * args.scale
+                    row.update(old_score=round(old_score, 3), old_stars=get_stars(old_score, STAR_THRESHOLDS),
+                               new_score=round(new_score, 3), new_stars=get_stars(new_score, args.star_thresholds),
+                               old_correct=old_score >= CORRECT_THRESHOLD, new_correct=new_score >= args.correct_threshold)
+                    row['star_change'] = row['new_stars'] - row['old_stars']
+                    summary['star_changes'][row['star_change']] += 1
+                    summary['score_change_sum'] += new_score - old_score
+                    summary['became_correct'] += row['new_correct'] and not row['old_correct']
+                    summary['became_incorrect'] += row['old_correct'] and not row['new_correct']
+                else:
+                    summary['errors'] += 1
+                rows.append(row)
+            output.write(rows)
+            summary['drawings'] += len(rows)
+            write_checkpoint(checkpoint_path, {'config': config, 'done': skipped + summary['drawings'],
+                                               'offset': output.checkpoint()})
+    finally:
+        scorer.close()
+        output.close()
+    seconds = time.perf_counter() - start
+    scored = summary['drawings'] - summary['errors']
+    return {
+        'output': output_path,
+        'resumed_after': skipped,
+        'drawings': summary['drawings'],
+        'errors': summary['errors'],
+        'star_changes': {f'{change:+d}': count for change, count in sorted(summary['star_changes'].items())},
+        'stars_changed': sum(count for change, count in summary['star_changes'].items() if change),
+        'mean_score_change': round(summary['score_change_sum'] / scored, 3) if scored else None,
+        'became_correct': summary['became_correct'],
+        'became_incorrect': summary['became_incorrect'],
+        'workers': workers,
+        'batch_size': args.batch_size,
+        'seconds': round(seconds, 3),
+        'images_per_second': round(summary['drawings'] / seconds, 1) if seconds else None,
+    }
+
+
+def main(argv=None):
+    from cnn_evaluator import CORRECT_THRESHOLD, SCORE_SCALE, STAR_THRESHOLDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='drawing archive, or a directory, .zip or .tar(.gz) of drawings')
+    parser.add_argument('--modes', nargs='+', help='archive only: just these modes (single, local, multiplayer, room)')
+    parser.add_argument('--labels', help='CSV with columns path, answer and optionally score')
+    parser.add_argument('--label-from', choices=['parent', 'prefix', 'stem'], default='parent',
+                        help='without --labels: the parent directory, the file name up to "_", or the whole stem')
+    parser.add_argument('--old-model', help='NumPy .npz export to compute the old scores with')
+    parser.add_argument('--scale', type=float, default=SCORE_SCALE)
+    parser.add_argument('--star-thresholds', type=parse_thresholds, default=STAR_THRESHOLDS,
+                        help='comma-separated game scores for 1-5 stars')
+    parser.add_argument('--correct-threshold', type=float, default=CORRECT_THRESHOLD)
+    parser.add_argument('--output', default='rescore.csv')
+    parser.add_argument('--format', choices=sorted(OUTPUTS), default='csv')
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--workers', type=int, help='scoring processes (default: one per CPU)')
+    parser.add_argument('--limit', type=int, help='stop after this many drawings')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint')
+    args = parser.parse_args(argv)
+    print(json.dumps(rescore(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Cache of CNN scores for identical drawings.
+
+evaluate_with_cnn looks up a hash of the preprocessed 28x28 tensor, the target
+label and the model generation before running the model, so a resubmitted
+drawing (network retry, double click, same stroke payload) is answered without
+inference, and a model reload never serves stale scores. Entries are bounded by
+RESULT_CACHE_SIZE (LRU) and expire after RESULT_CACHE_TTL seconds.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-entry footprint: 16-byte digest, short label, float, timestamps and
+# OrderedDict/tuple overhead. Used only for the reported memory estimate.
+APPROX_ENTRY_BYTES = 240
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL mapping from make_key() keys to scores."""
+
+    def __init__(self, max_entries=4096, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (score, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(arr, label, generation=0):
+        digest = hashlib.blake2b(memoryview(arr).cast('B'), digest_size=16).digest()
+        return digest, str(label).upper(), generation
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            score, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return score
+
+    def put(self, key, score):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (score, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'approx_bytes': len(self._entries) * APPROX_ENTRY_BYTES,
+            }
@@ -0,0 +1,69 @@
+"""
+Per-request stage timings.
+
+Request handlers and cnn_evaluator wrap their work in span('decode'),
+span('preprocess'), span('model') and span('response'); the durations are
+collected per thread between begin() and end(). With SERVER_TIMING=1 the app
+returns them in a standard Server-Timing header, which browsers' dev tools
+and benchmarks/bench_scoring.py read:
+
+    Server-Timing: decode;dur=0.41, preprocess;dur=0.78, model;dur=0.30, response;dur=0.05, total;dur=1.62
+
+Spans may nest (decode contains base64 and image_open). A request started
+with begin(trace=True) also keeps every span's start offset, which metrics.py
+uses for sampled traces.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+_local = threading.local()
+
+
+def begin(trace=False):
+    _local.stages = {}
+    _local.trace = [] if trace else None
+    _local.started = time.perf_counter()
+
+
+def record(stage, seconds):
+    stages = getattr(_local, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        record(stage, seconds)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append((stage, start - _local.started, seconds))
+
+
+def end():
+    """Stage durations (seconds) of the current request, plus 'total'; resets the thread's state."""
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        return {}
+    stages['total'] = time.perf_counter() - _local.started
+    _local.stages = None
+    return stages
+
+
+def take_trace():
+    """(stage, start offset, seconds) of every span in a traced request, in completion order; None if untraced."""
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def server_timing_header(stages):
+    return ', '.join(f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in stages.items())
@@ -0,0 +1,130 @@
+"""
+Startup profile and readiness.
+
+app.py marks the end of each step of its import (module imports, app
+setup, blueprints, database) with checkpoint(). The model is then warmed up
+in a background thread, so the server answers /health/live right away.
+/health/ready returns 503 until the warm-up predict is done. The warm-up
+phases (preprocessing, model load, warm-up predict, reference index) are
+timed the same way.
+
+profile() reports every phase with its end offset from process start. The
+interpreter's own startup is counted too, so the offsets compare across
+deployments. benchmarks/bench_startup.py tracks the same numbers from
+outside the process.
+
+MODEL_WARMUP selects the warm-up mode:
+
+    background  warm up in a thread after import (default)
+    1           warm up during import, as before; ready as soon as it returns
+    0           no warm-up, the model loads on the first request; always ready
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'background')
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age():
+    """Seconds since this process was exec'd, from /proc, or 0 if unavailable."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command name, which may contain spaces; starttime is field 22
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+_origin = time.perf_counter() - _process_age()
+_lock = threading.Lock()
+_phases = []  # (name, seconds, end offset)
+_last_checkpoint = _origin
+_state = {'status': 'pending', 'error': None, 'ready_at': None}
+
+
+def elapsed():
+    """Seconds since process start."""
+    return time.perf_counter() - _origin
+
+
+def checkpoint(name):
+    """End a sequential startup step, which began at the previous checkpoint (or at process start)."""
+    global _last_checkpoint
+    now = time.perf_counter()
+    with _lock:
+        _phases.append((name, now - _last_checkpoint, now - _origin))
+        _last_checkpoint = now
+
+
+@contextmanager
+def phase(name):
+    """Time a startup step that runs alongside others (the warm-up thread)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            _phases.append((name, end - start, end - _origin))
+
+
+def _set(status, error=None):
+    with _lock:
+        _state['status'] = status
+        _state['error'] = error
+        if status == 'ready':
+            _state['ready_at'] = elapsed()
+
+
+def warm_up(fn, mode=MODEL_WARMUP):
+    """Run fn (cnn_evaluator.warm_up) as MODEL_WARMUP says; returns the thread in background mode."""
+    if mode == '0':
+        _set('ready')
+        return None
+    if mode == '1':
+        _set('running')
+        fn()
+        _set('ready')
+        return None
+
+    def run():
+        try:
+            fn()
+        except Exception as e:
+            # The registry loads lazily on the first request, which retries
+            logger.error(f"Background warm-up failed: {e}")
+            _set('failed', str(e))
+        else:
+            _set('ready')
+            logger.info(f"Ready {elapsed():.2f}s after process start")
+
+    _set('running')
+    thread = threading.Thread(target=run, name='model-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def status():
+    return _state['status']
+
+
+def profile():
+    """Phase timings and readiness, for /health and the startup benchmark."""
+    with _lock:
+        return {
+            'status': _state['status'],
+            'error': _state['error'],
+            'warmup_mode': MODEL_WARMUP,
+            'uptime_seconds': round(elapsed(), 3),
+            'ready_after_seconds': round(_state['ready_at'], 3) if _state['ready_at'] is not None else None,
+            'phases': [{'name': name, 'seconds': round(seconds, 4), 'at': round(at, 4)}
+                       for name, seconds, at in _phases],
+        }
@@ -11,6 +11,11 @@ class NoseDrawGame {
         this.isDrawing = false;
         this.faceDetected = false;
         this.hasDrawnContent = false;
+        this.strokes = []; // Polylines drawn so far, sent instead of the canvas image
+        this.localModel = null; // BrowserCNN when the server offers in-browser scoring (cnn.js)
+        this.localScoring = null;
+        this.live = null; // Running score while drawing (see live_scoring.py)
+        this.liveTimer = null;
         
         // Canvas elements
         this.drawingCanvas = document.getElementById('drawing-canvas');
@@ -33,6 +38,7 @@ class NoseDrawGame {
         this.currentLevelSpan = document.getElementById('current-level');
         this.progressBar = document.getElementById('progress-bar');
         this.drawingStatus = document.getElementById('drawing-status');
+        this.liveScoreBadge = document.getElementById('live-score');
         this.noseStatus = document.getElementById('nose-status');
         
         // Modals
@@ -49,6 +55,9 @@ class NoseDrawGame {
         // Load questions
         await this.loadQuestions();
         
+        // Load the CNN for in-browser scoring in the background; /evaluate is used until it is ready
+        this.loadLocalModel();
+        
         // Set up event listeners
         this.setupEventListeners();
         
@@ -87,6 +96,56 @@ class NoseDrawGame {
         }
     }
     
+    async loadLocalModel() {
+        if (typeof BrowserCNN === 'undefined') {
+            return;
+        }
+        try {
+            const response = await fetch('/evaluate_local/config');
+            const config = await response.json();
+            if (!config.enabled) {
+                return;
+            }
+            this.localModel = await BrowserCNN.load(config.manifest_url);
+            this.localScoring = config.scoring;
+            console.log(`Loaded model ${this.localModel.version} for in-browser scoring`);
+        } catch (error) {
+            console.warn('In-browser scoring unavailable, using the server:', error);
+            this.localModel = null;
+        }
+    }
+    
+    /**
+     * Score the drawing in the browser and show the stars right away; the
+     * server gets the claimed score and the 28x28 input and re-scores a sample.
+     */
+    scoreDrawingLocally(question) {
+        const pixels = canvasToGrayscale(this.drawingCanvas, 28);
+        const probs = this.localModel.predict(pixels);
+        const result = scoreLocally(probs, question.answer, this.localScoring);
+        this.showResults(Object.assign({ level: this.currentLevel }, result), question);
+        
+        const params = new URLSearchParams({
+            answer: question.answer,
+            level: this.currentLevel,
+            score: result.score,
+            model_version: this.localModel.version
+        });
+        fetch(`/evaluate_local?${params}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'X-Image-Width': '28',
+                'X-Image-Height': '28'
+            },
+            body: pixels
+        }).then(response => response.ok ? response.json() : null).then(checked => {
+            if (checked && checked.verified && checked.stars !== result.stars) {
+                console.warn(`Server re-scored this drawing: ${checked.stars} stars instead of ${result.stars}`);
+            }
+        }).catch(error => console.warn('Could not report the local score:', error));
+    }
+    
     setupEventListeners() {
         this.startCameraBtn.addEventListener('click', () => this.startCamera());
         this.startDrawingBtn.addEventListener('click', () => this.startDrawing());
@@ -179,6 +238,7 @@ class NoseDrawGame {
         this.updateStatus('Drawing started! Move your nose to draw.', 'success');
         this.drawingStatus.textContent = 'Drawing active';
         this.drawingStatus.className = 'badge bg-warning drawing-active';
+        this.startLiveScoring();
         
         // Add visual feedback to canvas
         this.drawingCanvas.classList.add('success-animation');
@@ -193,6 +253,7 @@ class NoseDrawGame {
         this.updateStatus('Drawing stopped. You can submit or continue drawing.', 'info');
         this.drawingStatus.textContent = 'Drawing paused';
         this.drawingStatus.className = 'badge bg-secondary';
+        this.stopLiveScoring();
     }
     
     clearCanvas() {
@@ -203,6 +264,14 @@ class NoseDrawGame {
         
         // Reset drawing state
         this.hasDrawnContent = false;
+        this.strokes = [];
+        if (this.live) {
+            // Tell the server to start the running score over
+            this.live.reset = true;
+            this.live.stroke = 0;
+            this.live.point = 0;
+        }
+        this.liveScoreBadge.style.display = 'none';
         this.updateDrawingControls();
     }
     
@@ -211,12 +280,127 @@ class NoseDrawGame {
         this.drawingCtx.moveTo(fromPos.x, fromPos.y);
         this.drawingCtx.lineTo(toPos.x, toPos.y);
         this.drawingCtx.stroke();
+        recordStrokeSegment(this.strokes, fromPos.x, fromPos.y, toPos.x, toPos.y);
         
         // Mark that we have drawn content
         this.hasDrawnContent = true;
         this.updateDrawingControls();
     }
     
+    /**
+     * Running score while drawing: every 1/hz seconds the points drawn since
+     * the last update go to /live/<id>/strokes, and the stars it answers
+     * with are shown. With the model loaded in the browser the canvas is
+     * scored locally instead.
+     */
+    startLiveScoring() {
+        const question = this.questions[this.currentQuestionIndex];
+        if (!question) {
+            return;
+        }
+        if (!this.live || this.live.answer !== question.answer) {
+            if (this.live && this.live.id) {
+                fetch(`/live/${this.live.id}`, { method: 'DELETE' }).catch(() => {});
+            }
+            this.live = { id: null, answer: question.answer, seq: 0, stroke: 0, point: 0, reset: false, busy: false, hz: 4 };
+        }
+        clearInterval(this.liveTimer);
+        this.liveTimer = setInterval(() => this.updateLiveScore(), 1000 / this.live.hz);
+    }
+    
+    stopLiveScoring() {
+        clearInterval(this.liveTimer);
+        this.liveTimer = null;
+        this.updateLiveScore();
+    }
+    
+    async updateLiveScore() {
+        const live = this.live;
+        if (!live || live.busy) {
+            return;
+        }
+        if (this.localModel) {
+            if (this.hasDrawnContent) {
+                const probs = this.localModel.predict(canvasToGrayscale(this.drawingCanvas, 28));
+                this.showLiveScore(scoreLocally(probs, live.answer, this.localScoring).stars);
+            }
+            return;
+        }
+        const delta = this.liveDelta();
+        if (!delta) {
+            return;
+        }
+        live.busy = true;
+        try {
+            if (!live.id) {
+                const opened = await fetch('/live', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(Object.assign({ answer: live.answer }, strokeCanvas(this.drawingCtx)))
+                });
+                if (!opened.ok) {
+                    throw new Error('Could not start live scoring');
+                }
+                const session = await opened.json();
+                live.id = session.live_id;
+                live.hz = session.hz;
+            }
+            const response = await fetch(`/live/${live.id}/strokes`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(Object.assign({ seq: ++live.seq }, delta))
+            });
+            if (!response.ok) {
+                if (response.status === 404) {
+                    live.id = null; // expired; open a new one
+                }
+                throw new Error(`Live scoring answered ${response.status}`);
+            }
+            const result = await response.json();
+            if (result.stars !== undefined && !live.reset) {
+                this.showLiveScore(result.stars);
+            }
+        } catch (error) {
+            // Lost or rejected update: send everything drawn so far next time
+            console.warn('Live score update failed:', error);
+            live.reset = true;
+            live.stroke = 0;
+            live.point = 0;
+        } finally {
+            live.busy = false;
+        }
+    }
+    
+    /**
+     * The points drawn since the last live update, or null if there are none.
+     */
+    liveDelta() {
+        const live = this.live;
+        const strokes = this.strokes;
+        const polylines = [];
+        let continues = false;
+        for (let i = live.stroke; i < strokes.length; i++) {
+            const from = i === live.stroke ? live.point : 0;
+            if (strokes[i].length > from) {
+                continues = continues || (polylines.length === 0 && from > 0);
+                polylines.push(strokes[i].slice(from));
+            }
+        }
+        if (polylines.length === 0 && !live.reset) {
+            return null;
+        }
+        live.stroke = Math.max(strokes.length - 1, 0);
+        live.point = strokes.length ? strokes[strokes.length - 1].length : 0;
+        const delta = { strokes: encodeStrokes(polylines), continue: continues, reset: live.reset };
+        live.reset = false;
+        return delta;
+    }
+    
+    showLiveScore(stars) {
+        this.liveScoreBadge.textContent = 'Live: ' + '★'.repeat(stars) + '☆'.repeat(5 - stars);
+        this.liveScoreBadge.style.display = 'inline-block';
+    }
+    
     async submitDrawing() {
         if (this.currentQuestionIndex >= this.questions.length) {
             this.updateStatus('No more questions available.', 'warning');
@@ -227,24 +411,56 @@ class NoseDrawGame {
         this.updateStatus('Evaluating your drawing...', 'info');
         
         try {
-            // Get canvas image as base64
-            const imageData = this.drawingCanvas.toDataURL('image/png');
-            
             // Get correct answer
             const currentQuestion = this.questions[this.currentQuestionIndex];
             
-            // Submit to backend
-            const response = await fetch('/evaluate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    image: imageData,
+            if (this.localModel) {
+                try {
+                    this.scoreDrawingLocally(currentQuestion);
+                    return;
+                } catch (error) {
+                    console.warn('In-browser scoring failed, using the server:', error);
+                }
+            }
+            
+            let response;
+            if (this.strokes.length > 0) {
+                // Send the stroke polylines; the server rasterizes them directly
+                response = await fetch('/evaluate', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify(Object.assign({
+                        strokes: encodeStrokes(this.strokes),
+                        answer: currentQuestion.answer,
+                        level: this.currentLevel
+                    }, strokeCanvas(this.drawingCtx)))
+                });
+            } else {
+                // Submit a 28x28 grayscale buffer (784 bytes) instead of a base64 PNG
+                const params = new URLSearchParams({
                     answer: currentQuestion.answer,
                     level: this.currentLevel
-                })
-            });
+                });
+                response = await fetch(`/evaluate?${params}`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Image-Width': '28',
+                        'X-Image-Height': '28'
+                    },
+                    body: canvasToGrayscale(this.drawingCanvas, 28)
+                });
+            }
+            
+            if (response.status === 503 && response.headers.has('Retry-After')) {
+                // The server is shedding load; let the child try again once it has caught up
+                const wait = parseInt(response.headers.get('Retry-After'), 10) || 1;
+                this.updateStatus(`Lots of drawings are being checked right now. Try again in ${wait} second${wait === 1 ? '' : 's'}!`, 'warning');
+                setTimeout(() => { this.submitDrawingBtn.disabled = false; }, wait * 1000);
+                return;
+            }
             
             if (!response.ok) {
                 throw new Error('Failed to evaluate drawing');
@@ -448,6 +664,112 @@ class NoseDrawGame {
     }
 }
 
+/**
+ * Downsample a canvas to size x size 8-bit grayscale pixels on a white
+ * background the way the server's Preprocessor.resize does: PIL's
+ * convert('L') luminance, a box reduction by the largest whole factor (the
+ * remainder trimmed evenly), then an area-weighted resize. So the in-browser
+ * model sees the same pixels as the server for the whole canvas.
+ */
+function canvasToGrayscale(canvas, size) {
+    const width = canvas.width, height = canvas.height;
+    const rgba = canvas.getContext('2d').getImageData(0, 0, width, height).data;
+    const factor = Math.max(1, Math.min(Math.floor(height / size), Math.floor(width / size)));
+    const w = Math.floor(width / factor), h = Math.floor(height / factor);
+    const left = Math.floor((width - w * factor) / 2), top = Math.floor((height - h * factor) / 2);
+    const reduced = new Float64Array(w * h);
+    for (let y = 0; y < h * factor; y++) {
+        const row = (top + y) * width + left;
+        const out = Math.floor(y / factor) * w;
+        for (let x = 0; x < w * factor; x++) {
+            const i = (row + x) * 4;
+            const luma = Math.floor((rgba[i] * 299 + rgba[i + 1] * 587 + rgba[i + 2] * 114 + 500) / 1000);
+            // Transparent pixels are white background
+            reduced[out + Math.floor(x / factor)] += 255 - (255 - luma) * rgba[i + 3] / 255;
+        }
+    }
+    for (let i = 0; i < reduced.length; i++) {
+        reduced[i] = Math.round(reduced[i] / (factor * factor));
+    }
+    return areaResize(reduced, w, h, size);
+}
+
+/**
+ * Area-weighted resize of a w x h grayscale array to size x size (cv2's INTER_AREA when shrinking).
+ */
+function areaResize(src, w, h, size) {
+    const spans = n => {
+        const scale = n / size;
+        return Array.from({ length: size }, (_, o) => {
+            const start = o * scale, end = start + scale, span = [];
+            for (let i = Math.floor(start); i < Math.min(n, Math.ceil(end)); i++) {
+                const overlap = Math.min(end, i + 1) - Math.max(start, i);
+                if (overlap > 1e-9) {
+                    span.push([i, overlap / scale]);
+                }
+            }
+            return span;
+        });
+    };
+    const xs = spans(w), ys = spans(h);
+    const rows = new Float64Array(h * size);
+    for (let y = 0; y < h; y++) {
+        for (let x = 0; x < size; x++) {
+            let v = 0;
+            xs[x].forEach(([i, weight]) => { v += src[y * w + i] * weight; });
+            rows[y * size + x] = v;
+        }
+    }
+    const gray = new Uint8Array(size * size);
+    for (let y = 0; y < size; y++) {
+        for (let x = 0; x < size; x++) {
+            let v = 0;
+            ys[y].forEach(([i, weight]) => { v += rows[i * size + x] * weight; });
+            gray[y * size + x] = Math.round(v);
+        }
+    }
+    return gray;
+}
+
+/**
+ * Append a drawn segment to a list of polylines, starting a new polyline
+ * whenever the segment does not continue from the previous point.
+ */
+function recordStrokeSegment(strokes, x1, y1, x2, y2) {
+    const current = strokes[strokes.length - 1];
+    const last = current && current[current.length - 1];
+    if (!last || last[0] !== x1 || last[1] !== y1) {
+        strokes.push([[x1, y1], [x2, y2]]);
+    } else {
+        current.push([x2, y2]);
+    }
+}
+
+/**
+ * The canvas fields of a stroke submission: the server draws the strokes
+ * on a canvas of the same size, pen and ink, so they score like the image.
+ */
+function strokeCanvas(ctx) {
+    return { canvas: [ctx.canvas.width, ctx.canvas.height], pen: ctx.lineWidth, ink: ctx.strokeStyle };
+}
+
+/**
+ * Delta-encode polylines as flat integer lists: [x0, y0, dx1, dy1, ...].
+ */
+function encodeStrokes(strokes) {
+    return strokes.map(points => {
+        const flat = [];
+        let px = 0, py = 0;
+        points.forEach(([x, y]) => {
+            const rx = Math.round(x), ry = Math.round(y);
+            flat.push(rx - px, ry - py);
+            px = rx;
+            py = ry;
+        });
+        return flat;
+    });
+}
+
 // Initialize the game when the page loads
 document.addEventListener('DOMContentLoaded', () => {
     console.log('DOM loaded, initializing NoseDraw Game...');
@@ -0,0 +1,171 @@
+/**
+ * In-browser forward pass of the EMNIST CNN exported by browser_model.py,
+ * and the same partial-credit scoring as cnn_evaluator.py, so single-player
+ * drawings can be scored without a round trip (see /evaluate_local).
+ */
+class BrowserCNN {
+    constructor(manifest, buffer) {
+        if (buffer.byteLength !== manifest.byte_length) {
+            throw new Error(`Model weights are ${buffer.byteLength} bytes, expected ${manifest.byte_length}`);
+        }
+        this.manifest = manifest;
+        this.version = manifest.version;
+        this.layers = manifest.layers;
+        this.tensors = {};
+        Object.entries(manifest.tensors).forEach(([name, t]) => {
+            this.tensors[name] = { shape: t.shape, data: new Float32Array(buffer, t.offset, t.length) };
+        });
+    }
+
+    /**
+     * Fetch the manifest and the weights it names (cached by the browser like any static file).
+     */
+    static async load(manifestUrl) {
+        const response = await fetch(manifestUrl);
+        if (!response.ok) {
+            throw new Error(`Could not load ${manifestUrl}`);
+        }
+        const manifest = await response.json();
+        const weightsUrl = new URL(manifest.weights, new URL(manifestUrl, window.location.href));
+        weightsUrl.searchParams.set('v', manifest.version);
+        const weights = await fetch(weightsUrl);
+        if (!weights.ok) {
+            throw new Error(`Could not load ${weightsUrl}`);
+        }
+        return new BrowserCNN(manifest, await weights.arrayBuffer());
+    }
+
+    /**
+     * Class probabilities for a 28x28 grayscale drawing (Uint8Array, white background, dark ink).
+     */
+    predict(gray) {
+        let [h, w, c] = this.manifest.input;
+        let x = new Float32Array(h * w * c);
+        for (let i = 0; i < x.length; i++) {
+            x[i] = gray[i] / 255;
+        }
+        this.layers.forEach((layer, i) => {
+            if (layer.type === 'Conv2D') {
+                const kernel = this.tensors[`${i}_kernel`];
+                [x, h, w, c] = conv2d(x, h, w, c, kernel.data, kernel.shape, this.tensors[`${i}_bias`].data);
+                activate(x, layer.activation);
+            } else if (layer.type === 'MaxPooling2D') {
+                [x, h, w] = maxPool(x, h, w, c, layer.pool_size);
+            } else if (layer.type === 'Flatten') {
+                [h, w, c] = [1, 1, x.length];
+            } else if (layer.type === 'Dense') {
+                x = dense(x, this.tensors[`${i}_kernel`].data, this.tensors[`${i}_bias`].data);
+                [h, w, c] = [1, 1, x.length];
+                activate(x, layer.activation);
+            }
+        });
+        return x;
+    }
+}
+
+/**
+ * Stride-1 'valid' convolution of an HWC input with an HWIO kernel, as in numpy_cnn.py.
+ */
+function conv2d(x, h, w, cin, kernel, shape, bias) {
+    const [kh, kw, , cout] = shape;
+    const oh = h - kh + 1, ow = w - kw + 1;
+    const out = new Float32Array(oh * ow * cout);
+    for (let y = 0; y < oh; y++) {
+        for (let xx = 0; xx < ow; xx++) {
+            const o = (y * ow + xx) * cout;
+            out.set(bias, o);
+            for (let ky = 0; ky < kh; ky++) {
+                for (let kx = 0; kx < kw; kx++) {
+                    const p = ((y + ky) * w + xx + kx) * cin;
+                    const k = (ky * kw + kx) * cin * cout;
+                    for (let ci = 0; ci < cin; ci++) {
+                        const v = x[p + ci];
+                        if (v === 0) continue;
+                        const kc = k + ci * cout;
+                        for (let co = 0; co < cout; co++) {
+                            out[o + co] += v * kernel[kc + co];
+                        }
+                    }
+                }
+            }
+        }
+    }
+    return [out, oh, ow, cout];
+}
+
+function maxPool(x, h, w, c, [ph, pw]) {
+    const oh = Math.floor(h / ph), ow = Math.floor(w / pw);
+    const out = new Float32Array(oh * ow * c).fill(-Infinity);
+    for (let y = 0; y < oh * ph; y++) {
+        for (let xx = 0; xx < ow * pw; xx++) {
+            const p = (y * w + xx) * c;
+            const o = (Math.floor(y / ph) * ow + Math.floor(xx / pw)) * c;
+            for (let ch = 0; ch < c; ch++) {
+                if (x[p + ch] > out[o + ch]) out[o + ch] = x[p + ch];
+            }
+        }
+    }
+    return [out, oh, ow];
+}
+
+function dense(x, kernel, bias) {
+    const n = bias.length;
+    const out = Float32Array.from(bias);
+    for (let i = 0; i < x.length; i++) {
+        const v = x[i];
+        if (v === 0) continue;
+        const k = i * n;
+        for (let j = 0; j < n; j++) {
+            out[j] += v * kernel[k + j];
+        }
+    }
+    return out;
+}
+
+function activate(x, name) {
+    if (name === 'relu') {
+        for (let i = 0; i < x.length; i++) {
+            if (x[i] < 0) x[i] = 0;
+        }
+    } else if (name === 'softmax') {
+        let max = -Infinity, sum = 0;
+        for (let i = 0; i < x.length; i++) max = Math.max(max, x[i]);
+        for (let i = 0; i < x.length; i++) {
+            x[i] = Math.exp(x[i] - max);
+            sum += x[i];
+        }
+        for (let i = 0; i < x.length; i++) x[i] /= sum;
+    } else if (name && name !== 'linear') {
+        throw new Error(`Unsupported activation: ${name}`);
+    }
+}
+
+/**
+ * Score probabilities against the answer with the server's rules
+ * (scoring comes from /evaluate_local/config): top-k partial credit,
+ * the display scale, stars and the correctness threshold.
+ */
+function scoreLocally(probs, answer, scoring) {
+    const label = String(answer).toUpperCase();
+    let index = -1;
+    if (/^[0-9]$/.test(label)) {
+        index = Number(label);
+    } else if (/^[A-Z]$/.test(label)) {
+        index = 10 + label.charCodeAt(0) - 65;
+    }
+    let score = 0;
+    if (index >= 0 && index < probs.length) {
+        let rank = 0;
+        for (let i = 0; i < probs.length; i++) {
+            if (probs[i] > probs[index]) rank++;
+        }
+        const credit = rank < scoring.top_k_credit.length ? scoring.top_k_credit[rank] : 1.0;
+        score = probs[index] * credit * 100 * scoring.score_scale;
+    }
+    const stars = scoring.star_thresholds.filter(threshold => score >= threshold).length;
+    return { score, stars, is_correct: score >= scoring.correct_threshold };
+}
+
+if (typeof module !== 'undefined') {
+    module.exports = { BrowserCNN, scoreLocally };
+}
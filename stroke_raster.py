@@ -0,0 +1,126 @@
+"""
+Server-side rasterization of stroke submissions.
+
+Clients can send the polyline the nose tracker produced instead of a
+rendered canvas. Each stroke is a flat, delta-encoded list of integer canvas
+coordinates, sent with the canvas it was drawn on:
+
+    {"strokes": [[x0, y0, dx1, dy1, dx2, dy2, ...], ...],
+     "canvas": [640, 480], "pen": 4, "ink": "#007bff"}
+
+The strokes are drawn the way the page drew them (same canvas size, pen
+width, round caps and ink) onto a white grayscale image. So
+preprocess_image sees the same frame as for the canvas PNG or the raw
+upload of that drawing, and both score alike. No PNG is ever encoded or
+decoded.
+"""
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+RASTER_SIZE = 28
+DEFAULT_PEN = 4            # lineWidth of the game canvases
+DEFAULT_INK = '#000000'
+MAX_CANVAS_SIDE = 4096
+MAX_PEN = 64
+MAX_STROKE_POINTS = 20000
+
+Canvas = namedtuple('Canvas', 'width height pen ink')
+
+
+class StrokeError(ValueError):
+    """The stroke payload is malformed."""
+
+
+def decode_strokes(strokes):
+    """Turn delta-encoded strokes into a list of (k, 2) float arrays of absolute points."""
+    if not isinstance(strokes, list):
+        raise StrokeError("strokes must be a list")
+    decoded = []
+    total = 0
+    for stroke in strokes:
+        if not isinstance(stroke, list) or len(stroke) < 2 or len(stroke) % 2:
+            raise StrokeError("each stroke must be a flat list of x, y pairs")
+        total += len(stroke) // 2
+        if total > MAX_STROKE_POINTS:
+            raise StrokeError(f"too many points (max {MAX_STROKE_POINTS})")
+        try:
+            deltas = np.asarray(stroke, dtype=np.float64).reshape(-1, 2)
+        except (TypeError, ValueError):
+            raise StrokeError("stroke coordinates must be numbers")
+        if not np.isfinite(deltas).all():
+            raise StrokeError("stroke coordinates must be finite")
+        decoded.append(np.cumsum(deltas, axis=0))
+    return decoded
+
+
+def ink_level(color):
+    """8-bit gray of a '#rrggbb' ink color, weighted like PIL's convert('L')."""
+    if not isinstance(color, str) or len(color) != 7 or color[0] != '#':
+        raise StrokeError("ink must be a #rrggbb color")
+    try:
+        r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    except ValueError:
+        raise StrokeError("ink must be a #rrggbb color")
+    return (r * 299 + g * 587 + b * 114 + 500) // 1000
+
+
+def parse_canvas(payload):
+    """Canvas a stroke submission was drawn on, from its "canvas", "pen" and "ink" fields."""
+    size = payload.get('canvas')
+    if not isinstance(size, list) or len(size) != 2:
+        raise StrokeError("strokes need the canvas size as [width, height]")
+    try:
+        width, height = (int(side) for side in size)
+        pen = float(payload.get('pen', DEFAULT_PEN))
+    except (TypeError, ValueError):
+        raise StrokeError("canvas size and pen width must be numbers")
+    if not (0 < width <= MAX_CANVAS_SIDE and 0 < height <= MAX_CANVAS_SIDE):
+        raise StrokeError(f"unsupported canvas size {width}x{height}")
+    if not 0 < pen <= MAX_PEN:
+        raise StrokeError(f"pen width must be between 0 and {MAX_PEN}")
+    return Canvas(width, height, pen, ink_level(payload.get('ink', DEFAULT_INK)))
+
+
+def reduction(canvas, size=RASTER_SIZE):
+    """
+    Largest whole factor a canvas can be drawn smaller by while the pen stays
+    at least two pixels wide (thinner lines lose ink on diagonals) and the
+    canvas at least size x size.
+    """
+    return max(1, min(int(canvas.pen) // 2, canvas.width // size, canvas.height // size))
+
+
+def blank_canvas(canvas, factor=1):
+    """White grayscale PIL image for a canvas drawn factor times smaller."""
+    return Image.new('L', (max(1, canvas.width // factor), max(1, canvas.height // factor)), 255)
+
+
+def draw_strokes(out, points, canvas, factor=1):
+    """Draw absolute canvas-coordinate polylines into a blank_canvas() image."""
+    draw = ImageDraw.Draw(out)
+    width = max(1, int(round(canvas.pen / factor)))
+    radius = canvas.pen / factor / 2
+    for p in points:
+        if not len(p):
+            continue
+        # Canvas coordinates are pixel edges; PIL puts pixel centers on whole numbers
+        line = [(float(x), float(y)) for x, y in p / factor - 0.5]
+        if len(line) > 1:
+            draw.line(line, fill=canvas.ink, width=width, joint='curve')
+        if width > 1 or len(line) == 1:
+            # Round caps, like the page's lineCap; also draws a single-point stroke (a dot)
+            for x, y in (line[0], line[-1]):
+                draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=canvas.ink)
+    return out
+
+
+def rasterize_strokes(points, canvas, factor=1):
+    """The strokes on their canvas as a uint8 array, drawn factor times smaller."""
+    return np.asarray(draw_strokes(blank_canvas(canvas, factor), points, canvas, factor))
+
+
+def strokes_to_image(payload):
+    """Canvas-sized uint8 drawing from a JSON stroke submission."""
+    return rasterize_strokes(decode_strokes(payload.get('strokes')), parse_canvas(payload))
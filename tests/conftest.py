@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Before anything imports the app: the NumPy model, a throwaway database and no background writers
+os.environ.setdefault('CNN_BACKEND', 'numpy')
+os.environ.setdefault('MODEL_WARMUP', '0')
+os.environ.setdefault('DRAWING_ARCHIVE', '0')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp(prefix='nosedraw-tests-')}/test.db")
+
+
+@pytest.fixture
+def app():
+    """The Flask app, imported on first use so the settings above apply."""
+    import app as module
+    return module.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def data_url():
+    """A drawing as the page posts it: a PNG data URL of a 280x280 canvas with a vertical stroke."""
+    import base64
+    import io
+
+    from PIL import Image, ImageDraw
+
+    def make(offset=0):
+        image = Image.new('L', (280, 280), 255)
+        ImageDraw.Draw(image).line([(140 + offset, 60), (140 + offset, 220)], fill=0, width=12)
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+    return make
@@ -0,0 +1,101 @@
+"""Admission control sheds inference work instead of queueing it without bound."""
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import cnn_evaluator
+from admission import AdmissionController, Overloaded
+
+
+def test_admits_up_to_max_concurrency_then_sheds_when_the_queue_is_full():
+    admission = AdmissionController(2, max_queue=0, queue_timeout=1)
+    admission.acquire()
+    admission.acquire()
+    with pytest.raises(Overloaded) as shed:
+        admission.acquire()
+    assert shed.value.retry_after >= 1
+    stats = admission.stats()
+    assert (stats['admitted'], stats['shed_queue_full'], stats['running']) == (2, 1, 2)
+
+
+def test_sheds_when_the_expected_wait_is_past_the_deadline():
+    admission = AdmissionController(1, max_queue=10, queue_timeout=0.5)
+    admission.acquire()
+    admission.release(2.0)  # the model takes two seconds a request
+    admission.acquire()
+    with pytest.raises(Overloaded) as shed:
+        admission.acquire()
+    assert shed.value.retry_after == 2
+    assert admission.stats()['shed_deadline'] == 1
+
+
+def test_queued_request_is_shed_at_the_deadline():
+    admission = AdmissionController(1, max_queue=10, queue_timeout=0.05)
+    admission.acquire()
+    start = time.monotonic()
+    with pytest.raises(Overloaded):
+        admission.acquire()
+    assert time.monotonic() - start < 1
+    stats = admission.stats()
+    assert (stats['queued'], stats['shed_timeout'], stats['queue_depth']) == (1, 1, 0)
+
+
+def test_queued_request_gets_the_released_slot():
+    admission = AdmissionController(1, max_queue=10, queue_timeout=5)
+    admission.acquire()
+    got = threading.Event()
+
+    def waiter():
+        with admission.slot():
+            got.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while admission.stats()['queue_depth'] == 0:
+        time.sleep(0.001)
+    admission.release(0.01)
+    thread.join(2)
+    assert got.is_set()
+    assert admission.stats()['admitted'] == 2
+
+
+@pytest.fixture
+def full_admission(monkeypatch):
+    """The model's slots all taken and no queue, so the next request is shed."""
+    admission = cnn_evaluator.admission
+    monkeypatch.setattr(admission, 'max_queue', 0)
+    monkeypatch.setattr(admission, '_running', admission.max_concurrency)
+    cnn_evaluator.result_cache.clear()
+    yield admission
+    cnn_evaluator.result_cache.clear()
+
+
+def test_evaluate_answers_503_with_retry_after(client, data_url, full_admission):
+    response = client.post('/evaluate', json={'image': data_url(), 'answer': '1'})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert 'try again' in response.get_json()['error']
+
+
+def test_multiplayer_submission_is_shed_without_using_the_turn(client, data_url, full_admission):
+    created = client.post('/multiplayer/start_game', json={'player1_name': 'Ana', 'player2_name': 'Ben'}).get_json()
+    assert created['success']
+    body = {'drawing_data': data_url(), 'player': 1}
+    response = client.post('/multiplayer/submit_drawing', json=body)
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    state = client.get('/multiplayer/get_game_state').get_json()
+    assert state['game_state']['current_turn'] == 1
+
+
+def test_every_model_entry_point_is_admitted(full_admission):
+    image = Image.new('L', (280, 280), 255)
+    with pytest.raises(Overloaded):
+        cnn_evaluator.rank_labels(image, ['A', '1'])
+    with pytest.raises(Overloaded):
+        cnn_evaluator.score_many([image], ['A'])
+    with pytest.raises(Overloaded):
+        cnn_evaluator.score_preprocessed(np.full((1, 28, 28), 255, dtype=np.uint8), ['A'])
@@ -0,0 +1,36 @@
+"""Input checks of the single-player scoring routes."""
+import pytest
+
+from local_scoring import local_scoring
+
+
+@pytest.mark.parametrize('level', ['two', 0, -1, 2.5, [1], True])
+def test_evaluate_rejects_a_bad_level(client, data_url, level):
+    response = client.post('/evaluate', json={'image': data_url(), 'answer': '1', 'level': level})
+    assert response.status_code == 400
+    assert 'level' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('level, expected', [(None, 1), (3, 3), ('4', 4)])
+def test_evaluate_reads_the_level(client, data_url, level, expected):
+    body = {'image': data_url(), 'answer': '1'}
+    if level is not None:
+        body['level'] = level
+    response = client.post('/evaluate', json=body)
+    assert response.status_code == 200
+    assert response.get_json()['level'] == expected
+
+
+@pytest.mark.parametrize('body', [{'score': 50, 'level': 'two'}, {'score': 50, 'level': 0},
+                                  {'score': 'lots'}, {'score': [50]}, {'score': 10000}, {}])
+def test_evaluate_local_rejects_bad_fields(client, data_url, monkeypatch, body):
+    monkeypatch.setattr(local_scoring, 'should_verify', lambda version: False)
+    response = client.post('/evaluate_local', json=dict(body, image=data_url(), answer='1'))
+    assert response.status_code == 400
+
+
+def test_evaluate_local_reads_the_level(client, data_url, monkeypatch):
+    monkeypatch.setattr(local_scoring, 'should_verify', lambda version: False)
+    response = client.post('/evaluate_local', json={'image': data_url(), 'answer': '1', 'score': 50, 'level': '5'})
+    assert response.status_code == 200
+    assert (response.get_json()['level'], response.get_json()['verified']) == (5, False)
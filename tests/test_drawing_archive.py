@@ -0,0 +1,99 @@
+"""Records written by the drawing archive read back as they went in (drawing_archive.py)."""
+import numpy as np
+import pytest
+
+from drawing_archive import HEADER_SIZE, RECORD_DTYPE, DrawingArchive, open_segment, segment_paths, segments, \
+    stroke_points
+
+
+def drawing(seed):
+    return np.random.default_rng(seed).integers(0, 256, (28, 28), dtype=np.uint8)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return DrawingArchive(directory=str(tmp_path), enabled=True, max_bytes=0)
+
+
+def test_disabled_archive_records_nothing(tmp_path):
+    archive = DrawingArchive(directory=str(tmp_path), enabled=False)
+    assert not archive.record(drawing(0), 'A', 10.0, 1, 'single', preprocessed=True)
+    assert segment_paths(str(tmp_path)) == []
+
+
+def test_records_round_trip(archive):
+    strokes = [[10, 20, 5, 0, 5, 0], [50, 60, 0, -5]]  # delta-encoded, as the pages send them
+    archive.record(drawing(0), 'a', 123.5, 4, 'single', strokes=strokes, preprocessed=True)
+    archive.record(drawing(1), 'B', 7.0, 0, 'room', session='123456', preprocessed=True)
+    archive.flush()
+
+    [(path, records)] = list(segments(archive.directory))
+    assert len(records) == 2
+    first, second = records
+    np.testing.assert_array_equal(first['pixels'], drawing(0))
+    np.testing.assert_array_equal(second['pixels'], drawing(1))
+    assert (first['label'], first['mode'], float(first['score']), int(first['stars'])) == (b'A', b'single', 123.5, 4)
+    assert (second['label'], second['mode'], second['session']) == (b'B', b'room', b'123456')
+    assert [points.tolist() for points in stroke_points(path, first)] == [[[10, 20], [15, 20], [20, 20]],
+                                                                         [[50, 60], [50, 55]]]
+    assert stroke_points(path, second) == []
+
+
+def test_images_are_preprocessed_before_they_are_archived(archive):
+    from PIL import Image
+
+    from cnn_evaluator import preprocess_uint8
+    image = Image.new('L', (280, 280), 255)
+    image.paste(0, (130, 40, 150, 240))
+    archive.record(image, '1', 50.0, 3, 'single')
+    archive.flush()
+    [(_, records)] = list(segments(archive.directory))
+    np.testing.assert_array_equal(records[0]['pixels'], preprocess_uint8(image))
+
+
+def test_full_segment_continues_in_the_next_one(tmp_path):
+    archive = DrawingArchive(directory=str(tmp_path), enabled=True, max_bytes=0,
+                             segment_bytes=HEADER_SIZE + 3 * RECORD_DTYPE.itemsize)
+    for i in range(7):
+        archive.record(drawing(i), 'A', float(i), 1, 'single', preprocessed=True)
+    archive.flush()
+    found = list(segments(str(tmp_path)))
+    assert [len(records) for _, records in found] == [3, 3, 1]
+    scores = [float(score) for _, records in found for score in records['score']]
+    assert scores == [float(i) for i in range(7)]
+
+
+def test_oldest_segments_are_pruned_to_fit_the_cap(tmp_path):
+    segment_bytes = HEADER_SIZE + 2 * RECORD_DTYPE.itemsize
+    archive = DrawingArchive(directory=str(tmp_path), enabled=True, segment_bytes=segment_bytes,
+                             max_bytes=2 * segment_bytes)
+    for i in range(8):
+        archive.record(drawing(i), 'A', float(i), 1, 'single', strokes=[[1, 1, 1, 1]], preprocessed=True)
+        archive.flush()
+    paths = segment_paths(str(tmp_path))
+    assert [p[-10:] for p in paths] == ['000003.rec', '000004.rec']
+    assert not (tmp_path / 'drawings-000001.strokes').exists()
+    # What is left still reads back, strokes included
+    for path, records in segments(str(tmp_path)):
+        assert [points.tolist() for points in stroke_points(path, records[0])] == [[[1, 1], [2, 2]]]
+    assert archive.stats()['segments_pruned'] == 2
+
+
+def test_segment_from_another_format_is_refused(tmp_path):
+    path = tmp_path / 'drawings-000001.rec'
+    path.write_bytes(b'not an archive'.ljust(HEADER_SIZE + RECORD_DTYPE.itemsize, b'\0'))
+    with pytest.raises(ValueError):
+        open_segment(str(path))
+
+
+def test_stats_survive_a_segment_pruned_meanwhile(archive, monkeypatch):
+    import drawing_archive
+
+    archive.record(drawing(0), 'A', 1.0, 1, 'single', preprocessed=True)
+    archive.flush()
+    [path] = segment_paths(archive.directory)
+    listed = [path.replace('000001', '000000'), path]  # listed, then deleted by another worker
+    monkeypatch.setattr(drawing_archive, 'segment_paths', lambda directory: listed)
+    stats = archive.stats()
+    assert stats['segments'] == 2
+    assert stats['bytes'] == HEADER_SIZE + RECORD_DTYPE.itemsize
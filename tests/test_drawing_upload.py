@@ -0,0 +1,92 @@
+"""The upload formats the scoring routes accept (drawing_upload.py)."""
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import cnn_evaluator
+
+PIXELS = np.full((28, 28), 255, dtype=np.uint8)
+PIXELS[4:24, 13:16] = 0
+
+
+def png(pixels=PIXELS):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def no_cached_scores():
+    cnn_evaluator.result_cache.clear()
+
+
+def test_all_formats_score_the_same(client):
+    data_url = 'data:image/png;base64,' + base64.b64encode(png()).decode()
+    as_json = client.post('/evaluate', json={'image': data_url, 'answer': '1', 'level': 2})
+    multipart = client.post('/evaluate', data={'image': (io.BytesIO(png()), 'drawing.png'), 'answer': '1',
+                                               'level': '2'}, content_type='multipart/form-data')
+    raw = client.post('/evaluate?answer=1&level=2', data=PIXELS.tobytes(),
+                      content_type='application/octet-stream')
+    results = [response.get_json() for response in (as_json, multipart, raw)]
+    assert [response.status_code for response in (as_json, multipart, raw)] == [200, 200, 200]
+    assert {result['score'] for result in results} == {results[0]['score']}
+    assert {result['level'] for result in results} == {2}
+
+
+def test_raw_upload_of_another_size(client):
+    big = np.asarray(Image.fromarray(PIXELS).resize((56, 42)))
+    response = client.post('/evaluate?answer=1', data=big.tobytes(), content_type='application/octet-stream',
+                           headers={'X-Image-Width': '56', 'X-Image-Height': '42'})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('body, headers', [
+    (PIXELS.tobytes()[:-1], {}),
+    (PIXELS.tobytes(), {'X-Image-Width': 'wide'}),
+    (PIXELS.tobytes(), {'X-Image-Width': '5000', 'X-Image-Height': '1'}),
+])
+def test_bad_raw_upload_is_a_400(client, body, headers):
+    response = client.post('/evaluate?answer=1', data=body, content_type='application/octet-stream',
+                           headers=headers)
+    assert response.status_code == 400
+
+
+def test_unsupported_content_type_is_a_400(client):
+    response = client.post('/evaluate', data='image', content_type='text/plain')
+    assert response.status_code == 400
+    assert 'text/plain' in response.get_json()['error']
+
+
+def test_missing_drawing_is_a_400(client):
+    response = client.post('/evaluate', data={'answer': '1'}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def game(client):
+    client.post('/multiplayer/start_game', json={'player1_name': 'Ana', 'player2_name': 'Ben'})
+
+
+def test_multiplayer_multipart_submit(client, game):
+    response = client.post('/multiplayer/submit_drawing', content_type='multipart/form-data',
+                           data={'drawing_data': (io.BytesIO(png()), 'drawing.png'), 'player': '1'})
+    assert response.status_code == 200
+    assert response.get_json()['current_turn'] == 2
+
+
+@pytest.mark.parametrize('player', ['x', '3', '0', '1.0', ''])
+def test_multiplayer_submit_rejects_an_unknown_player(client, game, player):
+    response = client.post(f'/multiplayer/submit_drawing?player={player}', data=PIXELS.tobytes(),
+                           content_type='application/octet-stream')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'player must be 1 or 2'
+
+
+@pytest.mark.parametrize('player', [3, True, [1]])
+def test_multiplayer_submit_rejects_a_non_player_json_value(client, game, player):
+    data_url = 'data:image/png;base64,' + base64.b64encode(png()).decode()
+    response = client.post('/multiplayer/submit_drawing', json={'drawing_data': data_url, 'player': player})
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+"""Pushed game state over server-sent events (NoseDrawDuel/multiplayer/game_events.py and /multiplayer/events)."""
+import json
+import threading
+import time
+
+import pytest
+
+from NoseDrawDuel.multiplayer import routes
+from NoseDrawDuel.multiplayer.game_events import GONE, GameEventHub, format_event
+
+
+def events(chunks):
+    """(event, id, data) for every SSE message in the stream chunks."""
+    parsed = []
+    for message in ''.join(chunks).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line and line[0] != ':')
+        if 'event' in fields:
+            parsed.append((fields['event'], fields.get('id'), json.loads(fields['data'])))
+    return parsed
+
+
+def test_format_event():
+    assert format_event('state', '{"a": 1}', 3) == 'event: state\nid: 3\ndata: {"a": 1}\n\n'
+    assert format_event('ended', '{}') == 'event: ended\ndata: {}\n\n'
+
+
+def test_notify_wakes_a_waiting_stream():
+    hub = GameEventHub()
+    hub._watchers['s'] += 1
+    hub.notify('s', 1)
+    threading.Timer(0.05, hub.notify, ('s', 2)).start()
+    started = time.monotonic()
+    assert hub.wait('s', 1, timeout=5) == 2
+    assert time.monotonic() - started < 1
+
+
+def test_versions_never_move_back():
+    hub = GameEventHub()
+    hub._watchers['s'] += 1
+    hub.notify('s', 3)
+    hub.notify('s', 2)
+    assert hub.wait('s', 0, timeout=0) == 3
+    hub.notify('s', GONE)
+    hub.notify('s', 4)
+    assert hub.wait('s', 3, timeout=0) == GONE
+
+
+def test_unwatched_sessions_are_not_tracked():
+    hub = GameEventHub()
+    hub.notify('s', 1)
+    assert hub.wait('s', 0, timeout=0) is None
+
+
+@pytest.fixture
+def game(client):
+    client.post('/multiplayer/start_game', json={'player1_name': 'Ana', 'player2_name': 'Ben'})
+
+
+@pytest.fixture
+def short_streams(monkeypatch):
+    monkeypatch.setattr(routes, 'GAME_EVENTS_MAX_STREAM', 0.3)
+    monkeypatch.setattr(routes, 'GAME_EVENTS_KEEPALIVE', 0.1)
+
+
+def test_stream_sends_the_state_without_the_answer(client, game, short_streams):
+    response = client.get('/multiplayer/events')
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.startswith('retry: 1000\n\n')
+    assert ': keepalive' in body
+    [(event, event_id, state)] = events([body])
+    assert (event, event_id) == ('state', '0')
+    assert state['game_status'] == 'player1_turn'
+    assert 'current_answer' not in state
+
+
+def test_reconnect_resumes_from_the_last_event_id(client, game, short_streams):
+    body = client.get('/multiplayer/events', headers={'Last-Event-ID': '0'}).get_data(as_text=True)
+    assert events([body]) == []
+
+
+def test_changes_are_pushed_to_an_open_stream(client, data_url, game):
+    response = client.get('/multiplayer/events', buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks) == b'retry: 1000\n\n'
+    assert events([next(chunks).decode()])[0][1] == '0'
+    client.post('/multiplayer/submit_drawing', json={'drawing_data': data_url(), 'player': 1})
+    [(event, event_id, state)] = events([next(chunks).decode()])
+    assert (event, event_id, state['current_turn']) == ('state', '1', 2)
+    client.post('/multiplayer/end_game')
+    assert events([next(chunks).decode()]) == [('ended', None, {})]
+    response.close()
+
+
+def test_no_stream_without_a_game(client):
+    assert client.get('/multiplayer/events').status_code == 404
@@ -0,0 +1,121 @@
+"""Write-behind recording of results and the leaderboard summary (game_history.py)."""
+import pytest
+
+from game_history import HistoryWriter, history
+from local_scoring import local_scoring
+
+
+@pytest.fixture
+def db(app):
+    from NoseDrawDuel.models import DrawingResult, LeaderboardEntry
+    db = app.extensions['sqlalchemy']
+    history.flush()  # whatever earlier tests' requests queued, so it does not land mid-test
+    with app.app_context():
+        for model in (DrawingResult, LeaderboardEntry):
+            db.session.execute(db.delete(model))
+        db.session.commit()
+    return db
+
+
+@pytest.fixture
+def writer(app, db):
+    """A writer whose thread never wakes on its own: the tests flush and refresh by hand."""
+    from NoseDrawDuel.models import DrawingResult, LeaderboardEntry
+    writer = HistoryWriter(enabled=True, flush_interval=3600, refresh_interval=0, board_size=2, queue_size=10)
+    writer.init_app(app, db, DrawingResult, LeaderboardEntry)
+    return writer
+
+
+def stored(app, db):
+    from NoseDrawDuel.models import DrawingResult
+    with app.app_context():
+        rows = db.session.execute(db.select(DrawingResult).order_by(DrawingResult.id)).scalars().all()
+        return [(row.mode, row.answer, row.score, row.player_name) for row in rows]
+
+
+def test_record_only_queues_until_flushed(app, db, writer):
+    assert writer.record('single', 'a', 50.0, 3, player_name=' Ana ')
+    assert stored(app, db) == []
+    assert writer.flush() == 1
+    assert stored(app, db) == [('single', 'A', 50.0, 'Ana')]
+    assert writer.stats()['pending'] == 0
+
+
+def test_any_json_player_name_is_recorded_as_text(app, db, writer):
+    for name in (5, ['Ana'], '', None):
+        assert writer.record('single', 'A', 1.0, 1, player_name=name)
+    writer.flush()
+    assert [row[3] for row in stored(app, db)] == ['5', "['Ana']", None, None]
+
+
+def test_scoring_route_survives_a_non_string_player_name(client, db, data_url):
+    response = client.post('/evaluate', json={'image': data_url(), 'answer': '1', 'player_name': 5})
+    assert response.status_code == 200
+
+
+def test_failed_batch_is_kept_and_written_on_the_next_flush(app, db, writer, monkeypatch):
+    for score in (10.0, 20.0):
+        writer.record('single', 'A', score, 1)
+    insert = db.insert
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr(db, 'insert', unavailable)
+    assert writer.flush() == 0
+    assert writer.stats()['pending'] == 2
+    monkeypatch.setattr(db, 'insert', insert)
+    writer.record('single', 'A', 30.0, 2)
+    assert writer.flush() == 3
+    assert [row[2] for row in stored(app, db)] == [10.0, 20.0, 30.0]
+    stats = writer.stats()
+    assert (stats['failed_batches'], stats['written'], stats['dropped']) == (1, 3, 0)
+
+
+def test_retried_batch_never_outgrows_the_queue(app, db, writer, monkeypatch):
+    monkeypatch.setattr(db, 'insert', lambda *args, **kwargs: 1 / 0)
+    for score in range(8):
+        writer.record('single', 'A', float(score), 1)
+    writer._queue.maxsize = 5  # the queue shrank (or filled up) while the batch was out
+    writer.flush()
+    assert writer.stats()['dropped'] == 3
+    assert writer.stats()['pending'] == 5
+
+
+def test_full_queue_drops_instead_of_blocking(writer):
+    results = [writer.record('single', 'A', 1.0, 1) for _ in range(12)]
+    assert results.count(False) == 2
+    assert writer.stats()['dropped'] == 2
+
+
+def test_leaderboards_keep_the_top_results_per_key(app, db, writer):
+    for player, answer, score in [('Ana', 'A', 90.0), ('Ben', 'A', 70.0), ('Cy', 'A', 80.0), ('Ana', 'B', 60.0)]:
+        writer.record('single', answer, score, 3, player_name=player, level=1)
+    writer.flush()
+    writer.refresh()
+    with app.app_context():
+        question = writer.leaderboard('question')
+        assert [(e['player_name'], e['rank']) for e in question['A']] == [('Ana', 1), ('Cy', 2)]
+        assert [e['score'] for e in writer.leaderboard('player', 'Ana')['Ana']] == [90.0, 60.0]
+        assert [e['score'] for e in writer.leaderboard('level', 1)['1']] == [90.0, 80.0]
+        # Refreshing again replaces the summary rather than adding to it
+        writer.refresh()
+        assert len(writer.leaderboard('question', 'a')['A']) == 2
+    assert writer.stats()['refreshes'] == 2
+
+
+def test_only_verified_browser_scores_are_recorded(client, db, data_url, monkeypatch):
+    from NoseDrawDuel.models import DrawingResult
+    body = {'image': data_url(), 'answer': '1', 'score': 300, 'player_name': 'Cheater'}
+
+    monkeypatch.setattr(local_scoring, 'should_verify', lambda version: False)
+    assert client.post('/evaluate_local', json=body).get_json()['verified'] is False
+    monkeypatch.setattr(local_scoring, 'should_verify', lambda version: True)
+    response = client.post('/evaluate_local', json=body).get_json()
+    assert response['verified'] is True
+    history.flush()
+    with client.application.app_context():
+        rows = db.session.execute(db.select(DrawingResult.score)
+                                  .where(DrawingResult.player_name == 'Cheater')).scalars().all()
+    # Only the server's own score of the verified submission
+    assert rows == [pytest.approx(response['score'])]
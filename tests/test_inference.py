@@ -0,0 +1,190 @@
+"""Timeouts and late replies in the micro-batcher and the inference worker pool."""
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from inference_batcher import MicroBatcher
+from inference_pool import (InferenceError, InferencePool, InferenceTimeout, WorkerStarting, _buffer_bytes,
+                            _Worker)
+
+# Stands in for `python -m inference_pool`: answers each command with the sum of every input image.
+# 'silent' never answers; 'late-error' and 'late-result' first send a reply to an earlier request,
+# the second after overwriting the shared block as a late result would.
+FAKE_WORKER = r'''
+import struct, sys
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+shm = shared_memory.SharedMemory(name=sys.argv[1])
+resource_tracker.unregister(shm._name, 'shared_memory')
+mode = sys.argv[2]
+REQUEST, REPLY = struct.Struct('<cII'), struct.Struct('<IBI')
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+first = True
+while True:
+    header = stdin.read(REQUEST.size)
+    if len(header) < REQUEST.size or mode == 'silent':
+        break
+    op, request_id, n = REQUEST.unpack(header)
+    if first and mode == 'late-error':
+        stdout.write(REPLY.pack(request_id + 1000, 1, 4) + b'late')
+    elif first and mode == 'late-result':
+        np.ndarray((n, 1), dtype=np.float32, buffer=shm.buf)[:] = -1
+        stdout.write(REPLY.pack(request_id + 1000, 0, 1))
+    first = False
+    sums = np.ndarray((n, 784), dtype=np.float32, buffer=shm.buf).sum(axis=1, keepdims=True)
+    np.ndarray((n, 1), dtype=np.float32, buffer=shm.buf)[:] = sums
+    stdout.write(REPLY.pack(request_id, 0, 1))
+    stdout.flush()
+if mode == 'silent':
+    stdin.read()
+'''
+
+
+def fake_worker(mode, ready=True):
+    worker = _Worker.__new__(_Worker)
+    worker.index = 0
+    worker.max_batch = 4
+    worker.shm = shared_memory.SharedMemory(create=True, size=_buffer_bytes(4))
+    worker.process = subprocess.Popen([sys.executable, '-c', FAKE_WORKER, worker.shm.name, mode],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+    worker.ready = ready
+    worker.started_at = time.monotonic()
+    worker._next_id = 0
+    return worker
+
+
+@pytest.fixture
+def workers():
+    started = []
+
+    def start(mode, ready=True):
+        started.append(fake_worker(mode, ready))
+        return started[-1]
+
+    yield start
+    for worker in started:
+        worker.stop()
+
+
+def images(n):
+    return np.random.default_rng(n).random((n, 28, 28, 1), dtype=np.float32)
+
+
+def test_worker_answers_with_its_own_reply(workers):
+    arr = images(3)
+    out = workers('echo').call(b'P', arr, timeout=5)
+    np.testing.assert_allclose(out[:, 0], arr.reshape(3, -1).sum(axis=1), rtol=1e-5)
+
+
+def test_silent_worker_times_out(workers):
+    worker = workers('silent')
+    start = time.monotonic()
+    with pytest.raises(InferenceTimeout):
+        worker.call(b'P', images(1), timeout=0.1)
+    assert time.monotonic() - start < 2
+
+
+@pytest.mark.parametrize('mode', ['late-error', 'late-result'])
+def test_late_reply_to_an_earlier_request_is_discarded(workers, mode):
+    arr = images(2)
+    out = workers(mode).call(b'P', arr, timeout=5)
+    np.testing.assert_allclose(out[:, 0], arr.reshape(2, -1).sum(axis=1), rtol=1e-5)
+
+
+def test_loading_worker_raises_worker_starting_within_the_limit(workers):
+    worker = workers('silent', ready=False)
+    start = time.monotonic()
+    with pytest.raises(WorkerStarting):
+        worker.wait_ready(60, limit=0.05)
+    assert time.monotonic() - start < 2
+    # Past its start timeout it is a plain timeout, so the pool replaces it
+    with pytest.raises(InferenceTimeout) as timeout:
+        worker.wait_ready(0.05)
+    assert not isinstance(timeout.value, WorkerStarting)
+
+
+@pytest.fixture
+def pool(workers, monkeypatch):
+    """A started one-worker pool whose restarts are counted and replaced by still-loading fakes."""
+    pool = InferencePool(size=1, timeout=0.1, max_batch=4, health_interval=0)
+    pool._started = True
+
+    def replace(worker):
+        worker.stop()
+        pool._count('restarts')
+        return workers('silent', ready=False)
+
+    monkeypatch.setattr(pool, '_replace', replace)
+    return pool
+
+
+def test_pool_replaces_a_worker_that_times_out(pool, workers):
+    pool._idle.put(workers('silent'))
+    with pytest.raises(InferenceTimeout):
+        pool.predict(images(1))
+    # The replacement is still loading: the next request fails fast instead of waiting for it
+    with pytest.raises(WorkerStarting):
+        pool.predict(images(1))
+    stats = pool.stats()
+    assert (stats['timeouts'], stats['restarts'], stats['worker_starting'], stats['idle']) == (1, 1, 1, 1)
+
+
+def test_pool_times_out_when_no_worker_is_free(pool):
+    with pytest.raises(InferenceTimeout):
+        pool.predict(images(1))
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_pool_splits_batches_larger_than_the_block(pool, workers):
+    pool.timeout = 5  # the fake still has to import NumPy
+    pool._idle.put(workers('echo'))
+    arr = images(10)
+    out = pool.predict(arr)
+    assert out.shape == (10, 1)
+    np.testing.assert_allclose(out[:, 0], arr.reshape(10, -1).sum(axis=1), rtol=1e-5)
+
+
+def test_batcher_groups_concurrent_requests():
+    seen = []
+
+    def predict(arr):
+        seen.append(len(arr))
+        return arr.reshape(len(arr), -1).sum(axis=1, keepdims=True)
+
+    batcher = MicroBatcher(predict, max_batch_size=8, max_wait=0.05)
+    arr = images(8)
+    futures = [batcher.submit(arr[i:i + 1]) for i in range(8)]
+    results = [future.result(timeout=2) for future in futures]
+    np.testing.assert_allclose(np.concatenate(results), arr.reshape(8, -1).sum(axis=1), rtol=1e-5)
+    assert sum(seen) == 8 and len(seen) < 8
+
+
+def test_batcher_caller_times_out_on_a_slow_model():
+    release = threading.Event()
+
+    def slow(arr):
+        release.wait(2)
+        return np.zeros((len(arr), 10), dtype=np.float32)
+
+    batcher = MicroBatcher(slow, max_wait=0)
+    with pytest.raises(FutureTimeout):
+        batcher.predict(images(1), timeout=0.05)
+    release.set()
+
+
+def test_batcher_passes_model_errors_to_every_caller():
+    def broken(arr):
+        raise InferenceError('model failed')
+
+    batcher = MicroBatcher(broken, max_batch_size=4, max_wait=0.05)
+    futures = [batcher.submit(images(1)) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(InferenceError):
+            future.result(timeout=2)
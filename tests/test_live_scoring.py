@@ -0,0 +1,93 @@
+"""The running score while a drawing is in progress (live_scoring.py and the /live routes)."""
+import time
+
+import numpy as np
+import pytest
+
+from live_scoring import LiveDrawing, LiveScorer
+from stroke_raster import Canvas, decode_strokes
+
+CANVAS = {'canvas': [280, 280], 'pen': 8, 'ink': '#000000'}
+VERTICAL = [[140, 60, 0, 40, 0, 40, 0, 40, 0, 40]]  # delta-encoded, as the page sends strokes
+HORIZONTAL = [[60, 140, 40, 0, 40, 0, 40, 0, 40, 0]]
+
+
+def open_live(client, answer='1'):
+    response = client.post('/live', json=dict(CANVAS, answer=answer))
+    assert response.status_code == 200
+    return response.get_json()['live_id']
+
+
+def post(client, live_id, seq, strokes, **fields):
+    return client.post(f'/live/{live_id}/strokes', json=dict(fields, seq=seq, strokes=strokes))
+
+
+def test_reset_starts_the_drawing_over(client):
+    live_id = open_live(client)
+    assert post(client, live_id, 1, HORIZONTAL).status_code == 200
+    # The page clears the canvas, or resends everything after a failed post
+    response = post(client, live_id, 2, VERTICAL, reset=True)
+    assert response.status_code == 200
+    assert response.get_json()['seq'] == 2
+    assert post(client, live_id, 3, VERTICAL, **{'continue': False}).status_code == 200
+
+
+def test_reset_clears_the_canvas():
+    canvas = Canvas(280, 280, 8, 0)
+    drawing, fresh = LiveDrawing('1', canvas), LiveDrawing('1', canvas)
+    drawing.add(decode_strokes(HORIZONTAL), False)
+    drawing.reset()
+    drawing.add(decode_strokes(VERTICAL), False)
+    fresh.add(decode_strokes(VERTICAL), False)
+    np.testing.assert_array_equal(drawing.render(), fresh.render())
+    assert drawing.points == fresh.points
+
+
+def test_out_of_order_post_asks_for_a_resend(client):
+    live_id = open_live(client)
+    response = post(client, live_id, 3, VERTICAL)
+    assert response.status_code == 409
+    assert response.get_json()['expected'] == 1
+
+
+def test_retried_post_is_not_drawn_twice(client):
+    live_id = open_live(client)
+    post(client, live_id, 1, VERTICAL)
+    response = post(client, live_id, 1, VERTICAL)
+    assert response.status_code == 200
+    assert response.get_json()['seq'] == 1
+
+
+def test_unknown_session_and_bad_strokes(client):
+    assert post(client, 'nope', 1, VERTICAL).status_code == 404
+    live_id = open_live(client)
+    assert post(client, live_id, 1, [['x']]).status_code == 400
+    assert client.post('/live', json={'answer': '1'}).status_code == 400
+
+
+def test_changed_sessions_are_scored_together_at_most_hz_times_a_second():
+    batches = []
+
+    def score(batch, labels):
+        batches.append(list(labels))
+        return np.full(len(batch), 0.5)
+
+    scorer = LiveScorer(score_fn=score, hz=20, busy=lambda: False)
+    canvas = Canvas(280, 280, 8, 0)
+    first, second = scorer.open('1', canvas), scorer.open('7', canvas)
+    scorer.update(first, 1, VERTICAL)
+    scorer.update(second, 1, HORIZONTAL)
+    deadline = time.monotonic() + 2
+    while scorer.update(first, 1, VERTICAL)['score'] is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scorer.update(second, 1, HORIZONTAL)['score'] == 0.5
+    assert sorted(label for batch in batches for label in batch) == ['1', '7']
+    # Nothing changed since: no more predictions
+    time.sleep(0.1)
+    assert scorer.stats()['predictions'] == 2
+
+
+@pytest.mark.parametrize('hz', [0, -1, float('nan')])
+def test_rate_must_be_positive(hz):
+    with pytest.raises(ValueError, match='LIVE_SCORE_HZ'):
+        LiveScorer(hz=hz)
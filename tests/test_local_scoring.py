@@ -0,0 +1,87 @@
+"""Sampled server-side verification of browser-scored drawings (local_scoring.py and /evaluate_local)."""
+import json
+import sys
+
+import pytest
+
+from admission import Overloaded
+from local_scoring import LocalScoring, local_scoring
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path = tmp_path / 'emnist_cnn.json'
+    path.write_text(json.dumps({'version': 'v1', 'weights': 'emnist_cnn.bin'}))
+    return str(path)
+
+
+def test_without_an_export_every_claim_is_verified(tmp_path):
+    scoring = LocalScoring(str(tmp_path / 'missing.json'), verify_fraction=0)
+    assert not scoring.available()
+    assert scoring.should_verify('v1')
+
+
+def test_claims_are_sampled_at_the_verify_fraction(manifest):
+    assert not LocalScoring(manifest, verify_fraction=0).should_verify('v1')
+    assert LocalScoring(manifest, verify_fraction=1).should_verify('v1')
+    sampled = LocalScoring(manifest, verify_fraction=0.5)
+    hits = sum(sampled.should_verify('v1') for _ in range(2000))
+    assert 800 < hits < 1200
+
+
+def test_claims_from_another_model_version_are_always_verified(manifest):
+    scoring = LocalScoring(manifest, verify_fraction=0)
+    assert scoring.should_verify('v0')
+    assert scoring.stats()['stale_model'] == 1
+
+
+def test_mismatch_beyond_the_tolerance_is_counted(manifest):
+    scoring = LocalScoring(manifest, tolerance=1.0)
+    assert scoring.verified(50.0, 50.9, 'A')
+    assert not scoring.verified(50.0, 60.0, 'A')
+    stats = scoring.stats()
+    assert (stats['verified'], stats['mismatches']) == (2, 1)
+
+
+def test_offload_ratio(manifest):
+    scoring = LocalScoring(manifest)
+    for _ in range(3):
+        scoring.trusted()
+    scoring.verified(1.0, 1.0, 'A')
+    assert scoring.stats()['offload_ratio'] == 0.75
+    assert scoring.stats()['model_calls_avoided'] == 3
+
+
+def test_config_is_disabled_without_an_export(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(local_scoring, 'manifest_path', str(tmp_path / 'missing.json'))
+    assert client.get('/evaluate_local/config').get_json() == {'enabled': False}
+
+
+def test_config_carries_the_version_and_scoring_rules(client, manifest, monkeypatch):
+    monkeypatch.setattr(local_scoring, 'manifest_path', manifest)
+    monkeypatch.setattr(local_scoring, 'enabled', True)
+    config = client.get('/evaluate_local/config').get_json()
+    assert (config['enabled'], config['model_version']) == (True, 'v1')
+    assert set(config['scoring']) == {'score_scale', 'top_k_credit', 'star_thresholds', 'correct_threshold'}
+
+
+def test_verified_claim_is_answered_with_the_server_score(client, data_url, monkeypatch):
+    monkeypatch.setattr(local_scoring, 'should_verify', lambda version: True)
+    mismatches = local_scoring.stats()['mismatches']
+    response = client.post('/evaluate_local', json={'image': data_url(), 'answer': '1', 'score': 343}).get_json()
+    assert response['verified'] is True
+    assert response['score'] != 343
+    assert local_scoring.stats()['mismatches'] == mismatches + 1
+
+
+def test_verification_is_skipped_under_overload(client, data_url, monkeypatch):
+    def shed(pixels, answer):
+        raise Overloaded('busy', 1)
+
+    monkeypatch.setattr(local_scoring, 'should_verify', lambda version: True)
+    monkeypatch.setattr(sys.modules['app'], 'evaluate_preprocessed', shed)
+    skipped = local_scoring.stats()['verify_skipped']
+    response = client.post('/evaluate_local', json={'image': data_url(), 'answer': '1', 'score': 120})
+    assert response.status_code == 200
+    assert (response.get_json()['score'], response.get_json()['verified']) == (120, False)
+    assert local_scoring.stats()['verify_skipped'] == skipped + 1
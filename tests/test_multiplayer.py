@@ -0,0 +1,71 @@
+"""Turn order and round checks of the two-player game routes (NoseDrawDuel/multiplayer/routes.py)."""
+import threading
+
+import pytest
+
+from game_history import history
+from NoseDrawDuel.multiplayer import routes
+
+
+@pytest.fixture
+def game(client):
+    response = client.post('/multiplayer/start_game', json={'player1_name': 'Ana', 'player2_name': 'Ben'})
+    return response.get_json()['session_id']
+
+
+def submit(client, data_url, player):
+    return client.post('/multiplayer/submit_drawing', json={'drawing_data': data_url(), 'player': player})
+
+
+def test_players_take_turns(client, data_url, game):
+    first = submit(client, data_url, 1).get_json()
+    assert (first['game_status'], first['current_turn']) == ('player2_turn', 2)
+    second = submit(client, data_url, 2).get_json()
+    assert second['game_status'] == 'finished'
+    assert second['winner'] is not None
+
+
+def test_submit_out_of_turn_is_refused(client, data_url, game):
+    assert submit(client, data_url, 2).status_code == 409
+    submit(client, data_url, 1)
+    submit(client, data_url, 2)
+    recorded = history.stats()['recorded']
+    # A retried or double-clicked submit after the game finished
+    response = submit(client, data_url, 1)
+    assert response.status_code == 409
+    state = client.get('/multiplayer/get_game_state').get_json()['game_state']
+    assert state['game_status'] == 'finished'
+    assert history.stats()['recorded'] == recorded
+
+
+def test_submit_scored_for_an_old_round_is_refused(client, data_url, game, monkeypatch):
+    evaluate = routes.evaluate_preprocessed
+
+    def next_question_lands_meanwhile(pixels, answer):
+        routes.get_store().update(game, lambda state: state.update(current_answer='Z' if answer != 'Z' else 'Y'))
+        return evaluate(pixels, answer)
+
+    monkeypatch.setattr(routes, 'evaluate_preprocessed', next_question_lands_meanwhile)
+    recorded = history.stats()['recorded']
+    response = submit(client, data_url, 1)
+    assert response.status_code == 409
+    state = client.get('/multiplayer/get_game_state').get_json()['game_state']
+    assert (state['game_status'], state['player1_score']) == ('player1_turn', 0.0)
+    assert history.stats()['recorded'] == recorded
+
+
+def test_first_requests_share_one_store(app, monkeypatch):
+    monkeypatch.setattr(routes, '_store', None)
+    stores, start = [], threading.Barrier(8)
+
+    def first_request():
+        start.wait()
+        with app.app_context():
+            stores.append(routes.get_store())
+
+    threads = [threading.Thread(target=first_request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(store) for store in stores}) == 1
@@ -0,0 +1,95 @@
+"""Cached, conditional delivery of the question bank (question_bank.py and /questions)."""
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from question_bank import QuestionBank
+
+
+def test_questions_are_served_with_a_strong_etag(client):
+    response = client.get('/questions')
+    assert response.status_code == 200
+    assert response.get_json()['questions']
+    etag, weak = response.get_etag()
+    assert etag and not weak
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_current_copy_gets_304(client):
+    etag = client.get('/questions').get_etag()[0]
+    response = client.get('/questions', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.get_etag()[0] == etag
+
+
+def test_gzip_when_accepted(client):
+    plain = client.get('/questions')
+    zipped = client.get('/questions', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.get_etag()[0] != plain.get_etag()[0]
+    # Either representation's ETag validates the cached copy
+    response = client.get('/questions', headers={'If-None-Match': f'"{plain.get_etag()[0]}"',
+                                                 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 304
+
+
+def test_filters_and_pages(client):
+    level = client.get('/questions?level=3').get_json()['questions']
+    assert level and {q['level'] for q in level} == {3}
+    page = client.get('/questions?page=2&per_page=3').get_json()
+    everything = client.get('/questions').get_json()['questions']
+    assert page['questions'] == everything[3:6]
+    assert (page['page'], page['per_page'], page['total']) == (2, 3, len(everything))
+    assert client.get('/questions?page=1&per_page=1000').get_json()['per_page'] == 100
+
+
+@pytest.fixture
+def bank_file(tmp_path):
+    path = tmp_path / 'questions.json'
+
+    def write(questions):
+        path.write_text(json.dumps({'questions': questions}))
+        # A new mtime even on filesystems with coarse timestamps
+        stamp = time.time() + len(questions)
+        os.utime(path, (stamp, stamp))
+    write([{'id': 1, 'question': 'Draw the number 1', 'answer': '1', 'level': 1, 'type': 'number'}])
+    return path, write
+
+
+def test_edited_file_is_reloaded_with_a_new_etag(bank_file):
+    path, write = bank_file
+    bank = QuestionBank(str(path), reload_interval=0.01)
+    before = bank.snapshot().full.etag
+    write([{'id': 1, 'question': 'Draw the letter A', 'answer': 'A', 'level': 1, 'type': 'letter'},
+           {'id': 2, 'question': 'Draw the letter B', 'answer': 'B', 'level': 2, 'type': 'letter'}])
+    time.sleep(0.02)
+    assert [q['answer'] for q in bank.questions()] == ['A', 'B']
+    assert bank.snapshot().full.etag != before
+    assert bank.get(2)['answer'] == 'B'
+    assert bank.stats()['loads'] == 2
+
+
+def test_broken_file_keeps_the_last_good_questions(bank_file):
+    path, _ = bank_file
+    bank = QuestionBank(str(path), reload_interval=0.01)
+    etag = bank.snapshot().full.etag
+    path.write_text('{"questions": [')
+    time.sleep(0.02)
+    assert [q['answer'] for q in bank.questions()] == ['1']
+    assert bank.snapshot().full.etag == etag
+    assert bank.stats()['load_errors'] == 1
+
+
+def test_unchanged_file_is_not_parsed_again(bank_file):
+    path, _ = bank_file
+    bank = QuestionBank(str(path), reload_interval=0.01)
+    snapshot = bank.snapshot()
+    time.sleep(0.02)
+    assert bank.snapshot() is snapshot
+    assert bank.stats()['loads'] == 1
@@ -0,0 +1,83 @@
+"""rescore.py resumes from its checkpoint and ends with the same rows as an uninterrupted run."""
+import csv
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import rescore
+from drawing_archive import DrawingArchive
+
+
+@pytest.fixture
+def archived(tmp_path):
+    """A drawing archive of ten drawings."""
+    directory = tmp_path / 'archive'
+    archive = DrawingArchive(directory=str(directory), enabled=True, max_bytes=0)
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        archive.record(rng.integers(0, 256, (28, 28), dtype=np.uint8), 'ABC'[i % 3], float(i * 10), 1, 'single',
+                       preprocessed=True)
+    archive.flush()
+    return str(directory)
+
+
+def run(source, output, *options):
+    rescore.main([source, '--output', str(output), '--workers', '1', '--batch-size', '3', *options])
+
+
+def rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_resume_continues_after_the_checkpoint(archived, tmp_path, capsys):
+    full, partial = tmp_path / 'full.csv', tmp_path / 'partial.csv'
+    run(archived, full)
+    run(archived, partial, '--limit', '4')
+    checkpoint = json.loads((tmp_path / 'partial.csv.checkpoint.json').read_text())
+    assert checkpoint['done'] == 4
+    # A crash after writing rows but before the next checkpoint
+    with open(partial, 'a') as f:
+        f.write('segment:99,X,1,1,1,1,0,False,False,\n')
+    capsys.readouterr()
+
+    run(archived, partial, '--resume')
+    summary = json.loads(capsys.readouterr().out)
+    assert (summary['resumed_after'], summary['drawings']) == (4, 6)
+    assert rows(partial) == rows(full)
+    assert len(rows(full)) == 11
+
+
+def test_resume_refuses_a_checkpoint_of_other_options(archived, tmp_path):
+    output = tmp_path / 'out.csv'
+    run(archived, output, '--limit', '4')
+    with pytest.raises(SystemExit, match='different options'):
+        run(archived, output, '--resume', '--scale', '2')
+
+
+def test_recorded_scores_are_the_old_scores(archived, tmp_path):
+    output = tmp_path / 'out.csv'
+    run(archived, output)
+    table = rows(output)
+    header, body = table[0], table[1:]
+    old = [float(row[header.index('old_score')]) for row in body]
+    assert old == [float(i * 10) for i in range(10)]
+    assert [row[header.index('answer')] for row in body] == ['ABC'[i % 3] for i in range(10)]
+
+
+def test_png_directory_resumes_in_the_same_order(tmp_path, capsys):
+    source = tmp_path / 'drawings'
+    for label in '17':
+        (source / label).mkdir(parents=True)
+        for i in range(3):
+            image = Image.new('L', (56, 56), 255)
+            image.paste(0, (26, 8 + i, 30, 48))
+            image.save(source / label / f'{i}.png')
+    full, partial = tmp_path / 'full.csv', tmp_path / 'partial.csv'
+    run(str(source), full)
+    run(str(source), partial, '--limit', '2')
+    run(str(source), partial, '--resume')
+    assert rows(partial) == rows(full)
+    assert [row[1] for row in rows(full)[1:]] == ['1', '1', '1', '7', '7', '7']
@@ -0,0 +1,86 @@
+"""Cache keys and bounds of the score cache, and how evaluate_with_cnn uses it."""
+import time
+
+import numpy as np
+import pytest
+
+import cnn_evaluator
+from result_cache import ResultCache
+
+
+def pixels(seed):
+    return np.random.default_rng(seed).random((1, 28, 28, 1), dtype=np.float32)
+
+
+def test_key_depends_on_pixels_label_and_model_generation():
+    arr = pixels(0)
+    key = ResultCache.make_key(arr, 'a', 1)
+    assert key == ResultCache.make_key(arr.copy(), 'A', 1)
+    assert key != ResultCache.make_key(arr, 'B', 1)
+    assert key != ResultCache.make_key(arr, 'A', 2)
+    changed = arr.copy()
+    changed[0, 14, 14, 0] += 1e-3
+    assert key != ResultCache.make_key(changed, 'A', 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2, ttl=60)
+    keys = [ResultCache.make_key(pixels(i), 'A') for i in range(3)]
+    cache.put(keys[0], 0.1)
+    cache.put(keys[1], 0.2)
+    assert cache.get(keys[0]) == 0.1
+    cache.put(keys[2], 0.3)
+    assert cache.get(keys[1]) is None
+    assert (cache.get(keys[0]), cache.get(keys[2])) == (0.1, 0.3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ResultCache(max_entries=4, ttl=0.01)
+    key = ResultCache.make_key(pixels(0), 'A')
+    cache.put(key, 0.5)
+    time.sleep(0.02)
+    assert cache.get(key) is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_size_zero_disables_the_cache():
+    cache = ResultCache(max_entries=0)
+    key = ResultCache.make_key(pixels(0), 'A')
+    cache.put(key, 0.5)
+    assert cache.get(key) is None
+    assert cache.stats()['entries'] == 0
+
+
+@pytest.fixture
+def predictions(monkeypatch):
+    """Count the forward passes evaluate_with_cnn makes, on a fresh cache."""
+    calls = []
+    predict = cnn_evaluator.predict
+
+    def counted(arr):
+        calls.append(len(arr))
+        return predict(arr)
+
+    monkeypatch.setattr(cnn_evaluator, 'predict', counted)
+    monkeypatch.setattr(cnn_evaluator, 'result_cache', ResultCache(16, 60))
+    return calls
+
+
+def test_resubmitted_drawing_is_answered_from_the_cache(predictions):
+    drawing = np.full((28, 28), 255, dtype=np.uint8)
+    drawing[4:24, 13:15] = 0
+    first = cnn_evaluator.evaluate_preprocessed(drawing, '1')
+    assert cnn_evaluator.evaluate_preprocessed(drawing.copy(), '1') == first
+    assert len(predictions) == 1
+    # Another answer is another key
+    cnn_evaluator.evaluate_preprocessed(drawing, '7')
+    assert len(predictions) == 2
+
+
+def test_model_reload_does_not_serve_stale_scores(predictions, monkeypatch):
+    drawing = np.full((28, 28), 255, dtype=np.uint8)
+    cnn_evaluator.evaluate_preprocessed(drawing, 'A')
+    monkeypatch.setattr(cnn_evaluator, 'model_version', lambda: -1)
+    cnn_evaluator.evaluate_preprocessed(drawing, 'A')
+    assert len(predictions) == 2
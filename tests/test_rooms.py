@@ -0,0 +1,171 @@
+"""Room memory budget, eviction and tournament lifetime in RoomStore, and the rooms API's input checks."""
+import itertools
+import time
+
+import numpy as np
+import pytest
+
+from NoseDrawDuel.multiplayer.rooms import FINISHED, RoomCapacityError, RoomNotFound, RoomStore
+
+QUESTION = {'question': 'Draw the number 1', 'answer': '1'}
+BLANK = np.full((28, 28), 255, dtype=np.uint8)
+
+
+def questions():
+    return lambda: QUESTION
+
+
+def play_round(store, code, scores=None):
+    """Start a round and score it (see score_round)."""
+    store.start_round(code, QUESTION)
+    return score_round(store, code, scores)
+
+
+def score_round(store, code, scores=None):
+    """Have everyone in a drawing room submit and score it with the given (or increasing) scores."""
+    for seat in range(len(store.get(code)['players'])):
+        store.submit(code, seat, BLANK)
+    players, _, _ = store.begin_scoring(code)
+    scores = scores or [float(i) for i in range(len(players))]
+    return store.finish_scoring(code, players, scores, [0] * len(players))
+
+
+def room_with_players(store, *names):
+    code = store.create()['code']
+    for name in names:
+        store.join(code, name)
+    return code
+
+
+def test_finished_rooms_are_evicted_least_recently_active_first():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=60)
+    old, recent = room_with_players(store, 'Ana', 'Ben'), room_with_players(store, 'Cy', 'Di')
+    play_round(store, old)
+    play_round(store, recent)
+    store.budget_bytes = store.stats()['bytes']  # full: the next room has to make space
+    store.create()
+    with pytest.raises(RoomNotFound):
+        store.get(old)
+    assert store.get(recent)['status'] == FINISHED
+    assert store.stats()['evicted'] == 1
+
+
+def test_active_rooms_are_never_evicted():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=60)
+    waiting = room_with_players(store, 'Ana')
+    store.budget_bytes = store.stats()['bytes']
+    with pytest.raises(RoomCapacityError):
+        store.create()
+    assert store.get(waiting)['players'][0]['name'] == 'Ana'
+    assert store.stats()['refused'] == 1
+
+
+def test_starting_a_round_never_evicts_its_own_room():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=60)
+    code = room_with_players(store, 'Ana', 'Ben')
+    play_round(store, code)
+    store.budget_bytes = store.stats()['bytes']
+    # Only this finished room could make space for its own drawings
+    with pytest.raises(RoomCapacityError):
+        store.start_round(code, QUESTION)
+    assert store.get(code)['status'] == FINISHED
+
+
+def test_accounted_bytes_return_to_zero_when_rooms_expire():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=0.05)
+    code = room_with_players(store, 'Ana', 'Ben')
+    store.start_round(code, QUESTION)
+    assert store.stats()['bytes'] > 0
+    time.sleep(0.1)
+    with pytest.raises(RoomNotFound):
+        store.get(code)
+    store.budget_bytes = 0  # expiry runs before the budget check
+    with pytest.raises(RoomCapacityError):
+        store.create()
+    assert store.stats()['bytes'] == 0
+
+
+def test_tournament_opens_no_rooms_when_one_fails():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=60)
+    count = itertools.count()
+
+    def flaky_question():
+        if next(count) == 1:
+            raise RuntimeError('question bank unavailable')
+        return QUESTION
+
+    with pytest.raises(RuntimeError):
+        store.create_tournament(['Ana', 'Ben', 'Cy', 'Di'], 2, flaky_question)
+    stats = store.stats()
+    assert (stats['rooms'], stats['tournaments'], stats['bytes']) == (0, 0, 0)
+
+
+def test_tournament_over_budget_leaves_nothing_behind():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=60)
+    store.create_tournament(['Ana', 'Ben', 'Cy', 'Di'], 2, questions())
+    one_tournament = store.stats()['bytes']
+    store.budget_bytes = one_tournament + one_tournament // 2
+    with pytest.raises(RoomCapacityError):
+        store.create_tournament(['Ed', 'Flo', 'Gus', 'Hal'], 2, questions())
+    stats = store.stats()
+    assert (stats['rooms'], stats['tournaments'], stats['bytes']) == (2, 1, one_tournament)
+
+
+def test_bracket_advances_the_room_winners():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=60)
+    tournament = store.create_tournament(['Ana', 'Ben', 'Cy', 'Di'], 2, questions())
+    for room in tournament['rounds'][0]:
+        assert score_round(store, room['code']) == tournament['code']
+    store.advance(tournament['code'], questions())
+    rounds = store.tournament(tournament['code'])['rounds']
+    final = rounds[1][0]
+    assert sorted(final['players']) == sorted(room['winner'] for room in rounds[0])
+    score_round(store, final['code'], scores=[10.0, 5.0])
+    store.advance(tournament['code'], questions())
+    assert store.tournament(tournament['code'])['champion'] == final['players'][0]
+
+
+def test_tournament_rooms_live_as_long_as_the_tournament():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=0.2)
+    tournament = store.create_tournament(['Ana', 'Ben', 'Cy', 'Di'], 2, questions())
+    first, second = (room['code'] for room in tournament['rounds'][0])
+    time.sleep(0.12)
+    store.submit(first, 0, BLANK)  # activity in one room keeps the whole tournament alive
+    time.sleep(0.12)
+    store.create()  # runs expiry
+    assert store.get(second)['status'] == 'drawing'
+    assert len(store.tournament(tournament['code'])['rounds'][0]) == 2
+
+
+def test_tournament_expires_with_its_rooms():
+    store = RoomStore(budget_bytes=10 ** 9, ttl=0.05)
+    tournament = store.create_tournament(['Ana', 'Ben', 'Cy', 'Di'], 2, questions())
+    time.sleep(0.1)
+    store.budget_bytes = 0
+    with pytest.raises(RoomCapacityError):
+        store.create()
+    with pytest.raises(RoomNotFound):
+        store.tournament(tournament['code'])
+    stats = store.stats()
+    assert (stats['rooms'], stats['tournaments'], stats['bytes']) == (0, 0, 0)
+
+
+@pytest.mark.parametrize('body', [{'max_players': 'ten'}, {'max_players': 2.5}, {'max_players': 0},
+                                  {'max_players': [4]}, {'max_players': True}])
+def test_create_room_rejects_a_bad_max_players(client, body):
+    response = client.post('/multiplayer/rooms', json=body)
+    assert response.status_code == 400
+    assert 'max_players' in response.get_json()['error']
+
+
+def test_create_room_accepts_a_numeric_string(client):
+    response = client.post('/multiplayer/rooms', json={'max_players': '6'})
+    assert response.status_code == 200
+    assert response.get_json()['max_players'] == 6
+
+
+@pytest.mark.parametrize('room_size', ['four', 1, 3.5])
+def test_create_tournament_rejects_a_bad_room_size(client, room_size):
+    response = client.post('/multiplayer/tournaments', json={'players': ['Ana', 'Ben'], 'room_size': room_size})
+    assert response.status_code == 400
+    assert 'room_size' in response.get_json()['error']
@@ -0,0 +1,94 @@
+"""Optimistic locking in the game session stores."""
+import threading
+
+import pytest
+
+from NoseDrawDuel.multiplayer.session_store import MemorySessionStore, SessionConflict, SQLSessionStore
+
+STATE = {'player1_name': 'Ana', 'player2_name': 'Ben', 'player1_score': 0.0, 'player2_score': 0.0,
+         'current_turn': 1, 'game_status': 'player1_turn'}
+
+
+@pytest.fixture(params=['memory', 'sql'])
+def store(request, app):
+    if request.param == 'memory':
+        yield MemorySessionStore(ttl=60, max_sessions=100)
+        return
+    from NoseDrawDuel.models import GameSession
+    with app.app_context():
+        yield SQLSessionStore(app.extensions['sqlalchemy'], GameSession, ttl=60)
+
+
+def test_compare_and_set_rejects_a_stale_version(store):
+    session_id = store.create(STATE)
+    first, second = store.get(session_id), store.get(session_id)
+    assert first['version'] == second['version'] == 0
+    assert store.compare_and_set(session_id, first['version'], dict(first, player1_score=50.0))
+    # The second writer read before the first one wrote
+    assert not store.compare_and_set(session_id, second['version'], dict(second, player2_score=70.0))
+    state = store.get(session_id)
+    assert (state['player1_score'], state['player2_score'], state['version']) == (50.0, 0.0, 1)
+
+
+def test_update_rereads_after_losing_a_race(store):
+    session_id = store.create(STATE)
+    calls = []
+
+    def mutate(state):
+        calls.append(state['version'])
+        if len(calls) == 1:
+            # Someone else commits between this read and its write
+            other = store.get(session_id)
+            assert store.compare_and_set(session_id, other['version'], dict(other, player2_score=10.0))
+        state['player1_score'] = 20.0
+
+    state = store.update(session_id, mutate)
+    assert calls == [0, 1]
+    assert state['version'] == 2
+    stored = store.get(session_id)
+    assert (stored['player1_score'], stored['player2_score']) == (20.0, 10.0)
+
+
+def test_update_gives_up_with_session_conflict(store):
+    session_id = store.create(STATE)
+
+    def always_loses(state):
+        other = store.get(session_id)
+        store.compare_and_set(session_id, other['version'], other)
+
+    with pytest.raises(SessionConflict):
+        store.update(session_id, always_loses, retries=3)
+
+
+def test_update_of_a_missing_session_returns_none(store):
+    assert store.update('nope', lambda state: None) is None
+
+
+def test_concurrent_updates_are_not_lost():
+    store = MemorySessionStore()
+    session_id = store.create(dict(STATE, player1_score=0.0))
+
+    def add_points():
+        for _ in range(50):
+            store.update(session_id, lambda state: state.update(player1_score=state['player1_score'] + 1),
+                         retries=1000)
+
+    threads = [threading.Thread(target=add_points) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state = store.get(session_id)
+    assert state['player1_score'] == 400
+    assert state['version'] == 400
+
+
+def test_memory_store_caps_sessions_least_recently_used_first():
+    store = MemorySessionStore(ttl=60, max_sessions=2)
+    first = store.create(STATE)
+    second = store.create(STATE)
+    store.get(first)
+    store.create(STATE)
+    assert store.get(second) is None
+    assert store.get(first) is not None
+    assert len(store) == 2
@@ -0,0 +1,79 @@
+"""A drawing scores the same whether it is sent as a canvas image or as strokes."""
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from cnn_evaluator import SCORE_SCALE, evaluate_with_cnn, preprocess_uint8, score_preprocessed
+from stroke_raster import StrokeError, decode_strokes, parse_canvas, rasterize_strokes, reduction, strokes_to_image
+
+TOLERANCE = 5.0  # in game score points (0-343)
+
+CANVASES = {
+    # name: (size, ink) as the pages draw them, 4 px round pen
+    'single': ((640, 480), (0, 123, 255)),
+    'multi': ((300, 300), (0, 0, 0)),
+}
+
+DRAWINGS = {
+    '1': lambda w, h: [[(w / 2, y) for y in np.linspace(h * 0.2, h * 0.8, 40)]],
+    '7': lambda w, h: [[(w * 0.3, h * 0.2), (w * 0.7, h * 0.2), (w * 0.45, h * 0.8)]],
+    '0': lambda w, h: [[(w / 2 + h * 0.2 * np.cos(a), h / 2 + h * 0.3 * np.sin(a)) for a in np.linspace(0, 2 * np.pi, 60)]],
+    'A': lambda w, h: [[(w * 0.35, h * 0.8), (w / 2, h * 0.2), (w * 0.65, h * 0.8)], [(w * 0.42, h * 0.55), (w * 0.58, h * 0.55)]],
+}
+
+
+def encode(strokes):
+    encoded = []
+    for stroke in strokes:
+        points = np.round(np.array(stroke)).astype(int)
+        encoded.append(np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=int)).ravel().tolist())
+    return encoded
+
+
+def canvas_image(strokes, size, ink):
+    """What the page's canvas holds (4 px pen, round caps), drawn with integer points as they are sent."""
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for stroke in strokes:
+        # A canvas line at x covers pixels x - 2 .. x + 1; PIL centers its lines on pixel centers
+        points = [tuple(p) for p in (np.round(np.array(stroke)) - 0.5).tolist()]
+        draw.line(points, fill=ink, width=4, joint='curve')
+        for x, y in (points[0], points[-1]):
+            draw.ellipse((x - 2, y - 2, x + 2, y + 2), fill=ink)
+    return image
+
+
+def payload(strokes, size, ink):
+    return {'strokes': encode(strokes), 'canvas': list(size), 'pen': 4, 'ink': '#{:02x}{:02x}{:02x}'.format(*ink)}
+
+
+@pytest.mark.parametrize('canvas', sorted(CANVASES))
+@pytest.mark.parametrize('label', sorted(DRAWINGS))
+def test_image_and_strokes_score_alike(canvas, label):
+    size, ink = CANVASES[canvas]
+    strokes = DRAWINGS[label](*size)
+    from_image = evaluate_with_cnn(canvas_image(strokes, size, ink), label) * SCORE_SCALE
+    from_strokes = evaluate_with_cnn(strokes_to_image(payload(strokes, size, ink)), label) * SCORE_SCALE
+    assert from_strokes == pytest.approx(from_image, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('canvas', sorted(CANVASES))
+def test_reduced_canvas_scores_like_the_full_one(canvas):
+    # Live sessions draw on a smaller copy of the canvas
+    size, ink = CANVASES[canvas]
+    body = payload(DRAWINGS['7'](*size), size, ink)
+    spec = parse_canvas(body)
+    points = decode_strokes(body['strokes'])
+    full = preprocess_uint8(rasterize_strokes(points, spec))
+    reduced = preprocess_uint8(rasterize_strokes(points, spec, reduction(spec)))
+    scores = score_preprocessed(np.stack([full, reduced]), ['7', '7']) * SCORE_SCALE
+    assert scores[1] == pytest.approx(scores[0], abs=TOLERANCE)
+
+
+def test_strokes_need_the_canvas():
+    with pytest.raises(StrokeError):
+        strokes_to_image({'strokes': [[10, 10, 5, 5]]})
+    with pytest.raises(StrokeError):
+        parse_canvas({'canvas': [640, 480], 'ink': 'blue'})
+    with pytest.raises(StrokeError):
+        parse_canvas({'canvas': [0, 480]})
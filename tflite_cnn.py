@@ -0,0 +1,278 @@
+"""
+Quantized TFLite variants of the EMNIST CNN.
+
+    python tflite_cnn.py export int8       # dynamic-range int8 weights  -> emnist_cnn_model.int8.tflite
+    python tflite_cnn.py export float16    # float16 weights             -> emnist_cnn_model.float16.tflite
+    python tflite_cnn.py compare           # parity, stars, latency and memory against the Keras model
+
+Each exported model has two named outputs, 'probabilities' and 'embedding'
+(the penultimate layer), so the reference index works with it too. Select a
+variant per deployment with CNN_BACKEND=tflite and CNN_QUANTIZATION=int8|float16.
+
+The interpreter comes from ai_edge_litert or tflite_runtime when installed
+(no TensorFlow import) and from tf.lite otherwise.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+H5_PATH = 'emnist_cnn_model.h5'
+TFLITE_PATHS = {
+    'int8': 'emnist_cnn_model.int8.tflite',
+    'float16': 'emnist_cnn_model.float16.tflite',
+}
+SIGNATURE = 'serving_default'
+
+# Interpreter threads per request thread; web workers already run many threads
+TFLITE_NUM_THREADS = int(os.environ.get('TFLITE_NUM_THREADS', '1'))
+
+
+def export_tflite(quantization='int8', h5_path=H5_PATH, out_path=None):
+    """Convert the Keras model to a post-training quantized .tflite file."""
+    import tensorflow as tf
+
+    if quantization not in TFLITE_PATHS:
+        raise ValueError(f"Unknown quantization {quantization!r}; expected one of {sorted(TFLITE_PATHS)}")
+    out_path = out_path or TFLITE_PATHS[quantization]
+    model = tf.keras.models.load_model(h5_path)
+    both = tf.keras.Model(inputs=model.inputs,
+                          outputs={'probabilities': model.outputs[0], 'embedding': model.layers[-2].output})
+    converter = tf.lite.TFLiteConverter.from_keras_model(both)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    with open(out_path, 'wb') as f:
+        f.write(converter.convert())
+    return out_path
+
+
+def _interpreter_class():
+    for module in ('ai_edge_litert.interpreter', 'tflite_runtime.interpreter'):
+        try:
+            return importlib.import_module(module).Interpreter
+        except ImportError:
+            pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteCNN:
+    """Keras-style predict() over a .tflite model; each thread gets its own interpreter."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._content = f.read()
+        self.path = path
+        self._interpreter_cls = _interpreter_class()
+        self._local = threading.local()
+        self._runner()  # fail at load time, not on the first request
+
+    def _runner(self):
+        runner = getattr(self._local, 'runner', None)
+        if runner is None:
+            interpreter = self._interpreter_cls(model_content=self._content, num_threads=TFLITE_NUM_THREADS)
+            self._local.input_name = interpreter.get_signature_list()[SIGNATURE]['inputs'][0]
+            runner = self._local.runner = interpreter.get_signature_runner(SIGNATURE)
+        return runner
+
+    def run(self, arr):
+        """Both outputs for a preprocessed (N, 28, 28, 1) array."""
+        runner = self._runner()
+        return runner(**{self._local.input_name: np.asarray(arr, dtype=np.float32)})
+
+    def predict(self, arr, verbose=0):
+        return self.run(arr)['probabilities']
+
+    def get_weights(self):
+        # The flatbuffer holds the (quantized) weights; its size is what the model costs
+        return [np.frombuffer(self._content, dtype=np.uint8)]
+
+    def embedding_model(self):
+        return TFLiteEmbedding(self)
+
+
+class TFLiteEmbedding:
+    """predict()-compatible view of a TFLiteCNN that returns the 'embedding' output."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, arr, verbose=0):
+        return self.model.run(arr)['embedding']
+
+
+MEMORY_PROBE = '''
+import json, sys
+import cnn_evaluator
+cnn_evaluator.warm_up()
+with open('/proc/self/statm') as f:
+    import os
+    rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+print(json.dumps({'process_rss_bytes': rss, 'tensorflow_imported': 'tensorflow' in sys.modules}))
+'''
+
+
+def _process_memory(variant):
+    """Resident size of a fresh process serving one variant (import cost included)."""
+    import subprocess
+
+    backend = {'keras': 'keras', 'numpy': 'numpy'}.get(variant, 'tflite')
+    env = dict(os.environ, CNN_BACKEND=backend, CNN_QUANTIZATION=variant, TF_CPP_MIN_LOG_LEVEL='3',
+               MODEL_RELOAD_INTERVAL='0')
+    env.pop('CNN_TFLITE_PATH', None)
+    out = subprocess.run([sys.executable, '-c', MEMORY_PROBE], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def held_out_drawings(directory=None, samples=500, seed=0):
+    """
+    Preprocessed (N, 28, 28, 1) drawings for the comparison.
+
+    With a directory (e.g. DEBUG_CAPTURE_DIR) every PNG under it is used;
+    otherwise the reference templates plus seeded random rotations, scalings,
+    shifts and stroke-width changes of them.
+    """
+    import cv2
+    from PIL import Image
+    import cnn_evaluator
+    from preprocessing import get_preprocessor
+
+    if directory:
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                       for name in names if name.lower().endswith('.png'))
+        if not paths:
+            raise FileNotFoundError(f"No PNG drawings under {directory}")
+        arrays = []
+        for path in paths:
+            with Image.open(path) as img:
+                arrays.append(cnn_evaluator.preprocess_image(img))
+        return np.concatenate(arrays, axis=0)
+
+    preprocessor = get_preprocessor(28)
+    templates = []
+    for name in sorted(os.listdir(cnn_evaluator.REFERENCE_PATH)):
+        if name.lower().endswith('.png'):
+            with Image.open(os.path.join(cnn_evaluator.REFERENCE_PATH, name)) as img:
+                templates.append(preprocessor.run_uint8(img))
+    rng = np.random.default_rng(seed)
+    drawings = list(templates)
+    kernel = np.ones((2, 2), np.uint8)
+    while len(drawings) < samples:
+        base = templates[rng.integers(len(templates))]
+        matrix = cv2.getRotationMatrix2D((14, 14), rng.uniform(-15, 15), rng.uniform(0.8, 1.1))
+        matrix[:, 2] += rng.uniform(-3, 3, size=2)
+        warped = cv2.warpAffine(base, matrix, (28, 28), borderValue=255)
+        thickness = rng.integers(3)
+        if thickness == 1:
+            warped = cv2.erode(warped, kernel)    # thicker dark strokes
+        elif thickness == 2:
+            warped = cv2.dilate(warped, kernel)   # thinner dark strokes
+        drawings.append(warped)
+    batch = np.stack(drawings[:samples]).astype(np.float32) / 255.0
+    return batch[..., None]
+
+
+def _scaled_scores(preds):
+    """(N, classes) game scores (x SCORE_SCALE) of every drawing against every label."""
+    from cnn_evaluator import SCORE_SCALE, partial_credit_scores
+
+    n, classes = preds.shape
+    return np.stack([partial_credit_scores(preds, np.full(n, label)) for label in range(classes)], axis=1) * SCORE_SCALE
+
+
+def _measure(model, batch, runs=200):
+    single = batch[:1]
+    model.predict(single, verbose=0)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(single, verbose=0)
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    preds = np.asarray(model.predict(batch, verbose=0))
+    batch_seconds = time.perf_counter() - start
+    return preds, {
+        'predict_p50_ms': round(float(np.percentile(times, 50)) * 1000, 4),
+        'predict_p99_ms': round(float(np.percentile(times, 99)) * 1000, 4),
+        'batch_ms_per_image': round(batch_seconds * 1000 / len(batch), 4),
+    }
+
+
+def compare(variants=('int8', 'float16'), drawings_dir=None, samples=500, h5_path=H5_PATH):
+    """Run the Keras model and each variant over the same drawings and report the differences."""
+    from tensorflow.keras.models import load_model
+    from numpy_cnn import NPZ_PATH, NumpyCNN
+    from cnn_evaluator import get_stars
+
+    batch = held_out_drawings(drawings_dir, samples)
+    stars = np.vectorize(get_stars, otypes=[np.int64])
+
+    baseline = load_model(h5_path)
+    expected, baseline_timing = _measure(baseline, batch)
+    expected_scores = _scaled_scores(expected)
+    expected_stars = stars(expected_scores)
+
+    report = {
+        'drawings': int(len(batch)),
+        'source': drawings_dir or 'augmented reference templates',
+        'baseline': dict(baseline_timing, **_process_memory('keras'), variant='keras float32',
+                         file_bytes=os.path.getsize(h5_path)),
+        'variants': {},
+    }
+    for variant in variants:
+        if variant == 'numpy':
+            path = NPZ_PATH
+            model = NumpyCNN(path)
+        else:
+            path = TFLITE_PATHS[variant]
+            model = TFLiteCNN(path)
+        actual, timing = _measure(model, batch)
+        scores = _scaled_scores(actual)
+        variant_stars = stars(scores)
+        changed = variant_stars != expected_stars
+        transitions = {}
+        for before, after in zip(expected_stars[changed], variant_stars[changed]):
+            key = f'{before}->{after}'
+            transitions[key] = transitions.get(key, 0) + 1
+        report['variants'][variant] = dict(
+            timing,
+            **_process_memory(variant),
+            path=path,
+            file_bytes=os.path.getsize(path),
+            top1_agreement=float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()),
+            max_abs_prob_diff=float(np.abs(expected - actual).max()),
+            # Every drawing scored against every label, as /evaluate would for that target
+            scaled_score_mad=float(np.abs(expected_scores - scores).mean()),
+            scaled_score_max_abs_diff=float(np.abs(expected_scores - scores).max()),
+            star_changes=int(changed.sum()),
+            star_change_rate=float(changed.mean()),
+            star_transitions=dict(sorted(transitions.items())),
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='write a quantized .tflite model')
+    export.add_argument('quantization', nargs='?', choices=sorted(TFLITE_PATHS), default='int8')
+    check = commands.add_parser('compare', help='compare quantized variants with the Keras model')
+    check.add_argument('--variants', nargs='+', choices=sorted(TFLITE_PATHS) + ['numpy'], default=['int8', 'float16'])
+    check.add_argument('--drawings', help='directory of PNG drawings to use instead of augmented templates')
+    check.add_argument('--samples', type=int, default=500)
+    args = parser.parse_args()
+    if args.command == 'export':
+        print(f"Wrote {export_tflite(args.quantization)}")
+    else:
+        print(json.dumps(compare(args.variants, args.drawings, args.samples), indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())